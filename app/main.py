@@ -1,4 +1,6 @@
+import json
 import sys
+from contextlib import nullcontext
 from pathlib import Path
 
 PROJECT_ROOT = Path(__file__).resolve().parents[1]
@@ -10,18 +12,258 @@ import pandas as pd
 import folium
 from streamlit_folium import st_folium
 
-from src.layers.polygons import add_food_desert_layer, add_food_swamp_layer, add_county_boundaries, add_pop_weighted_food_desert_layer, add_pop_weighted_food_swamp_layer
-from src.layers.points import add_point_layer
+from src.layers.fragments import FragmentCache
+from src.layers.polygons import (
+    add_choropleth_layer, add_county_boundaries, add_static_choropleth_layer, add_static_county_boundaries,
+)
+from src.layers.styles import CHOROPLETH_LAYERS, COUNTY_CHOROPLETH_LAYERS, COUNTY_ROLLUP_MAX_ZOOM
+from src.layers.points import add_point_layer, add_static_point_layer, POINT_LAYERS, POINT_TOOLTIP_COLUMNS
+from src.layers.heat import add_heat_overlay, add_static_heat_overlay, heat_level_for_zoom, HEAT_LAYERS, HEAT_ZOOMS
+from src.layers.static_assets import STATIC_INDEX
+from src.layers.store import (
+    GeoStore, read_geo_store, concat_geo_stores, tract_layers_name, TRACTS_OBJECT, COUNTIES_OBJECT, BOUNDS_COLUMNS,
+)
+from src.ingest.states import STATES, NC_FIPS, partition_name
+from src.spatial.geometry_optimize import pyramid_level_for_zoom, PYRAMID_ZOOMS
+from src.spatial.viewport import ViewportIndex, bounds_from_folium, padded_view
+from src.metrics.food_swamp import SWAMP_RADII_MI
+from src.metrics.rollup import combine_rollups, level_rows, ROLLUP_LEVELS
+from src.utils.cache import file_sha256
+from src.utils.instrument import collect, measure
+from src.utils.lru import ByteLRU
+from src.utils.arrow_store import ArrowStore
 
 DATA_DIR = Path(__file__).resolve().parents[1] / "data" / "processed"
+# Layer files written by the build's static_layers stage, served by Streamlit
+# (server.enableStaticServing in .streamlit/config.toml) under /app/static/
+STATIC_DIR = Path(__file__).resolve().parent / "static"
+STATIC_LAYERS = "layers"
+MAP_KEY = "map"
+DEFAULT_CENTER = (35.5, -79.0)
+DEFAULT_ZOOM = 7
+LAYER_CACHE_MB = 256
+# State selections whose parsed layers, indexes and tables stay cached. Older
+# entries, including those from before a rebuild, are evicted, which also
+# releases the Arrow snapshot their frames were mapped from.
+CACHED_SELECTIONS = 4
+ROLLUP = "rollup_cube.parquet"
+RANKING_COLUMNS = {
+    "name": "Name", "population": "Population", "desert_severity": "Desert severity", "desert_rank": "Desert rank",
+    "desert_population": "Population in deserts", "swamp_index": "Swamp index", "swamp_rank": "Swamp rank",
+    "swamp_population": "Population in swamps", "healthy_count": "Healthy outlets",
+    "unhealthy_count": "Unhealthy outlets",
+}
 
-@st.cache_data(show_spinner=False)
-def load_parquet(name: str) -> pd.DataFrame:
-    return pd.read_parquet(DATA_DIR / name)
+# Data is partitioned by state (data/processed/state=37/...); every loader takes
+# the selected states as a tuple and reads only those partitions.
+
+def available_states() -> list[str]:
+    # A partition is usable once its last stages have written the map layers
+    required = ["build_manifest.json", *(tract_layers_name(z) for z in PYRAMID_ZOOMS)]
+    found = [p.name.split("=", 1)[1] for p in DATA_DIR.glob("state=*")
+             if all((p / name).exists() for name in required)]
+    return sorted(f for f in found if f in STATES)
+
+def _path(fips: str, name: str) -> Path:
+    return DATA_DIR / partition_name(fips) / name
+
+def _mtimes(states: tuple[str, ...], name: str) -> tuple[int, ...]:
+    return tuple(_path(f, name).stat().st_mtime_ns for f in states)
+
+@st.cache_data(show_spinner=False, max_entries=2 * len(STATES))
+def _manifest_hash(fips: str, mtime: int) -> str:
+    # `mtime` is only the cache key: the manifest is re-hashed once it is rewritten
+    return file_sha256(_path(fips, "build_manifest.json"))
+
+def data_version(states: tuple[str, ...]) -> tuple[str, ...]:
+    # The build manifest records the hash of every output, so it changes exactly
+    # when a rebuild changed something; a no-op rebuild keeps cached layers warm.
+    return tuple(_manifest_hash(f, _path(f, "build_manifest.json").stat().st_mtime_ns) for f in states)
+
+@st.cache_resource(show_spinner=False)
+def data_store() -> ArrowStore:
+    return ArrowStore(max_snapshots=CACHED_SELECTIONS)
+
+def load_table(states: tuple[str, ...], name: str) -> pd.DataFrame:
+    # Memory-mapped once per process and build version, and shared by every
+    # session without copies: treat the frame as read-only.
+    return data_store().snapshot(states, data_version(states), [DATA_DIR / partition_name(f) for f in states]).frame(name)
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_SELECTIONS * len(PYRAMID_ZOOMS) * 2)
+def _load_geo_store(states: tuple[str, ...], name: str, obj: str, mtimes: tuple[int, ...]) -> GeoStore:
+    return concat_geo_stores([read_geo_store(_path(f, name), obj) for f in states])
+
+def load_geo_store(states: tuple[str, ...], name: str, obj: str = TRACTS_OBJECT) -> GeoStore:
+    # Parsed once per process and shared by every session; the files' mtimes are
+    # part of the key so a rebuild is picked up without restarting the server.
+    return _load_geo_store(states, name, obj, _mtimes(states, name))
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_SELECTIONS * len(PYRAMID_ZOOMS) * 2)
+def _geo_index(states: tuple[str, ...], name: str, obj: str, mtimes: tuple[int, ...]) -> ViewportIndex:
+    return ViewportIndex.from_bounds(_load_geo_store(states, name, obj, mtimes).frame[BOUNDS_COLUMNS])
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_SELECTIONS * len(POINT_LAYERS))
+def _point_index(states: tuple[str, ...], name: str, version: tuple[str, ...]) -> ViewportIndex:
+    return ViewportIndex.from_points(load_table(states, name))
+
+def geo_store_in_view(states: tuple[str, ...], name: str, view, obj: str = TRACTS_OBJECT) -> GeoStore:
+    store = load_geo_store(states, name, obj)
+    if view is None:
+        return store
+    return store.with_features(_geo_index(states, name, obj, _mtimes(states, name)).query(view))
+
+def points_in_view(states: tuple[str, ...], name: str, view) -> pd.DataFrame:
+    df = load_table(states, name)
+    if view is None:
+        return df
+    return df.iloc[_point_index(states, name, data_version(states)).query(view)]
+
+@st.cache_resource(show_spinner=False, max_entries=CACHED_SELECTIONS)
+def _rollup_cube(states: tuple[str, ...], version: tuple[str, ...]) -> pd.DataFrame:
+    cube = load_table(states, ROLLUP)
+    return cube if len(states) == 1 else combine_rollups(cube)
+
+def rollup_cube(states: tuple[str, ...]) -> pd.DataFrame | None:
+    """The build's rollup cube for the selected states; regions spanning states are summed once per build."""
+    if not all(_path(f, ROLLUP).exists() for f in states):
+        return None
+    return _rollup_cube(states, data_version(states))
+
+def show_rankings(cube: pd.DataFrame):
+    with st.expander("Rankings"):
+        levels = [l for l in ROLLUP_LEVELS if l != "tract" and len(level_rows(cube, l))]
+        level = st.radio("Level", levels, horizontal=True, format_func=str.capitalize)
+        rows = level_rows(cube, level).sort_values(["desert_rank", "swamp_rank"])
+        st.dataframe(rows[list(RANKING_COLUMNS)].rename(columns=RANKING_COLUMNS), hide_index=True,
+                     use_container_width=True)
+        st.caption("Severity and swamp index are population-weighted averages over tracts; rank 1 is the worst.")
+
+@st.cache_resource(show_spinner=False)
+def layer_cache() -> ByteLRU:
+    # Serialised layer payloads, shared by every session in this process
+    return ByteLRU(LAYER_CACHE_MB * 2**20)
+
+@st.cache_data(show_spinner=False, max_entries=CACHED_SELECTIONS * len(HEAT_ZOOMS) * len(HEAT_LAYERS))
+def _load_heat(fips: str, layer: str, zoom: int, mtime: int) -> tuple[bytes, list] | None:
+    levels = json.loads(_path(fips, "heat_layers.json").read_text()).get(layer, {})
+    level = levels.get(str(zoom))
+    if level is None:
+        return None
+    return _path(fips, level["file"]).read_bytes(), level["bounds"]
+
+def _static_files(index: dict) -> list[str]:
+    files = [name for level in index["levels"].values() for name in level.values()]
+    files += index["points"].values()
+    files += [level["file"] for zooms in index["heat"].values() for level in zooms.values()]
+    return files
+
+@st.cache_data(show_spinner=False, max_entries=2 * len(STATES))
+def _load_static_index(fips: str, mtime: int) -> dict | None:
+    index = json.loads(_path(fips, STATIC_INDEX).read_text())
+    folder = STATIC_DIR / STATIC_LAYERS / partition_name(fips)
+    # The files live outside the partition, so check they are still there
+    if not all((folder / name).exists() for name in _static_files(index)):
+        return None
+    return index
+
+def static_indexes(states: tuple[str, ...]) -> dict[str, dict] | None:
+    """Each state's static layer index, or None unless every state has its files and they are served."""
+    if not st.get_option("server.enableStaticServing"):
+        return None
+    indexes = {}
+    for f in states:
+        path = _path(f, STATIC_INDEX)
+        index = _load_static_index(f, path.stat().st_mtime_ns) if path.exists() else None
+        if index is None:
+            return None
+        indexes[f] = index
+    return indexes
+
+def static_url(fips: str, name: str) -> str:
+    base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    return "/" + "/".join(p for p in (base, "app/static", STATIC_LAYERS, partition_name(fips), name) if p)
+
+def add_heat_layer(m: folium.Map, states: tuple[str, ...], layer: str, zoom: int, static: dict | None = None):
+    # One pre-rendered image per state, grouped so the layer control shows one entry
+    group = folium.FeatureGroup(name=HEAT_LAYERS[layer])
+    for f in states:
+        if static is not None:
+            level = static[f]["heat"][layer].get(str(zoom))
+            if level is not None:
+                add_static_heat_overlay(group, static_url(f, level["file"]), level["bounds"], name=HEAT_LAYERS[layer])
+            continue
+        manifest = _path(f, "heat_layers.json")
+        if not manifest.exists():
+            continue
+        heat = _load_heat(f, layer, zoom, manifest.stat().st_mtime_ns)
+        if heat is not None:
+            add_heat_overlay(group, *heat, name=HEAT_LAYERS[layer])
+    group.add_to(m)
+
+def show_diagnostics_panel(timings, states: tuple[str, ...]):
+    with st.expander("Diagnostics", expanded=True):
+        st.markdown("**This rerun**")
+        st.dataframe(pd.DataFrame([
+            {"step": t.name, "ms": round(t.seconds * 1000, 1), "rows": t.rows,
+             "payload KB": None if t.bytes is None else round(t.bytes / 1024, 1)}
+            for t in timings
+        ]), hide_index=True, use_container_width=True)
+        cache = layer_cache().stats()
+        st.caption(
+            f"Layer cache: {cache.entries} layers, {cache.bytes / 2**20:.1f} of {cache.max_bytes / 2**20:.0f} MB, "
+            f"{cache.hits} hits / {cache.misses} misses, {cache.evictions} evicted (all sessions)"
+        )
+        for f in states:
+            run_log = _path(f, "build_run.json")
+            if not run_log.exists():
+                continue
+            run = json.loads(run_log.read_text())
+            st.markdown(f"**Last build of {STATES[f][1]}** ({run.get('finished', 'unfinished')})")
+            rows = []
+            for name, entry in run["stages"].items():
+                # skipped stages show the numbers from the run that built them
+                r = entry.get("last_run") or entry
+                rows.append({
+                    "stage": name, "status": entry["status"], "s": r.get("seconds"), "rows": r.get("rows"),
+                    "MB written": None if r.get("bytes") is None else round(r["bytes"] / 2**20, 2),
+                    "peak RSS MB": r.get("max_rss_mb"), "traced peak MB": r.get("traced_peak_mb"),
+                })
+            st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+def current_view(default_center: tuple[float, float]):
+    # st_folium stores what the browser last reported under its key
+    state = st.session_state.get(MAP_KEY) or {}
+    center = state.get("center") or {}
+    zoom = int(state.get("zoom") or DEFAULT_ZOOM)
+    bbox = bounds_from_folium(state.get("bounds"))
+    if "lat" in center and "lng" in center:
+        return (center["lat"], center["lng"]), zoom, bbox
+    return default_center, zoom, bbox
+
+def _reset_view():
+    st.session_state.pop(MAP_KEY, None)
 
 def main():
-    st.set_page_config(page_title="NC Food Environment Map", layout="wide")
-    st.title("North Carolina Food Environment Map")
+    st.set_page_config(page_title="Food Environment Map", layout="wide")
+
+    built = available_states()
+    if not built:
+        st.error("No built states found in data/processed. Run scripts/build_nc_layers.py first.")
+        return
+    states = tuple(st.sidebar.multiselect(
+        "States",
+        built,
+        default=[NC_FIPS] if NC_FIPS in built else built[:1],
+        format_func=lambda f: STATES[f][1],
+        on_change=_reset_view,
+    ))
+    if not states:
+        st.info("Select at least one state.")
+        return
+    if len(states) == 1:
+        st.title(f"{STATES[states[0]][1]} Food Environment Map")
+    else:
+        st.title("Food Environment Map")
 
     st.sidebar.header("Layers")
     show_deserts = st.sidebar.checkbox("Food deserts (polygons)", value=True)
@@ -31,44 +273,173 @@ def main():
     show_counties = st.sidebar.checkbox("County boundaries", value=False)
     show_pop_weighted_desert = st.sidebar.checkbox("Food deserts (population-weighted)", value=False)
     show_pop_weighted_swamp = st.sidebar.checkbox("Food swamps (population-weighted)", value=False)
+    show_distance = st.sidebar.checkbox("Distance to nearest supermarket", value=False)
+    show_desert_heat = st.sidebar.checkbox("Food deserts (heatmap)", value=False)
+    show_swamp_heat = st.sidebar.checkbox("Food swamps (heatmap)", value=False)
+    show_radius_swamp = st.sidebar.checkbox("Food swamps (within a radius)", value=False)
+    swamp_radius = st.sidebar.select_slider(
+        "Swamp radius (miles)",
+        options=list(SWAMP_RADII_MI),
+        value=SWAMP_RADII_MI[0],
+        disabled=not show_radius_swamp,
+        help="Counts outlets within this distance of each tract's centroid instead of inside its boundary.",
+    )
+    county_rollups = st.sidebar.checkbox(
+        "County averages when zoomed out",
+        value=True,
+        help=f"At zoom {COUNTY_ROLLUP_MAX_ZOOM} and below, the desert and swamp layers show one polygon per "
+             "county from the build's rollup cube instead of every tract.",
+    )
+
+    st.sidebar.header("Performance")
+    indexes = static_indexes(states)
+    static_mode = st.sidebar.checkbox(
+        "Static layer files (browser-cached)",
+        value=indexes is not None,
+        disabled=indexes is None,
+        help="The map references each layer's file by URL instead of embedding its data, so the browser "
+             "downloads it once and caches it, and toggling layers only re-sends the map itself. "
+             "Needs a build with the static_layers stage and server.enableStaticServing.",
+    )
+    static = indexes if static_mode else None
+    viewport_mode = st.sidebar.checkbox(
+        "Viewport mode (only send features in view)",
+        value=False,
+        disabled=static is not None,
+        help="Sends only tracts and outlets inside the visible map area plus a margin. "
+             "Panning past the margin reloads the layers for the new area. Not used with static layer files, "
+             "which always hold whole states.",
+    ) and static is None
+    show_diagnostics = st.sidebar.checkbox(
+        "Diagnostics",
+        value=False,
+        help="Time each layer and size its payload on this rerun, and show the last build's stage timings.",
+    )
+
+    # Default view: NC's usual framing, or the middle of whatever is selected
+    if states == (NC_FIPS,):
+        home = DEFAULT_CENTER
+    else:
+        w, s, e, n = load_geo_store(states, tract_layers_name(min(PYRAMID_ZOOMS)), COUNTIES_OBJECT).total_bounds()
+        home = ((s + n) / 2, (w + e) / 2)
+
+    center, zoom, bbox = current_view(home)
+    level = pyramid_level_for_zoom(zoom)
+    view = padded_view(bbox) if viewport_mode and bbox is not None else None
+    cache = FragmentCache(layer_cache(), (data_version(states), states, level, view))
+    cube = rollup_cube(states)
+    county_view = (
+        county_rollups and zoom <= COUNTY_ROLLUP_MAX_ZOOM and cube is not None
+        and (static is None or all("county_desert" in static[f]["levels"][str(level)] for f in states))
+    )
+
+    def level_urls(key: str) -> list[str]:
+        return [static_url(f, static[f]["levels"][str(level)][key]) for f in states]
+
+    def choropleth(key: str):
+        if county_view and key in COUNTY_CHOROPLETH_LAYERS:
+            spec = COUNTY_CHOROPLETH_LAYERS[key]
+            if static is not None:
+                add_static_choropleth_layer(m, level_urls(f"county_{key}"), spec, COUNTIES_OBJECT)
+            else:
+                counties = geo_store_in_view(states, tract_layers_name(level), view, COUNTIES_OBJECT)
+                if counties.geometries:
+                    add_choropleth_layer(m, counties, spec, cache)
+        elif static is not None:
+            add_static_choropleth_layer(m, level_urls(key), CHOROPLETH_LAYERS[key])
+        elif tracts.geometries:
+            add_choropleth_layer(m, tracts, CHOROPLETH_LAYERS[key], cache)
+
+    def points(key: str, name: str):
+        layer = POINT_LAYERS[key]
+        if static is not None:
+            add_static_point_layer(m, [static_url(f, static[f]["points"][key]) for f in states], layer.name, layer.color)
+        else:
+            add_point_layer(m, points_in_view(states, name, view), layer.name, tooltip_cols=POINT_TOOLTIP_COLUMNS,
+                            color=layer.color, cache=cache)
+
+    # Sizing each payload costs a JSON dump per layer, so only when asked for
+    with collect() if show_diagnostics else nullcontext([]) as timings:
+        m = folium.Map(location=list(home), zoom_start=DEFAULT_ZOOM, tiles="CartoDB positron")
+        tracts = None
+        if static is None:
+            with measure("load tracts"):
+                tracts = geo_store_in_view(states, tract_layers_name(level), view)
+
+        if show_desert_heat:
+            add_heat_layer(m, states, "desert", heat_level_for_zoom(zoom), static)
+
+        if show_swamp_heat:
+            add_heat_layer(m, states, "swamp", heat_level_for_zoom(zoom), static)
+
+        if show_deserts:
+            choropleth("desert")
+
+        if show_swamps:
+            choropleth("swamp")
 
+        if show_healthy:
+            points("healthy", "healthy_food.parquet")
 
-    m = folium.Map(location=[35.5, -79.0], zoom_start=7, tiles="CartoDB positron")
-    tracts_geojson = DATA_DIR / "nc_tracts.geojson"
+        if show_unhealthy:
+            points("unhealthy", "unhealthy_food.parquet")
 
-    if show_deserts:
-        desert = load_parquet("food_desert_scores.parquet")
-        add_food_desert_layer(m, tracts_geojson, desert)
+        if show_counties:
+            if static is not None:
+                add_static_county_boundaries(m, level_urls("counties"))
+            else:
+                counties = geo_store_in_view(states, tract_layers_name(level), view, COUNTIES_OBJECT)
+                if counties.geometries:
+                    add_county_boundaries(m, counties, cache)
 
-    if show_swamps:
-        swamp = load_parquet("food_swamp_scores.parquet")
-        add_food_swamp_layer(m, tracts_geojson, swamp)
+        if show_pop_weighted_desert:
+            choropleth("pop_weighted_desert")
 
-    if show_healthy:
-        healthy = load_parquet("healthy_food.parquet")
-        add_point_layer(m, healthy, "Healthy outlets", tooltip_cols=["name", "outlet_type"], color="#1a9850")
+        if show_pop_weighted_swamp:
+            choropleth("pop_weighted_swamp")
 
-    if show_unhealthy:
-        unhealthy = load_parquet("unhealthy_food.parquet")
-        add_point_layer(m, unhealthy, "Unhealthy outlets", tooltip_cols=["name", "outlet_type"], color="#f46d43")
+        if show_distance:
+            choropleth("supermarket_distance")
 
-    if show_counties:
-        add_county_boundaries(m, DATA_DIR / "nc_counties.geojson")
+        if show_radius_swamp:
+            choropleth(f"swamp_within_{swamp_radius:g}mi")
 
-    
-    if show_pop_weighted_desert:
-        df = load_parquet("food_desert_population_weighted.parquet")
-        add_pop_weighted_food_desert_layer(m, tracts_geojson, df)
+        folium.LayerControl(collapsed=False).add_to(m)
+        # Only view changes rerun the script: zoom picks the geometry level, bounds
+        # drive viewport mode, and zoom/center are passed back so the user's view
+        # survives a re-render. That means every pan reruns too, in both modes:
+        # without the center, the next zoom would re-render at a stale one.
+        # Outside viewport mode the layer payloads come from the fragment cache,
+        # so such a rerun only rebuilds the map shell.
+        returned = ["zoom", "center", "bounds"] if viewport_mode else ["zoom", "center"]
+        with measure("st_folium (render + send)"):
+            st_folium(
+                m,
+                key=MAP_KEY,
+                zoom=zoom,
+                center=center,
+                returned_objects=returned,
+                use_container_width=True,
+                height=720,
+            )
+    caption = f"Tract geometry level: z{level} (current zoom {zoom})"
+    if county_view:
+        caption += " · desert and swamp layers show county averages"
+    if view is not None:
+        caption += f" · {len(tracts.geometries)} tracts in view"
+    st.caption(caption)
 
-    if show_pop_weighted_swamp:
-        df = load_parquet("food_swamp_population_weighted.parquet")
-        add_pop_weighted_food_swamp_layer(m, tracts_geojson, df)
+    if cube is not None:
+        show_rankings(cube)
 
-    folium.LayerControl(collapsed=False).add_to(m)
-    st_folium(m, use_container_width=True, height=720)
+    if show_diagnostics:
+        show_diagnostics_panel(timings, states)
 
     with st.expander("Artifacts found in data/processed"):
-        st.write(sorted([p.name for p in DATA_DIR.glob("*") if p.is_file()]))
+        st.write({
+            partition_name(f): sorted(p.name for p in (DATA_DIR / partition_name(f)).glob("*") if p.is_file())
+            for f in states
+        })
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,286 @@
+"""
+Offline benchmarks for the build and map hot paths on synthetic data.
+
+    python scripts/benchmark.py                      # NC scale (~2.6k tracts)
+    python scripts/benchmark.py --scale national     # ~85k tracts
+    python scripts/benchmark.py --tracts 10000 --outlets 20000
+    python scripts/benchmark.py --baseline data/benchmarks/benchmark_nc.json
+
+Fixtures are generated in memory (tract polygons with wiggly, many-vertex
+edges and uniformly scattered outlets), so nothing touches the network.
+"""
+from __future__ import annotations
+from pathlib import Path
+import argparse
+import json
+import platform
+import sys
+import time
+import warnings
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+import folium
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from src.spatial.geometry_optimize import simplify_shared_borders, topology_pyramid, PYRAMID_ZOOMS
+from src.spatial.tract_joins import points_to_gdf, spatial_join_points_to_tracts, locate_points
+from src.spatial.dedup import dedupe_outlets
+from src.spatial.centroids import tract_centroids
+from src.metrics.food_desert import compute_food_desert_scores
+from src.metrics.food_swamp import compute_food_swamp_index, compute_radius_swamp_index
+from src.metrics.food_access import compute_supermarket_access
+from src.metrics.tract_scores import merge_tract_scores
+from src.layers.styles import add_style_columns, CHOROPLETH_LAYERS
+from src.layers.store import geo_store_from_topology, TRACTS_OBJECT, COUNTIES_OBJECT
+from src.layers.polygons import add_choropleth_layer, add_county_boundaries
+from src.layers.points import add_point_layer
+from src.layers.fragments import FragmentCache
+from src.utils.lru import ByteLRU
+
+SCALES = {
+    # tracts, healthy outlets (unhealthy is 2×)
+    "nc": (2_600, 2_000),
+    "national": (85_000, 60_000),
+}
+# NC-ish extent; national fixtures keep the same density over a larger area
+ORIGIN = (-84.0, 34.0)
+TRACT_DEGREES = 0.08
+VERTICES_PER_EDGE = 24
+SIMPLIFY_TOLERANCE = 0.001
+OUT_DIR = PROJECT_ROOT / "data" / "benchmarks"
+
+
+def make_tracts(n: int, vertices_per_edge: int = VERTICES_PER_EDGE, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    A near-square grid of `n` tract polygons. Edge vertices are displaced by a
+    smooth function of their position, so neighbours share the same wiggly
+    boundary and simplification has real work to do.
+    """
+    cols = int(np.ceil(np.sqrt(n)))
+    i = np.arange(n)
+    x0 = ORIGIN[0] + (i % cols) * TRACT_DEGREES
+    y0 = ORIGIN[1] + (i // cols) * TRACT_DEGREES
+
+    t = np.linspace(0.0, 1.0, vertices_per_edge, endpoint=False)
+    # Unit-square ring, counter-clockwise from the south-west corner
+    ux = np.r_[t, np.ones_like(t), 1 - t, np.zeros_like(t), 0.0]
+    uy = np.r_[np.zeros_like(t), t, np.ones_like(t), 1 - t, 0.0]
+    x = x0[:, None] + ux[None, :] * TRACT_DEGREES
+    y = y0[:, None] + uy[None, :] * TRACT_DEGREES
+    amp = TRACT_DEGREES * 0.04
+    dx = amp * np.sin(y * 157.0) * np.cos(x * 61.0)
+    dy = amp * np.sin(x * 149.0) * np.cos(y * 67.0)
+    rings = np.stack([x + dx, y + dy], axis=-1)
+
+    counties = (i // 25) % 1000
+    geoids = [f"37{c:03d}{k:06d}" for c, k in zip(counties, i)]
+    return gpd.GeoDataFrame(
+        {"GEOID": geoids, "NAME": geoids, "COUNTYFP": [g[2:5] for g in geoids], "STATEFP": "37",
+         "population": np.random.default_rng(seed).integers(0, 8000, n)},
+        geometry=shapely.polygons(rings),
+        crs="EPSG:4326",
+    )
+
+
+def make_outlets(tracts: gpd.GeoDataFrame, n: int, outlet_type: str, seed: int) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    w, s, e, nn = tracts.total_bounds
+    return pd.DataFrame({
+        "name": [f"{outlet_type} {k}" for k in range(n)],
+        "lat": rng.uniform(s, nn, n),
+        "lon": rng.uniform(w, e, n),
+        "outlet_type": outlet_type,
+        "osm_id": [f"node/{seed}{k}" for k in range(n)],
+    })
+
+
+def make_usda(tracts: gpd.GeoDataFrame, seed: int = 3) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    n = len(tracts)
+    df = pd.DataFrame({"CensusTract": tracts["GEOID"].astype("int64")})
+    for c in ("LILATracts_1And10", "LILATracts_halfAnd10", "LILATracts_1And20", "LowAccessTracts"):
+        df[c] = rng.integers(0, 2, n).astype(float)
+    return df
+
+
+def timed(results: dict, name: str, fn, repeat: int):
+    """Run `fn` `repeat` times, record best and mean seconds, return its last result."""
+    runs = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        runs.append(time.perf_counter() - t0)
+    results[name] = {"best_s": round(min(runs), 5), "mean_s": round(sum(runs) / len(runs), 5), "repeat": repeat}
+    print(f"  {name:<34} {min(runs) * 1000:10.1f} ms")
+    return out
+
+
+def _map() -> folium.Map:
+    return folium.Map(location=[35.5, -79.0], zoom_start=7, tiles="CartoDB positron")
+
+
+def _html_bytes(m: folium.Map) -> int:
+    return len(m.get_root().render().encode("utf-8"))
+
+
+def run(n_tracts: int, n_healthy: int, repeat: int) -> dict:
+    timings: dict = {}
+    sizes: dict = {}
+
+    print(f"Generating fixtures: {n_tracts:,} tracts, {n_healthy:,} healthy / {2 * n_healthy:,} unhealthy outlets")
+    tracts = make_tracts(n_tracts)
+    healthy = make_outlets(tracts, n_healthy, "healthy", seed=1)
+    unhealthy = make_outlets(tracts, 2 * n_healthy, "unhealthy", seed=2)
+    usda = make_usda(tracts)
+    sizes["tract_vertices"] = int(shapely.get_num_coordinates(tracts.geometry.values).sum())
+
+    print("Build hot paths")
+    simplified = timed(timings, "simplify_shared_borders",
+                       lambda: simplify_shared_borders(tracts, SIMPLIFY_TOLERANCE), repeat)
+    timed(timings, "spatial_join_points_to_tracts",
+          lambda: spatial_join_points_to_tracts(points_to_gdf(healthy), simplified), repeat)
+    # What the build does: one batched STRtree query against the full-resolution tracts
+    geoid_h = timed(timings, "locate_points",
+                    lambda: locate_points(healthy["lon"].to_numpy(), healthy["lat"].to_numpy(), tracts), repeat)
+    timed(timings, "dedupe_outlets", lambda: dedupe_outlets(unhealthy), repeat)
+    joined_h = healthy.assign(GEOID=geoid_h)
+    joined_u = unhealthy.assign(GEOID=locate_points(unhealthy["lon"].to_numpy(), unhealthy["lat"].to_numpy(), tracts))
+    desert = timed(timings, "compute_food_desert_scores", lambda: compute_food_desert_scores(usda), repeat)
+    swamp = timed(timings, "compute_food_swamp_index", lambda: compute_food_swamp_index(joined_h, joined_u), repeat)
+    cents = tract_centroids(simplified)
+    access = timed(timings, "compute_supermarket_access", lambda: compute_supermarket_access(cents, healthy), repeat)
+    swamp_radius = timed(timings, "compute_radius_swamp_index",
+                         lambda: compute_radius_swamp_index(cents, healthy, unhealthy), repeat)
+
+    desert_pop = desert.merge(tracts[["GEOID", "population"]], on="GEOID")
+    desert_pop["pop_weighted_desert"] = desert_pop["desert_severity"] * desert_pop["population"]
+    swamp_pop = swamp.merge(tracts[["GEOID", "population"]], on="GEOID")
+    swamp_pop["pop_weighted_swamp"] = swamp_pop["swamp_index"] * swamp_pop["population"]
+    attrs = pd.DataFrame(tracts.drop(columns="geometry"))
+    scored = merge_tract_scores(attrs, desert, desert_pop, swamp, swamp_pop, access, swamp_radius)
+    scored, _ = timed(timings, "add_style_columns", lambda: add_style_columns(scored), repeat)
+
+    pyramid = timed(timings, "topology_pyramid",
+                    lambda: topology_pyramid(tracts[["GEOID", "COUNTYFP", "geometry"]], scored), repeat)
+    sizes["pyramid_bytes"] = {str(z): len(json.dumps(t, separators=(",", ":"))) for z, t in pyramid.items()}
+    # The app's statewide view draws the coarsest pyramid level
+    level = pyramid[min(PYRAMID_ZOOMS)]
+    store = timed(timings, "geo_store", lambda: geo_store_from_topology(level, TRACTS_OBJECT), repeat)
+    counties = geo_store_from_topology(level, COUNTIES_OBJECT)
+
+    print("Map layers (build + render, one layer per map)")
+    for key, spec in CHOROPLETH_LAYERS.items():
+        def layer(spec=spec):
+            m = _map()
+            add_choropleth_layer(m, store, spec)
+            return _html_bytes(m)
+        sizes[f"html_bytes.{key}"] = timed(timings, f"layer.{key}", layer, repeat)
+
+    def county_layer():
+        m = _map()
+        add_county_boundaries(m, counties)
+        return _html_bytes(m)
+    sizes["html_bytes.counties"] = timed(timings, "layer.counties", county_layer, repeat)
+
+    def points_layer():
+        m = _map()
+        add_point_layer(m, joined_h, "Healthy outlets", tooltip_cols=["name", "outlet_type"], color="#1a9850")
+        return _html_bytes(m)
+    sizes["html_bytes.healthy_points"] = timed(timings, "add_point_layer", points_layer, repeat)
+
+    def default_map():
+        # What the app renders on first load: desert polygons + healthy outlets
+        m = _map()
+        add_choropleth_layer(m, store, CHOROPLETH_LAYERS["desert"])
+        add_point_layer(m, joined_h, "Healthy outlets", tooltip_cols=["name", "outlet_type"], color="#1a9850")
+        folium.LayerControl(collapsed=False).add_to(m)
+        return _html_bytes(m)
+    sizes["html_bytes.default_map"] = timed(timings, "default_map_html", default_map, repeat)
+
+    # The same map again with its layer payloads already in the app's LRU
+    cache = FragmentCache(ByteLRU(256 * 2**20), ("benchmark", min(PYRAMID_ZOOMS)))
+    def default_map_cached():
+        m = _map()
+        add_choropleth_layer(m, store, CHOROPLETH_LAYERS["desert"], cache)
+        add_point_layer(m, joined_h, "Healthy outlets", tooltip_cols=["name", "outlet_type"], color="#1a9850",
+                        cache=cache)
+        folium.LayerControl(collapsed=False).add_to(m)
+        return _html_bytes(m)
+    default_map_cached()
+    timed(timings, "default_map_html_cached", default_map_cached, repeat)
+
+    return {"timings": timings, "sizes": sizes}
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Names of timings more than `tolerance`× slower than the baseline's."""
+    slower = []
+    for name, t in results["timings"].items():
+        base = baseline.get("timings", {}).get(name)
+        if base and base["best_s"] > 0 and t["best_s"] > tolerance * base["best_s"]:
+            slower.append(f"{name}: {base['best_s'] * 1000:.1f} ms -> {t['best_s'] * 1000:.1f} ms")
+    return slower
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark build and map hot paths on synthetic data (offline).")
+    p.add_argument("--scale", choices=sorted(SCALES), default="nc")
+    p.add_argument("--tracts", type=int, help="Override the number of tracts.")
+    p.add_argument("--outlets", type=int, help="Override the number of healthy outlets (unhealthy is 2x).")
+    p.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the best is reported.")
+    p.add_argument("--out", type=Path, help="JSON results path (default data/benchmarks/benchmark_<scale>.json).")
+    p.add_argument("--baseline", type=Path, help="Earlier results to compare against; exits 1 on regressions.")
+    p.add_argument("--tolerance", type=float, default=1.25, help="Slowdown factor counted as a regression.")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Centroids of lat/lon fixtures and folium deprecations are expected noise here
+    warnings.simplefilter("ignore", UserWarning)
+    warnings.simplefilter("ignore", FutureWarning)
+    n_tracts, n_healthy = SCALES[args.scale]
+    n_tracts = args.tracts or n_tracts
+    n_healthy = args.outlets or n_healthy
+    label = args.scale if not (args.tracts or args.outlets) else f"{n_tracts}t_{n_healthy}o"
+
+    results = {
+        "scale": label,
+        "tracts": n_tracts,
+        "healthy_outlets": n_healthy,
+        "unhealthy_outlets": 2 * n_healthy,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "geopandas": gpd.__version__,
+            "shapely": shapely.__version__,
+            "folium": folium.__version__,
+        },
+        **run(n_tracts, n_healthy, max(args.repeat, 1)),
+    }
+
+    out = args.out or OUT_DIR / f"benchmark_{label}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(results, indent=2))
+    print(f"\nWrote {out}")
+
+    if args.baseline:
+        slower = compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+        if slower:
+            print(f"Regressions (>{args.tolerance:g}x slower than {args.baseline}):")
+            for line in slower:
+                print(f"  {line}")
+            raise SystemExit(1)
+        print(f"No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
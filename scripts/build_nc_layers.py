@@ -1,58 +1,229 @@
 from __future__ import annotations
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
+from functools import partial
+import argparse
+import json
+import os
+import sys
 
-from src.ingest.fetch_census_tracts import load_nc_tracts_gdf
-from src.ingest.fetch_usda_food_access import load_usda_food_access
-from src.ingest.fetch_osm_outlets import fetch_healthy_outlets, fetch_unhealthy_outlets
-from src.ingest.fetch_nc_counties import load_nc_counties
-from src.ingest.fetch_population import fetch_nc_tract_population
-from src.spatial.geometry_optimize import simplify_polygons, drop_large_columns
-from src.spatial.tract_joins import points_to_gdf, spatial_join_points_to_tracts
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.append(str(PROJECT_ROOT))
+
+import geopandas as gpd
+import pandas as pd
+
+from src.ingest.fetch_census_tracts import load_tracts_gdf
+from src.ingest.fetch_usda_food_access import load_usda_food_access, usda_parquet, DEFAULT_LOCAL_NAME
+from src.ingest.fetch_osm_outlets import fetch_healthy_outlets, fetch_unhealthy_outlets, BoundingBox, NC_BBOX
+from src.ingest.fetch_nc_counties import load_counties, state_bounds
+from src.ingest.fetch_population import fetch_tract_population
+from src.ingest.states import STATES, NC_FIPS, parse_states, partition_name
+from src.ingest.scheduler import run_concurrently
+from src.spatial.geometry_optimize import simplify_shared_borders, topology_pyramid, drop_large_columns, PYRAMID_ZOOMS
+from src.spatial.tract_joins import assign_tracts_cached
+from src.spatial.dedup import dedupe_outlets, DEDUP_DISTANCE_M
 from src.spatial.centroids import tract_centroids
-from src.metrics.food_desert import compute_food_desert_scores
-from src.metrics.food_swamp import compute_food_swamp_index
-from src.metrics.nutrition import compute_nutrition_scores_stub
+from src.spatial.road_network import load_road_graph
+from src.metrics.food_desert import compute_food_desert_scores, DRIVE_LOW_ACCESS_MINUTES
+from src.metrics.drive_time import compute_drive_times, DRIVE_CUTOFF_MINUTES
+from src.metrics.food_swamp import compute_food_swamp_index, compute_radius_swamp_index, SWAMP_RADII_MI
+from src.metrics.food_access import compute_supermarket_access, ACCESS_RADII_MI
+from src.metrics.nutrition import compute_nutrition_scores, inventory_signature, INVENTORY_CHUNK_ROWS
+from src.metrics.tract_scores import merge_tract_scores
+from src.metrics.rollup import tract_measures, assign_regions, build_rollup, level_rows, SWAMP_AFFECTED_INDEX
+from src.layers.store import tract_layers_name
+from src.layers.styles import add_style_columns, CHOROPLETH_LAYERS, COUNTY_CHOROPLETH_LAYERS
+from src.layers.points import POINT_TOOLTIP_COLUMNS
+from src.layers.static_assets import publish_static_layers, STATIC_INDEX
+from src.layers.heat import build_heat_rasters, heat_png_name, HEAT_LAYERS, HEAT_ZOOMS, HEAT_CELL_PIXELS, HEAT_SIGMA_CELLS
+from src.utils.pipeline import Stage, run_pipeline
+from src.utils.cache import file_sha256
+from src.utils.arrow_store import write_arrow_copy, arrow_path
 
-PROJECT_ROOT = Path(__file__).resolve().parents[1]
 RAW_CACHE = PROJECT_ROOT / "data" / "raw" / "cache"
+INTERIM = PROJECT_ROOT / "data" / "interim"
 PROCESSED = PROJECT_ROOT / "data" / "processed"
+# Served by Streamlit at /app/static/layers/... (server.enableStaticServing)
+STATIC_LAYERS = PROJECT_ROOT / "app" / "static" / "layers"
 
-def main():
-    PROCESSED.mkdir(parents=True, exist_ok=True)
-    RAW_CACHE.mkdir(parents=True, exist_ok=True)
-
-    print("1) Fetching NC census tracts…")
-    tracts = load_nc_tracts_gdf(RAW_CACHE)
-
-    print("2) Fetching ACS population data…")
-    pop_df = fetch_nc_tract_population()
-    pop_path = PROCESSED / "tract_population.parquet"
-    pop_df.to_parquet(pop_path, index=False)
-    print(f"   wrote {pop_path}")
-
-
-    print("3) Simplifying tract geometries (offline)…")
-    tracts_s = simplify_polygons(tracts, tolerance=0.001)
+SIMPLIFY_TOLERANCE = 0.001
+
+# Inputs shared by every state
+USDA_CSV = RAW_CACHE / DEFAULT_LOCAL_NAME
+COUNTY_ZIP = RAW_CACHE / "tl_2022_us_county.zip"
+
+# Optional road extracts, one per state: data/raw/roads/nc.osm.pbf (or .osm,
+# .gpkg, .shp). A state with one gets a drive-time stage.
+ROADS_DIR = PROJECT_ROOT / "data" / "raw" / "roads"
+ROAD_EXTENSIONS = (".osm.pbf", ".osm", ".gpkg", ".shp")
+
+# Optional store inventories, one file per store named by OSM id
+# (data/raw/inventory/node_123.csv), plus an optional categories.csv
+# overriding the nutrient-category scores. See src/metrics/nutrition.py.
+INVENTORY_DIR = PROJECT_ROOT / "data" / "raw" / "inventory"
+CATEGORY_SCORES = INVENTORY_DIR / "categories.csv"
+
+# Optional custom regions (health districts, metro areas, ...) for the rollup
+# cube: polygons in any CRS with a `name` column. Tracts join the region their
+# interior point falls in.
+REGIONS = PROJECT_ROOT / "data" / "raw" / "regions.geojson"
+REGION_NAME_COLUMN = "name"
+
+
+@dataclass(frozen=True)
+class StateBuild:
+    """
+    Everything one state's build reads and writes. Outputs are hive-partitioned
+    (data/processed/state=37/...) so each state builds, and is loaded by the
+    app, independently of the others.
+    """
+    fips: str
+    bbox: BoundingBox
+
+    @property
+    def interim(self) -> Path:
+        return INTERIM / partition_name(self.fips)
+
+    @property
+    def processed(self) -> Path:
+        return PROCESSED / partition_name(self.fips)
+
+    @property
+    def manifest(self) -> Path:
+        return self.processed / "build_manifest.json"
+
+    @property
+    def run_log(self) -> Path:
+        return self.processed / RUN_LOG
+
+    @property
+    def static_dir(self) -> Path:
+        return STATIC_LAYERS / partition_name(self.fips)
+
+    # Intermediate artifacts (not read by the app)
+    @property
+    def tracts_full(self) -> Path:
+        return self.interim / "tracts_full.parquet"
+
+    @property
+    def healthy_raw(self) -> Path:
+        return self.interim / "osm_healthy_points.parquet"
+
+    @property
+    def unhealthy_raw(self) -> Path:
+        return self.interim / "osm_unhealthy_points.parquet"
+
+    @property
+    def healthy_deduped(self) -> Path:
+        return self.interim / "osm_healthy_deduped.parquet"
+
+    @property
+    def unhealthy_deduped(self) -> Path:
+        return self.interim / "osm_unhealthy_deduped.parquet"
+
+    @property
+    def tract_assignments(self) -> Path:
+        return self.interim / "outlet_tracts.parquet"
+
+    @property
+    def nutrition_cache(self) -> Path:
+        return self.interim / "store_nutrition_totals.parquet"
+
+    @property
+    def roads(self) -> Path | None:
+        abbr = STATES[self.fips][0].lower()
+        return next((p for p in (ROADS_DIR / f"{abbr}{ext}" for ext in ROAD_EXTENSIONS) if p.exists()), None)
+
+    # Processed artifacts
+    def out(self, name: str) -> Path:
+        return self.processed / name
+
+    @property
+    def tract_layers(self) -> dict[int, Path]:
+        return {z: self.out(tract_layers_name(z)) for z in PYRAMID_ZOOMS}
+
+    def log(self, msg: str) -> None:
+        print(f"[{STATES[self.fips][0]}] {msg}")
+
+
+POPULATION = "tract_population.parquet"
+TRACTS_GEOJSON = "tracts.geojson"
+TRACTS_PARQUET = "tracts.parquet"
+LAYER_STYLES = "layer_styles.json"
+DESERT = "food_desert_scores.parquet"
+DESERT_POP = "food_desert_population_weighted.parquet"
+HEALTHY = "healthy_food.parquet"
+UNHEALTHY = "unhealthy_food.parquet"
+ACCESS = "supermarket_access.parquet"
+DRIVE = "drive_time.parquet"
+SWAMP = "food_swamp_scores.parquet"
+SWAMP_POP = "food_swamp_population_weighted.parquet"
+SWAMP_RADIUS = "food_swamp_radius.parquet"
+DESERT_HEAT = "desert_heat.parquet"
+SWAMP_HEAT = "swamp_heat.parquet"
+HEAT_MANIFEST = "heat_layers.json"
+RUN_LOG = "build_run.json"
+STORE_NUTRITION = "store_nutrition.parquet"
+TRACT_NUTRITION = "nutrition_scores.parquet"
+COUNTIES_GEOJSON = "counties.geojson"
+COUNTIES_PARQUET = "counties.parquet"
+ROLLUP = "rollup_cube.parquet"
+# osm_id keys store inventories (nutrition stage)
+OUTLET_COLUMNS = ["name", "lat", "lon", "outlet_type", "osm_id", "GEOID"]
+# Tables the app reads directly, given memory-mappable Arrow copies
+APP_TABLES = (HEALTHY, UNHEALTHY, ROLLUP)
+
+
+def _wrote(path: Path) -> None:
+    print(f"   wrote {path}")
+
+
+def fetch_tracts(s: StateBuild):
+    s.log("1) Fetching census tracts…")
+    tracts = load_tracts_gdf(RAW_CACHE, s.fips)
+    tracts.to_parquet(s.tracts_full, index=False)
+    _wrote(s.tracts_full)
+
+
+def fetch_population(s: StateBuild):
+    s.log("2) Fetching ACS population data…")
+    pop_df = fetch_tract_population(s.fips)
+    pop_df.to_parquet(s.out(POPULATION), index=False)
+    _wrote(s.out(POPULATION))
+
+
+def simplify_tracts(s: StateBuild):
+    s.log("3) Simplifying tract geometries (offline)…")
+    tracts = gpd.read_parquet(s.tracts_full)
+    pop_df = pd.read_parquet(s.out(POPULATION))
+    tracts_s = simplify_shared_borders(tracts, tolerance=SIMPLIFY_TOLERANCE)
     tracts_s = tracts_s.merge(pop_df, on="GEOID", how="left")
     tracts_s["population"] = tracts_s["population"].fillna(0).astype(int)
     tracts_s = drop_large_columns(tracts_s, keep=["GEOID", "NAME", "COUNTYFP", "STATEFP", "population"])
-    tracts_geojson_path = PROCESSED / "nc_tracts.geojson"
-    tracts_s.to_file(tracts_geojson_path, driver="GeoJSON")
-    print(f"   wrote {tracts_geojson_path}")
-
+    tracts_s.to_file(s.out(TRACTS_GEOJSON), driver="GeoJSON")
+    tracts_s.to_parquet(s.out(TRACTS_PARQUET), index=False)
+    _wrote(s.out(TRACTS_GEOJSON))
+    _wrote(s.out(TRACTS_PARQUET))
 
 
-
-    print("4) Loading USDA Food Access data (official deserts)…")
+def score_deserts(s: StateBuild):
+    s.log("4) Loading USDA Food Access data (official deserts)…")
     # Place your CSV here:
     #   data/raw/cache/usda_food_access.csv
-    usda = load_usda_food_access(RAW_CACHE, url=None)
-    desert_scores = compute_food_desert_scores(usda)
-    desert_path = PROCESSED / "food_desert_scores.parquet"
-    desert_scores.to_parquet(desert_path, index=False)
-    print(f"   wrote {desert_path}")
+    usda = load_usda_food_access(RAW_CACHE, url=None, states=[s.fips])
+    drive = pd.read_parquet(s.out(DRIVE)) if s.roads else None
+    desert_scores = compute_food_desert_scores(usda, drive_times=drive)
+    desert_scores.to_parquet(s.out(DESERT), index=False)
+    _wrote(s.out(DESERT))
+
 
-    print("5) Computing population-weighted food desert impact…")
+def weight_deserts(s: StateBuild):
+    s.log("5) Computing population-weighted food desert impact…")
+    desert_scores = pd.read_parquet(s.out(DESERT))
+    pop_df = pd.read_parquet(s.out(POPULATION))
 
     desert_pop = desert_scores.merge(pop_df, on="GEOID", how="left")
     desert_pop["population"] = desert_pop["population"].fillna(0)
@@ -61,36 +232,74 @@ def main():
         desert_pop["desert_severity"] * desert_pop["population"]
     )
 
-    desert_pop_path = PROCESSED / "food_desert_population_weighted.parquet"
-    desert_pop.to_parquet(desert_pop_path, index=False)
-    print(f"   wrote {desert_pop_path}")
+    desert_pop.to_parquet(s.out(DESERT_POP), index=False)
+    _wrote(s.out(DESERT_POP))
 
 
-    print("6) Fetching outlets from OSM Overpass (points)…")
-    healthy_pts = fetch_healthy_outlets()
-    unhealthy_pts = fetch_unhealthy_outlets()
+# The OSM stages only run when forced or when their output is missing, and both
+# mean fresh data is wanted: the tile cache is only reused to resume a fetch
+# that was interrupted.
+def fetch_healthy(s: StateBuild):
+    s.log("6a) Fetching healthy outlets from OSM Overpass (points)…")
+    outlets = fetch_healthy_outlets(s.bbox, cache_name=f"osm_healthy_{s.fips}", refresh=True)
+    outlets.to_parquet(s.healthy_raw, index=False)
+    _wrote(s.healthy_raw)
 
-    print("7) Spatial join: outlets → tract GEOID…")
-    healthy_gdf = points_to_gdf(healthy_pts)
-    unhealthy_gdf = points_to_gdf(unhealthy_pts)
 
-    joined_h = spatial_join_points_to_tracts(healthy_gdf, tracts_s)[["name", "lat", "lon", "outlet_type", "GEOID"]]
-    joined_u = spatial_join_points_to_tracts(unhealthy_gdf, tracts_s)[["name", "lat", "lon", "outlet_type", "GEOID"]]
+def fetch_unhealthy(s: StateBuild):
+    s.log("6b) Fetching unhealthy outlets from OSM Overpass (points)…")
+    outlets = fetch_unhealthy_outlets(s.bbox, cache_name=f"osm_unhealthy_{s.fips}", refresh=True)
+    outlets.to_parquet(s.unhealthy_raw, index=False)
+    _wrote(s.unhealthy_raw)
 
-    healthy_path = PROCESSED / "healthy_food.parquet"
-    unhealthy_path = PROCESSED / "unhealthy_food.parquet"
-    joined_h.to_parquet(healthy_path, index=False)
-    joined_u.to_parquet(unhealthy_path, index=False)
-    print(f"   wrote {healthy_path}")
-    print(f"   wrote {unhealthy_path}")
 
-    print("8) Compute food swamp index (computed)…")
-    swamp = compute_food_swamp_index(joined_h, joined_u)
-    swamp_path = PROCESSED / "food_swamp_scores.parquet"
-    swamp.to_parquet(swamp_path, index=False)
-    print(f"   wrote {swamp_path}")
+def dedupe(s: StateBuild):
+    s.log("6c) Merging outlets mapped twice (node + way) or duplicated nearby…")
+    for raw, deduped in ((s.healthy_raw, s.healthy_deduped), (s.unhealthy_raw, s.unhealthy_deduped)):
+        dedupe_outlets(pd.read_parquet(raw)).to_parquet(deduped, index=False)
+        _wrote(deduped)
 
-    print("9) Computing population-weighted food swamp impact…")
+
+def join_outlets(s: StateBuild):
+    s.log("7) Assigning outlets to tracts (full-resolution boundaries, cached by osm_id)…")
+    tracts = gpd.read_parquet(s.tracts_full, columns=["GEOID", "geometry"]).to_crs("EPSG:4326")
+    healthy = pd.read_parquet(s.healthy_deduped)
+    unhealthy = pd.read_parquet(s.unhealthy_deduped)
+    # Both sets in one batch; the cache is keyed by the tract file's hash
+    located = assign_tracts_cached(
+        pd.concat([healthy, unhealthy], ignore_index=True), tracts, s.tract_assignments, file_sha256(s.tracts_full),
+    ).drop_duplicates("osm_id").set_index("osm_id")["GEOID"]
+
+    joined_h = healthy.assign(GEOID=healthy["osm_id"].map(located))[OUTLET_COLUMNS]
+    joined_u = unhealthy.assign(GEOID=unhealthy["osm_id"].map(located))[OUTLET_COLUMNS]
+
+    joined_h.to_parquet(s.out(HEALTHY), index=False)
+    joined_u.to_parquet(s.out(UNHEALTHY), index=False)
+    _wrote(s.out(HEALTHY))
+    _wrote(s.out(UNHEALTHY))
+
+
+def score_swamps(s: StateBuild):
+    s.log("8) Compute food swamp index (computed)…")
+    swamp = compute_food_swamp_index(pd.read_parquet(s.out(HEALTHY)), pd.read_parquet(s.out(UNHEALTHY)))
+    swamp.to_parquet(s.out(SWAMP), index=False)
+    _wrote(s.out(SWAMP))
+
+
+def score_radius_swamps(s: StateBuild):
+    s.log(f"8b) Food swamp index within {', '.join(f'{r:g}' for r in SWAMP_RADII_MI)} mi of tract centroids…")
+    cents = tract_centroids(gpd.read_parquet(s.out(TRACTS_PARQUET)))
+    swamp = compute_radius_swamp_index(
+        cents, pd.read_parquet(s.out(HEALTHY)), pd.read_parquet(s.out(UNHEALTHY)), SWAMP_RADII_MI
+    )
+    swamp.to_parquet(s.out(SWAMP_RADIUS), index=False)
+    _wrote(s.out(SWAMP_RADIUS))
+
+
+def weight_swamps(s: StateBuild):
+    s.log("9) Computing population-weighted food swamp impact…")
+    swamp = pd.read_parquet(s.out(SWAMP))
+    pop_df = pd.read_parquet(s.out(POPULATION))
 
     swamp_pop = swamp.merge(pop_df, on="GEOID", how="left")
     swamp_pop["population"] = swamp_pop["population"].fillna(0)
@@ -99,38 +308,308 @@ def main():
         swamp_pop["swamp_index"] * swamp_pop["population"]
     )
 
-    swamp_pop_path = PROCESSED / "food_swamp_population_weighted.parquet"
-    swamp_pop.to_parquet(swamp_pop_path, index=False)
-    print(f"   wrote {swamp_pop_path}")
+    swamp_pop.to_parquet(s.out(SWAMP_POP), index=False)
+    _wrote(s.out(SWAMP_POP))
+
 
+def score_access(s: StateBuild):
+    s.log("9b) Distance to the nearest healthy outlet from each tract centroid…")
+    cents = tract_centroids(gpd.read_parquet(s.out(TRACTS_PARQUET)))
+    access = compute_supermarket_access(cents, pd.read_parquet(s.out(HEALTHY)), ACCESS_RADII_MI)
+    access.to_parquet(s.out(ACCESS), index=False)
+    _wrote(s.out(ACCESS))
 
-    print("10) Build heatmap inputs from tract centroids…")
-    cents = tract_centroids(tracts_s)
 
-    desert_w = desert_scores.merge(cents, on="GEOID", how="left")
+def score_drive_times(s: StateBuild):
+    s.log(f"9c) Drive time to the nearest healthy outlet over {s.roads.name}…")
+    graph = load_road_graph(s.roads)
+    s.log(f"    road graph: {graph.n_nodes:,} intersections, {len(graph.indices):,} directed edges")
+    cents = tract_centroids(gpd.read_parquet(s.out(TRACTS_PARQUET)))
+    drive = compute_drive_times(cents, pd.read_parquet(s.out(HEALTHY)), graph)
+    drive.to_parquet(s.out(DRIVE), index=False)
+    _wrote(s.out(DRIVE))
+
+
+def build_heat_inputs(s: StateBuild):
+    s.log("10) Build heatmap inputs from tract centroids…")
+    cents = tract_centroids(gpd.read_parquet(s.out(TRACTS_PARQUET)))
+
+    desert_w = pd.read_parquet(s.out(DESERT)).merge(cents, on="GEOID", how="left")
     desert_w["weight"] = desert_w["desert_severity"].fillna(0).astype(float)
     desert_heat = desert_w[["lat", "lon", "weight"]].dropna()
-    desert_heat_path = PROCESSED / "desert_heat.parquet"
-    desert_heat.to_parquet(desert_heat_path, index=False)
-    print(f"   wrote {desert_heat_path}")
+    desert_heat.to_parquet(s.out(DESERT_HEAT), index=False)
+    _wrote(s.out(DESERT_HEAT))
 
-    swamp_w = swamp.merge(cents, on="GEOID", how="left")
+    swamp_w = pd.read_parquet(s.out(SWAMP)).merge(cents, on="GEOID", how="left")
     swamp_w["weight"] = swamp_w["swamp_index"].fillna(0).astype(float)
     swamp_heat = swamp_w[["lat", "lon", "weight"]].dropna()
-    swamp_heat_path = PROCESSED / "swamp_heat.parquet"
-    swamp_heat.to_parquet(swamp_heat_path, index=False)
-    print(f"   wrote {swamp_heat_path}")
-
-    print("11) Nutrition scores (stub)…")
-    store_nutrition, tract_nutrition = compute_nutrition_scores_stub(joined_h)
-    store_nutrition.to_parquet(PROCESSED / "store_nutrition.parquet", index=False)
-    tract_nutrition.to_parquet(PROCESSED / "nutrition_scores.parquet", index=False)
-    print(f"   wrote {PROCESSED / 'store_nutrition.parquet'}")
-    print(f"   wrote {PROCESSED / 'nutrition_scores.parquet'}")
-
-    print("12) Fetching NC county boundaries…")
-    counties = load_nc_counties(RAW_CACHE)
-    counties.to_file(PROCESSED / "nc_counties.geojson", driver="GeoJSON")
+    swamp_heat.to_parquet(s.out(SWAMP_HEAT), index=False)
+    _wrote(s.out(SWAMP_HEAT))
+
+
+def build_heat_layers(s: StateBuild):
+    s.log("10b) Pre-binning heatmap rasters…")
+    manifest = {
+        layer: build_heat_rasters(pd.read_parquet(s.out(src)), s.bbox, layer, s.processed)
+        for layer, src in (("desert", DESERT_HEAT), ("swamp", SWAMP_HEAT))
+    }
+    s.out(HEAT_MANIFEST).write_text(json.dumps(manifest, indent=2))
+    _wrote(s.out(HEAT_MANIFEST))
+
+
+def score_nutrition(s: StateBuild):
+    s.log(f"11) Nutrition scores from store inventories in {INVENTORY_DIR}…")
+    store_nutrition, tract_nutrition = compute_nutrition_scores(
+        pd.read_parquet(s.out(HEALTHY)), INVENTORY_DIR, s.nutrition_cache, CATEGORY_SCORES,
+    )
+    store_nutrition.to_parquet(s.out(STORE_NUTRITION), index=False)
+    tract_nutrition.to_parquet(s.out(TRACT_NUTRITION), index=False)
+    _wrote(s.out(STORE_NUTRITION))
+    _wrote(s.out(TRACT_NUTRITION))
+
+
+def extract_counties(s: StateBuild):
+    s.log("12) Extracting county boundaries…")
+    counties = load_counties(RAW_CACHE, s.fips)
+    counties.to_file(s.out(COUNTIES_GEOJSON), driver="GeoJSON")
+    counties.to_parquet(s.out(COUNTIES_PARQUET), index=False)
+    _wrote(s.out(COUNTIES_GEOJSON))
+    _wrote(s.out(COUNTIES_PARQUET))
+
+
+def build_rollup_cube(s: StateBuild):
+    s.log("12b) Rolling tract scores up to counties, the state and custom regions…")
+    tracts = gpd.read_parquet(s.out(TRACTS_PARQUET))
+    measures = tract_measures(
+        pd.DataFrame(tracts.drop(columns="geometry")),
+        pd.read_parquet(s.out(DESERT_POP)),
+        pd.read_parquet(s.out(SWAMP_POP)),
+    )
+    counties = pd.read_parquet(s.out(COUNTIES_PARQUET), columns=["COUNTYFP", "NAME"])
+    # "Wake, NC": rankings can list counties from several states
+    county_names = pd.Series((counties["NAME"] + f", {STATES[s.fips][0]}").to_numpy(),
+                             index=s.fips + counties["COUNTYFP"].astype(str))
+    tract_regions = None
+    if REGIONS.exists():
+        regions = gpd.read_file(REGIONS)
+        if REGION_NAME_COLUMN not in regions:
+            raise ValueError(f"{REGIONS} needs a '{REGION_NAME_COLUMN}' column naming each region")
+        tract_regions = assign_regions(tracts, regions, REGION_NAME_COLUMN)
+    cube = build_rollup(measures, county_names, pd.Series({s.fips: STATES[s.fips][1]}), tract_regions)
+    cube.to_parquet(s.out(ROLLUP), index=False)
+    _wrote(s.out(ROLLUP))
+
+
+def build_tract_layers(s: StateBuild):
+    s.log("13) Building tract/county TopoJSON pyramid (scores and styles merged, one file per zoom band)…")
+    attrs = pd.DataFrame(gpd.read_parquet(s.out(TRACTS_PARQUET)).drop(columns="geometry"))
+    scored = merge_tract_scores(
+        attrs,
+        pd.read_parquet(s.out(DESERT)),
+        pd.read_parquet(s.out(DESERT_POP)),
+        pd.read_parquet(s.out(SWAMP)),
+        pd.read_parquet(s.out(SWAMP_POP)),
+        pd.read_parquet(s.out(ACCESS)),
+        pd.read_parquet(s.out(SWAMP_RADIUS)),
+    )
+    scored, caps = add_style_columns(scored)
+
+    # Counties carry their rows of the rollup cube, styled like the tract layers
+    county = level_rows(pd.read_parquet(s.out(ROLLUP)), "county")
+    county = county.assign(COUNTYFP=county["key"].str[2:]).drop(columns=["level", "key", "name"])
+    county_props = pd.read_parquet(s.out(COUNTIES_PARQUET), columns=["COUNTYFP", "NAME"]).merge(
+        county.round(4), on="COUNTYFP", how="left")
+    county_props, caps["counties"] = add_style_columns(county_props, COUNTY_CHOROPLETH_LAYERS)
+    s.out(LAYER_STYLES).write_text(json.dumps(caps, indent=2))
+    _wrote(s.out(LAYER_STYLES))
+
+    full = gpd.read_parquet(s.tracts_full)[["GEOID", "COUNTYFP", "geometry"]]
+    for z, topology in topology_pyramid(full, scored, county_props, PYRAMID_ZOOMS).items():
+        path = s.tract_layers[z]
+        path.write_text(json.dumps(topology, separators=(",", ":")))
+        _wrote(path)
+
+
+def publish_static(s: StateBuild):
+    s.log("14) Writing layers as versioned static files for the browser to fetch…")
+    index = publish_static_layers(
+        s.static_dir,
+        s.tract_layers,
+        {"healthy": pd.read_parquet(s.out(HEALTHY)), "unhealthy": pd.read_parquet(s.out(UNHEALTHY))},
+        json.loads(s.out(HEAT_MANIFEST).read_text()),
+        s.processed,
+    )
+    s.out(STATIC_INDEX).write_text(json.dumps(index, indent=2))
+    _wrote(s.static_dir)
+    _wrote(s.out(STATIC_INDEX))
+
+
+def write_app_tables(s: StateBuild):
+    s.log("15) Writing Arrow copies of the tables the app maps into memory…")
+    for name in APP_TABLES:
+        _wrote(write_arrow_copy(s.out(name)))
+
+
+def state_stages(s: StateBuild) -> list[Stage]:
+    """
+    Network stages declare no inputs: they only re-run when their outputs are
+    missing or when forced (e.g. `--force healthy unhealthy` after an OSM
+    refresh). Stale network stages are downloaded together on a thread pool.
+    """
+    o = s.out
+    drive = (o(DRIVE),) if s.roads else ()
+    return [
+        Stage("tracts", partial(fetch_tracts, s), outputs=(s.tracts_full,), network=True),
+        Stage("population", partial(fetch_population, s), outputs=(o(POPULATION),), network=True),
+        Stage("simplify", partial(simplify_tracts, s), inputs=(s.tracts_full, o(POPULATION)),
+              outputs=(o(TRACTS_GEOJSON), o(TRACTS_PARQUET)),
+              params={"tolerance": SIMPLIFY_TOLERANCE, "shared_borders": True}),
+        Stage("desert", partial(score_deserts, s), inputs=(USDA_CSV, *drive), outputs=(o(DESERT),),
+              params={"drive_threshold_minutes": DRIVE_LOW_ACCESS_MINUTES if drive else None}),
+        Stage("desert_pop", partial(weight_deserts, s), inputs=(o(DESERT), o(POPULATION)), outputs=(o(DESERT_POP),)),
+        Stage("healthy", partial(fetch_healthy, s), outputs=(s.healthy_raw,), network=True,
+              params={"bbox": asdict(s.bbox)}),
+        Stage("unhealthy", partial(fetch_unhealthy, s), outputs=(s.unhealthy_raw,), network=True,
+              params={"bbox": asdict(s.bbox)}),
+        Stage("dedup", partial(dedupe, s), inputs=(s.healthy_raw, s.unhealthy_raw),
+              outputs=(s.healthy_deduped, s.unhealthy_deduped), params={"distance_m": DEDUP_DISTANCE_M}),
+        Stage("join", partial(join_outlets, s), inputs=(s.healthy_deduped, s.unhealthy_deduped, s.tracts_full),
+              outputs=(o(HEALTHY), o(UNHEALTHY)), params={"columns": OUTLET_COLUMNS, "tracts": "full"}),
+        Stage("swamp", partial(score_swamps, s), inputs=(o(HEALTHY), o(UNHEALTHY)), outputs=(o(SWAMP),)),
+        Stage("swamp_radius", partial(score_radius_swamps, s), inputs=(o(TRACTS_PARQUET), o(HEALTHY), o(UNHEALTHY)),
+              outputs=(o(SWAMP_RADIUS),), params={"radii_mi": SWAMP_RADII_MI}),
+        Stage("swamp_pop", partial(weight_swamps, s), inputs=(o(SWAMP), o(POPULATION)), outputs=(o(SWAMP_POP),)),
+        Stage("access", partial(score_access, s), inputs=(o(TRACTS_PARQUET), o(HEALTHY)), outputs=(o(ACCESS),),
+              params={"radii_mi": ACCESS_RADII_MI}),
+        *([Stage("drive", partial(score_drive_times, s), inputs=(s.roads, o(TRACTS_PARQUET), o(HEALTHY)),
+                 outputs=drive, params={"cutoff_minutes": DRIVE_CUTOFF_MINUTES})] if drive else []),
+        Stage("heat", partial(build_heat_inputs, s), inputs=(o(TRACTS_PARQUET), o(DESERT), o(SWAMP)),
+              outputs=(o(DESERT_HEAT), o(SWAMP_HEAT))),
+        Stage("heat_rasters", partial(build_heat_layers, s), inputs=(o(DESERT_HEAT), o(SWAMP_HEAT)),
+              outputs=(*(o(heat_png_name(l, z)) for l in HEAT_LAYERS for z in HEAT_ZOOMS), o(HEAT_MANIFEST)),
+              params={"bbox": asdict(s.bbox), "zooms": HEAT_ZOOMS, "cell_pixels": HEAT_CELL_PIXELS,
+                      "sigma_cells": HEAT_SIGMA_CELLS}),
+        # Inventories are tracked by size and mtime (params) rather than hashed as
+        # inputs: there can be gigabytes of them, and the stage itself only
+        # re-reads the files that changed.
+        Stage("nutrition", partial(score_nutrition, s),
+              inputs=(o(HEALTHY), *((CATEGORY_SCORES,) if CATEGORY_SCORES.exists() else ())),
+              outputs=(o(STORE_NUTRITION), o(TRACT_NUTRITION)),
+              params={"inventory": inventory_signature(INVENTORY_DIR), "chunk_rows": INVENTORY_CHUNK_ROWS}),
+        Stage("counties", partial(extract_counties, s), inputs=(COUNTY_ZIP,),
+              outputs=(o(COUNTIES_GEOJSON), o(COUNTIES_PARQUET)), params={"columns": ["COUNTYFP", "NAME"]}),
+        Stage("rollup", partial(build_rollup_cube, s),
+              inputs=(o(TRACTS_PARQUET), o(DESERT_POP), o(SWAMP_POP), o(COUNTIES_PARQUET),
+                      *((REGIONS,) if REGIONS.exists() else ())),
+              outputs=(o(ROLLUP),), params={"swamp_affected_index": SWAMP_AFFECTED_INDEX}),
+        Stage("tract_layers", partial(build_tract_layers, s),
+              inputs=(s.tracts_full, o(TRACTS_PARQUET), o(COUNTIES_PARQUET), o(DESERT), o(DESERT_POP), o(SWAMP), o(SWAMP_POP),
+                      o(ACCESS), o(SWAMP_RADIUS), o(ROLLUP)),
+              outputs=(*s.tract_layers.values(), o(LAYER_STYLES)),
+              params={"zooms": PYRAMID_ZOOMS, "styles": {k: asdict(v) for k, v in CHOROPLETH_LAYERS.items()},
+                      "county_styles": {k: asdict(v) for k, v in COUNTY_CHOROPLETH_LAYERS.items()}}),
+        Stage("static_layers", partial(publish_static, s),
+              inputs=(*s.tract_layers.values(), o(HEALTHY), o(UNHEALTHY), o(HEAT_MANIFEST),
+                      *(o(heat_png_name(l, z)) for l in HEAT_LAYERS for z in HEAT_ZOOMS)),
+              outputs=(o(STATIC_INDEX),),
+              params={"dir": str(s.static_dir.relative_to(PROJECT_ROOT)), "points": POINT_TOOLTIP_COLUMNS}),
+        Stage("app_tables", partial(write_app_tables, s), inputs=tuple(o(n) for n in APP_TABLES),
+              outputs=tuple(arrow_path(o(n)) for n in APP_TABLES)),
+    ]
+
+
+STAGE_NAMES = [st.name for st in state_stages(StateBuild(NC_FIPS, NC_BBOX))]
+if "drive" not in STAGE_NAMES:
+    STAGE_NAMES.append("drive")  # only present for states with a road extract
+
+
+def build_state(fips: str, bbox: BoundingBox, force: set[str] | None, serial: bool,
+                trace_memory: bool = False) -> str:
+    """Build one state's partition. Runs in a worker process for multi-state builds."""
+    s = StateBuild(fips, bbox)
+    s.interim.mkdir(parents=True, exist_ok=True)
+    s.processed.mkdir(parents=True, exist_ok=True)
+    runner = None if serial else run_concurrently
+    run_pipeline(state_stages(s), s.manifest, force=force, runner=runner,
+                 run_path=s.run_log, trace_memory=trace_memory)
+    return fips
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the food environment layers, one partition per state.")
+    parser.add_argument(
+        "--states",
+        nargs="+",
+        default=[NC_FIPS],
+        metavar="STATE",
+        help="State FIPS codes or postal abbreviations to build, or 'all' (default: 37, North Carolina).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Number of states built in parallel, one process each. Peak memory is about this many states.",
+    )
+    parser.add_argument(
+        "--force",
+        nargs="*",
+        metavar="STAGE",
+        help="Re-run the named stages even if their inputs are unchanged (no names = every stage). "
+             f"Stages: {', '.join(STAGE_NAMES)}",
+    )
+    parser.add_argument(
+        "--serial",
+        action="store_true",
+        help="Download network sources one at a time instead of concurrently.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help=f"Record each stage's peak allocations with tracemalloc in {RUN_LOG} (slower).",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    PROCESSED.mkdir(parents=True, exist_ok=True)
+    INTERIM.mkdir(parents=True, exist_ok=True)
+    RAW_CACHE.mkdir(parents=True, exist_ok=True)
+
+    try:
+        states = parse_states(args.states)
+    except ValueError as e:
+        raise SystemExit(str(e))
+
+    force = set(args.force) if args.force is not None else None
+    if force:
+        unknown = force - set(STAGE_NAMES)
+        if unknown:
+            raise SystemExit(f"Unknown stage(s): {', '.join(sorted(unknown))}")
+
+    # Shared national inputs are fetched once here, before any worker starts
+    bounds = state_bounds(RAW_CACHE)
+    bboxes = {f: BoundingBox(**bounds.loc[f].to_dict()) for f in states}
+    if USDA_CSV.exists():
+        usda_parquet(RAW_CACHE)
+
+    if len(states) == 1 or args.workers <= 1:
+        for f in states:
+            build_state(f, bboxes[f], force, args.serial, args.trace_memory)
+    else:
+        failed = {}
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = {pool.submit(build_state, f, bboxes[f], force, args.serial, args.trace_memory): f for f in states}
+            for fut in as_completed(futures):
+                f = futures[fut]
+                try:
+                    fut.result()
+                    print(f"== {STATES[f][1]} done")
+                except Exception as e:
+                    failed[f] = e
+                    print(f"== {STATES[f][1]} FAILED: {e}")
+        if failed:
+            raise SystemExit(f"{len(failed)} state(s) failed: {', '.join(sorted(failed))}")
 
     print("\nDone. Now run:")
     print("  streamlit run app/main.py")
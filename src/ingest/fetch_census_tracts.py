@@ -2,25 +2,24 @@ from __future__ import annotations
 
 from pathlib import Path
 import zipfile
-import requests
 import geopandas as gpd
 
 from src.utils.cache import ensure_dir
+from src.utils.http import stream_to_file
+from src.ingest.states import NC_FIPS
 
-TIGER_TRACT_ZIP_URL = "https://www2.census.gov/geo/tiger/GENZ2023/shp/cb_2023_37_tract_500k.zip"
+TIGER_TRACT_ZIP_TEMPLATE = "https://www2.census.gov/geo/tiger/GENZ2023/shp/cb_2023_{fips}_tract_500k.zip"
+TIGER_TRACT_ZIP_URL = TIGER_TRACT_ZIP_TEMPLATE.format(fips=NC_FIPS)
 
-def download_nc_tracts_zip(cache_dir: Path, url: str = TIGER_TRACT_ZIP_URL) -> Path:
+def download_tracts_zip(cache_dir: Path, state_fips: str = NC_FIPS) -> Path:
     ensure_dir(cache_dir)
-    out = cache_dir / "cb_2023_37_tract_500k.zip"
+    out = cache_dir / f"cb_2023_{state_fips}_tract_500k.zip"
     if out.exists():
         return out
-    r = requests.get(url, stream=True, timeout=120)
-    r.raise_for_status()
-    with out.open("wb") as f:
-        for chunk in r.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                f.write(chunk)
-    return out
+    return stream_to_file(TIGER_TRACT_ZIP_TEMPLATE.format(fips=state_fips), out, desc=f"TIGER tracts {state_fips}")
+
+def download_nc_tracts_zip(cache_dir: Path) -> Path:
+    return download_tracts_zip(cache_dir, NC_FIPS)
 
 def extract_zip(zip_path: Path, extract_dir: Path) -> Path:
     ensure_dir(extract_dir)
@@ -28,9 +27,9 @@ def extract_zip(zip_path: Path, extract_dir: Path) -> Path:
         z.extractall(extract_dir)
     return extract_dir
 
-def load_nc_tracts_gdf(cache_dir: Path) -> gpd.GeoDataFrame:
-    zip_path = download_nc_tracts_zip(cache_dir)
-    shp_dir = extract_zip(zip_path, cache_dir / "cb_2023_37_tract_500k")
+def load_tracts_gdf(cache_dir: Path, state_fips: str = NC_FIPS) -> gpd.GeoDataFrame:
+    zip_path = download_tracts_zip(cache_dir, state_fips)
+    shp_dir = extract_zip(zip_path, cache_dir / f"cb_2023_{state_fips}_tract_500k")
     shp_files = list(shp_dir.glob("*.shp"))
     if not shp_files:
         raise FileNotFoundError(f"No .shp found in {shp_dir}")
@@ -49,3 +48,6 @@ def load_nc_tracts_gdf(cache_dir: Path) -> gpd.GeoDataFrame:
         else:
             raise KeyError("GEOID not found and cannot be constructed from STATEFP/COUNTYFP/TRACTCE.")
     return gdf
+
+def load_nc_tracts_gdf(cache_dir: Path) -> gpd.GeoDataFrame:
+    return load_tracts_gdf(cache_dir, NC_FIPS)
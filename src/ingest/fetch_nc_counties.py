@@ -1,15 +1,22 @@
 from pathlib import Path
 import geopandas as gpd
-import requests
+import numpy as np
+import pandas as pd
 import zipfile
 
 from src.utils.cache import ensure_dir
+from src.utils.http import stream_to_file
+from src.ingest.states import NC_FIPS
 
 TIGER_COUNTY_URL = (
     "https://www2.census.gov/geo/tiger/TIGER2022/COUNTY/tl_2022_us_county.zip"
 )
 
-def load_nc_counties(cache_dir: Path) -> gpd.GeoDataFrame:
+def county_shapefile(cache_dir: Path) -> Path:
+    """
+    Download and extract the national county shapefile once. Run this before
+    fanning out per-state builds so workers never race on the same zip.
+    """
     ensure_dir(cache_dir)
 
     zip_path = cache_dir / "tl_2022_us_county.zip"
@@ -17,12 +24,7 @@ def load_nc_counties(cache_dir: Path) -> gpd.GeoDataFrame:
     # Download once
     if not zip_path.exists():
         print("   downloading TIGER/Line US counties…")
-        r = requests.get(TIGER_COUNTY_URL, stream=True, timeout=120)
-        r.raise_for_status()
-        with zip_path.open("wb") as f:
-            for chunk in r.iter_content(1024 * 1024):
-                if chunk:
-                    f.write(chunk)
+        stream_to_file(TIGER_COUNTY_URL, zip_path, desc="TIGER counties")
 
     extract_dir = cache_dir / "tl_2022_us_county"
     if not extract_dir.exists():
@@ -32,11 +34,45 @@ def load_nc_counties(cache_dir: Path) -> gpd.GeoDataFrame:
     shp_files = list(extract_dir.glob("*.shp"))
     if not shp_files:
         raise FileNotFoundError("County shapefile not found after extraction.")
+    return shp_files[0]
 
-    gdf = gpd.read_file(shp_files[0]).to_crs("EPSG:4326")
+def load_counties(cache_dir: Path, state_fips: str = NC_FIPS) -> gpd.GeoDataFrame:
+    gdf = gpd.read_file(county_shapefile(cache_dir)).to_crs("EPSG:4326")
 
-    # Filter to North Carolina (STATEFP = '37')
-    gdf = gdf[gdf["STATEFP"] == "37"]
+    # Filter to the requested state (North Carolina is STATEFP = '37')
+    gdf = gdf[gdf["STATEFP"] == state_fips]
 
     # Keep only what we need
-    return gdf[["NAME", "geometry"]]
+    return gdf[["COUNTYFP", "NAME", "geometry"]]
+
+# A state wider than this must be straddling the antimeridian
+MAX_STATE_DEGREES = 180.0
+
+def state_bounds(cache_dir: Path) -> pd.DataFrame:
+    """
+    (south, west, north, east) of every state, from its counties. TIGER splits
+    polygons at ±180°, so a state spanning more than 180° (Alaska, whose
+    Aleutians cross the antimeridian) is measured on 0..360 longitudes
+    instead; its east is then above 180 (see BoundingBox).
+    """
+    gdf = gpd.read_file(county_shapefile(cache_dir)).to_crs("EPSG:4326")
+    parts = gdf[["STATEFP", "geometry"]].explode(index_parts=False)
+    b = parts.bounds.assign(STATEFP=parts["STATEFP"].to_numpy())
+    wraps = b.groupby("STATEFP")["maxx"].transform("max") - b.groupby("STATEFP")["minx"].transform("min") > MAX_STATE_DEGREES
+    shift = np.where(wraps & (b["maxx"] <= 0), 360.0, 0.0)
+    b["minx"] += shift
+    b["maxx"] += shift
+    g = b.groupby("STATEFP")
+    out = pd.DataFrame({
+        "south": g["miny"].min(),
+        "west": g["minx"].min(),
+        "north": g["maxy"].max(),
+        "east": g["maxx"].max(),
+    })
+    too_wide = out.index[out["east"] - out["west"] > MAX_STATE_DEGREES]
+    if len(too_wide):
+        raise ValueError(f"State bounds wider than {MAX_STATE_DEGREES:g}°: {', '.join(too_wide)}")
+    return out
+
+def load_nc_counties(cache_dir: Path) -> gpd.GeoDataFrame:
+    return load_counties(cache_dir, NC_FIPS)
@@ -1,10 +1,18 @@
 from __future__ import annotations
 from pathlib import Path
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-import requests
-import time
+from typing import Callable
+import csv
+import hashlib
+import shutil
+import threading
+import numpy as np
 import pandas as pd
+from tqdm import tqdm
+
+from src.utils.http import get_session
+from src.ingest.mirrors import Cancelled, MirrorHealth, hedged_fetch
 
 OVERPASS_URLS = [
     "https://overpass-api.de/api/interpreter",
@@ -15,6 +23,7 @@ OVERPASS_URLS = [
 
 @dataclass(frozen=True)
 class BoundingBox:
+    """Degrees; `east` is above 180 for a box that crosses the antimeridian."""
     south: float
     west: float
     north: float
@@ -22,59 +31,177 @@ class BoundingBox:
 
 NC_BBOX = BoundingBox(south=33.75, west=-84.45, north=36.6, east=-75.4)
 
+# Columns requested from Overpass in CSV mode (tab-separated, with a header
+# row). With `out center`, ::lat/::lon are the node position or way's center.
+OVERPASS_CSV_FIELDS = ["::type", "::id", "::lat", "::lon", "name", "brand", "operator"]
+OVERPASS_CSV_HEADER = [c.replace("::", "@") for c in OVERPASS_CSV_FIELDS]
+TILE_DEGREES = 1.0
+TILE_WORKERS = 3
+
 def _overpass_query(bbox: BoundingBox, q_body: str) -> str:
-    return f"""[out:json][timeout:180];
+    fields = ", ".join(OVERPASS_CSV_FIELDS)
+    return f"""[out:csv({fields}; true)][timeout:180];
 (
 {q_body}
 );
 out center;"""
 
 
-def _fetch_overpass(query: str) -> dict:
-    last_err = None
-    for url in OVERPASS_URLS:
+def split_bbox(bbox: BoundingBox, tile_degrees: float = TILE_DEGREES) -> list[BoundingBox]:
+    """
+    Cut `bbox` into a grid of tiles at most `tile_degrees` on a side. Across
+    the antimeridian the grid breaks at 180° and tiles beyond it are moved
+    back to -180..180, which is what Overpass accepts.
+    """
+    lats = np.append(np.arange(bbox.south, bbox.north, tile_degrees), bbox.north)
+    lons = np.append(np.arange(bbox.west, bbox.east, tile_degrees), bbox.east)
+    if bbox.west < 180 < bbox.east:
+        lons = np.unique(np.append(lons, 180.0))
+    return [
+        BoundingBox(south=round(float(s), 6), west=round(float(w - wrap), 6),
+                    north=round(float(n), 6), east=round(float(e - wrap), 6))
+        for s, n in zip(lats[:-1], lats[1:])
+        for w, e in zip(lons[:-1], lons[1:])
+        for wrap in [360.0 if w >= 180 else 0.0]
+    ]
+
+
+def _fetch_overpass(
+    query: str,
+    out: Path,
+    urls: list[str] | None = None,
+    hedge_after: float | None = None,
+) -> Path:
+    """
+    Stream the Overpass response to `out` without holding it in memory. The
+    query goes to the healthiest mirror first and is hedged to the next one if
+    it is slow (see `hedged_fetch`); each attempt writes its own `.part` file
+    and only the winner's is moved into place.
+    """
+    def attempt(url: str, cancel: threading.Event) -> Path:
+        tmp = out.with_suffix(out.suffix + f".{hashlib.sha1(url.encode()).hexdigest()[:8]}.part")
         try:
-            r = requests.post(url, data={"data": query}, timeout=300)
-            r.raise_for_status()
-            return r.json()
-        except Exception as e:
-            last_err = e
-            time.sleep(5)
-    raise RuntimeError(f"All Overpass endpoints failed. Last error: {last_err}")
-
-
-CACHE_DIR = Path(__file__).resolve().parents[3] / "data" / "raw" / "cache"
-
-def _fetch_with_cache(cache_name: str, query: str) -> dict:
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-    path = CACHE_DIR / cache_name
-    if path.exists():
-        return json.loads(path.read_text())
-    data = _fetch_overpass(query)
-    path.write_text(json.dumps(data))
-    return data
-
-def _elements_to_points(elements: list[dict], outlet_type: str) -> pd.DataFrame:
-    rows = []
-    for el in elements:
-        tags = el.get("tags", {})
-        name = tags.get("name") or tags.get("brand") or tags.get("operator") or "Unknown"
-        lat = el.get("lat") or (el.get("center") or {}).get("lat")
-        lon = el.get("lon") or (el.get("center") or {}).get("lon")
-        if lat is None or lon is None:
-            continue
-        rows.append({
-            "name": name,
-            "lat": float(lat),
-            "lon": float(lon),
-            "outlet_type": outlet_type,
-            "osm_id": f"{el.get('type','')}/{el.get('id','')}",
-        })
-    return pd.DataFrame(rows)
-
-def fetch_healthy_outlets(bbox: BoundingBox = NC_BBOX) -> pd.DataFrame:
-    s,w,n,e = bbox.south, bbox.west, bbox.north, bbox.east
-    q_body = f"""
+            with get_session(retries=False).post(url, data={"data": query}, timeout=300, stream=True) as r:
+                r.raise_for_status()
+                with tmp.open("wb") as f:
+                    for chunk in r.iter_content(chunk_size=1024 * 1024):
+                        if cancel.is_set():
+                            raise Cancelled(url)
+                        f.write(chunk)
+            _check_csv_header(tmp)
+            if cancel.is_set():
+                raise Cancelled(url)
+            return tmp
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    tmp = hedged_fetch(urls or OVERPASS_URLS, attempt, mirror_health(), hedge_after=hedge_after,
+                       discard=lambda p: p.unlink(missing_ok=True))
+    tmp.replace(out)
+    return out
+
+
+def _check_csv_header(path: Path) -> None:
+    # Overpass reports some errors as a 200 with an HTML/XML body
+    with path.open("r", encoding="utf-8", errors="replace") as f:
+        header = f.readline().rstrip("\n").split("\t")
+    if header != OVERPASS_CSV_HEADER:
+        raise ValueError(f"Unexpected Overpass response header: {header[:4]}")
+
+
+CACHE_DIR = Path(__file__).resolve().parents[2] / "data" / "raw" / "cache"
+MIRROR_HEALTH_PATH = CACHE_DIR / "overpass_mirrors.json"
+
+_health: MirrorHealth | None = None
+_health_lock = threading.Lock()
+
+def mirror_health() -> MirrorHealth:
+    """Process-wide mirror stats, loaded from (and saved back to) the cache."""
+    global _health
+    with _health_lock:
+        if _health is None:
+            _health = MirrorHealth(MIRROR_HEALTH_PATH)
+        return _health
+
+# Present in a tile directory while a fetch of it is unfinished
+PENDING_MARKER = ".pending"
+
+def _tile_dir(cache_name: str) -> Path:
+    return CACHE_DIR / "overpass" / cache_name
+
+def _tile_path(cache_name: str, tile: BoundingBox) -> Path:
+    return _tile_dir(cache_name) / f"{tile.south}_{tile.west}_{tile.north}_{tile.east}.tsv"
+
+def _fetch_tiles(cache_name: str, bbox: BoundingBox, q_body: Callable[[BoundingBox], str],
+                 refresh: bool = False) -> list[Path]:
+    """
+    Query every tile of `bbox` concurrently, caching each response on disk. A
+    tile is only marked done once its file is complete, so re-running after a
+    failure fetches just the tiles that are still missing. With `refresh`, a
+    complete set of tiles is discarded and fetched again; an unfinished one
+    (marked PENDING_MARKER) is still resumed, so an interrupted refresh doesn't
+    start over.
+    """
+    tile_dir = _tile_dir(cache_name)
+    pending = tile_dir / PENDING_MARKER
+    if refresh and tile_dir.exists() and not pending.exists():
+        shutil.rmtree(tile_dir)
+    tiles = split_bbox(bbox)
+    paths = [_tile_path(cache_name, t) for t in tiles]
+    todo = [(t, p) for t, p in zip(tiles, paths) if not p.exists()]
+    if todo:
+        tile_dir.mkdir(parents=True, exist_ok=True)
+        pending.touch()
+        errors = []
+        with ThreadPoolExecutor(max_workers=TILE_WORKERS) as pool:
+            futures = [pool.submit(_fetch_overpass, _overpass_query(t, q_body(t)), p) for t, p in todo]
+            for fut in tqdm(as_completed(futures), total=len(futures), desc=cache_name, unit="tile", leave=False):
+                try:
+                    fut.result()
+                except Exception as e:
+                    errors.append(e)
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)}/{len(todo)} Overpass tiles failed for {cache_name}; "
+                f"re-run to resume. First error: {errors[0]}"
+            )
+    pending.unlink(missing_ok=True)
+    return paths
+
+def _tiles_to_points(paths: list[Path], outlet_type: str) -> pd.DataFrame:
+    frames = [
+        pd.read_csv(
+            p,
+            sep="\t",
+            quoting=csv.QUOTE_NONE,
+            dtype={"@type": "string", "@id": "int64", "@lat": "float64", "@lon": "float64",
+                   "name": "string", "brand": "string", "operator": "string"},
+            names=OVERPASS_CSV_HEADER,
+            header=0,
+            keep_default_na=False,
+            na_values=[""],
+        )
+        for p in paths
+    ]
+    df = pd.concat(frames, ignore_index=True).dropna(subset=["@lat", "@lon"])
+    df["osm_id"] = df["@type"] + "/" + df["@id"].astype("string")
+    # Ways that cross a tile edge come back from both tiles
+    df = df.drop_duplicates("osm_id")
+    return pd.DataFrame({
+        "name": df["name"].fillna(df["brand"]).fillna(df["operator"]).fillna("Unknown").astype(object),
+        "brand": df["brand"].astype(object),
+        "lat": df["@lat"].to_numpy(),
+        "lon": df["@lon"].to_numpy(),
+        "outlet_type": outlet_type,
+        "osm_id": df["osm_id"].astype(object),
+    }).reset_index(drop=True)
+
+def fetch_healthy_outlets(bbox: BoundingBox = NC_BBOX, cache_name: str = "osm_healthy",
+                          refresh: bool = False) -> pd.DataFrame:
+    def q_body(t: BoundingBox) -> str:
+        s,w,n,e = t.south, t.west, t.north, t.east
+        return f"""
 node[shop=supermarket]({s},{w},{n},{e});
 way[shop=supermarket]({s},{w},{n},{e});
 node[shop=grocery]({s},{w},{n},{e});
@@ -82,16 +209,14 @@ way[shop=grocery]({s},{w},{n},{e});
 node[amenity=marketplace]({s},{w},{n},{e});
 way[amenity=marketplace]({s},{w},{n},{e});
 """
-    data = _fetch_with_cache("osm_healthy.json", _overpass_query(bbox, q_body))
-    return _elements_to_points(data.get("elements", []), "healthy")
+    return _tiles_to_points(_fetch_tiles(cache_name, bbox, q_body, refresh), "healthy")
 
-def fetch_unhealthy_outlets(bbox: BoundingBox = NC_BBOX) -> pd.DataFrame:
-    s,w,n,e = bbox.south, bbox.west, bbox.north, bbox.east
-    q_body = f"""
+def fetch_unhealthy_outlets(bbox: BoundingBox = NC_BBOX, cache_name: str = "osm_unhealthy",
+                            refresh: bool = False) -> pd.DataFrame:
+    def q_body(t: BoundingBox) -> str:
+        s,w,n,e = t.south, t.west, t.north, t.east
+        return f"""
 node[amenity=fast_food]({s},{w},{n},{e});
 way[amenity=fast_food]({s},{w},{n},{e});
 """
-    data = _fetch_with_cache("osm_unhealthy.json", _overpass_query(bbox, q_body))
-    return _elements_to_points(data.get("elements", []), "unhealthy")
-
-
+    return _tiles_to_points(_fetch_tiles(cache_name, bbox, q_body, refresh), "unhealthy")
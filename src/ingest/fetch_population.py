@@ -1,22 +1,24 @@
 from __future__ import annotations
 from pathlib import Path
-import requests
 import pandas as pd
 
+from src.utils.http import get_session
+from src.ingest.states import NC_FIPS
+
 ACS_URL = "https://api.census.gov/data/2022/acs/acs5"
 
-def fetch_nc_tract_population() -> pd.DataFrame:
+def fetch_tract_population(state_fips: str = NC_FIPS) -> pd.DataFrame:
     """
-    Fetch total population per census tract in North Carolina
+    Fetch total population per census tract in one state
     using ACS 5-year estimates.
     """
     params = {
         "get": "B01003_001E",
         "for": "tract:*",
-        "in": "state:37",
+        "in": f"state:{state_fips}",
     }
 
-    r = requests.get(ACS_URL, params=params, timeout=60)
+    r = get_session().get(ACS_URL, params=params, timeout=60)
     r.raise_for_status()
     data = r.json()
 
@@ -30,3 +32,6 @@ def fetch_nc_tract_population() -> pd.DataFrame:
     df["population"] = pd.to_numeric(df["B01003_001E"], errors="coerce").fillna(0).astype(int)
 
     return df[["GEOID", "population"]]
+
+def fetch_nc_tract_population() -> pd.DataFrame:
+    return fetch_tract_population(NC_FIPS)
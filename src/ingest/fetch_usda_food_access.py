@@ -1,10 +1,25 @@
 from __future__ import annotations
 from pathlib import Path
+from typing import Iterable
+import csv
 import pandas as pd
-import requests
-from src.utils.cache import ensure_dir
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from src.utils.cache import ensure_dir, memo_sha256
+from src.utils.http import stream_to_file
 
 DEFAULT_LOCAL_NAME = "usda_food_access.csv"
+PARQUET_PREFIX = "usda_food_access."
+
+# Columns that may hold the tract id, in order of preference
+GEOID_COLUMNS = ("CensusTract", "GEOID", "geoid", "TRACTID", "CensusTractId")
+NULL_VALUES = ["", "NULL", "NA", "NaN", "nan"]
+
+def is_desert_flag(column: str) -> bool:
+    u = column.upper()
+    return "LILA" in u or "LOWACCESS" in u
 
 def get_usda_food_access(cache_dir: Path, url: str | None = None) -> Path:
     ensure_dir(cache_dir)
@@ -16,13 +31,73 @@ def get_usda_food_access(cache_dir: Path, url: str | None = None) -> Path:
             f"USDA food access CSV not found at {out}. "
             "Place it there or pass a download URL via url=..."
         )
-    r = requests.get(url, stream=True, timeout=120)
-    r.raise_for_status()
-    with out.open("wb") as f:
-        for chunk in r.iter_content(chunk_size=1024 * 1024):
-            if chunk:
-                f.write(chunk)
+    return stream_to_file(url, out, desc="USDA food access")
+
+def _csv_header(path: Path) -> list[str]:
+    with path.open("r", encoding="utf-8-sig", errors="replace", newline="") as f:
+        return next(csv.reader(f))
+
+def _csv_to_parquet(csv_path: Path, out: Path) -> None:
+    """
+    Stream the CSV through Arrow, keeping only the tract id and the desert flag
+    columns, and write it as Parquet with a STATEFP column. Memory is bounded
+    by one CSV block, not the ~150 columns of the full atlas.
+    """
+    header = _csv_header(csv_path)
+    geoid_col = next((c for c in GEOID_COLUMNS if c in header), None)
+    if geoid_col is None:
+        raise KeyError("Could not find a GEOID/CensusTract column in USDA food access CSV.")
+    flags = [c for c in header if is_desert_flag(c)]
+
+    reader = pacsv.open_csv(
+        csv_path,
+        read_options=pacsv.ReadOptions(block_size=4 << 20),
+        convert_options=pacsv.ConvertOptions(
+            include_columns=[geoid_col, *flags],
+            column_types={geoid_col: pa.string(), **{c: pa.float32() for c in flags}},
+            null_values=NULL_VALUES,
+        ),
+    )
+    tmp = out.with_suffix(out.suffix + ".part")
+    writer = None
+    try:
+        for batch in reader:
+            geoid = pc.utf8_lpad(batch.column(geoid_col), 11, "0")
+            table = pa.table({
+                "GEOID": geoid,
+                "STATEFP": pc.utf8_slice_codeunits(geoid, 0, 2),
+                **{c: batch.column(c) for c in flags},
+            })
+            if writer is None:
+                writer = pq.ParquetWriter(tmp, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    tmp.replace(out)
+
+def usda_parquet(cache_dir: Path, url: str | None = None) -> Path:
+    """
+    Parquet projection of the USDA CSV, keyed by the CSV's content hash. It is
+    rebuilt (and older projections removed) only when the CSV changes. Call
+    this before fanning out per-state builds so workers never race on it.
+    """
+    csv_path = get_usda_food_access(cache_dir, url=url)
+    out = cache_dir / f"{PARQUET_PREFIX}{memo_sha256(csv_path)[:16]}.parquet"
+    if not out.exists():
+        print("   converting USDA food access CSV to Parquet…")
+        _csv_to_parquet(csv_path, out)
+        for old in cache_dir.glob(f"{PARQUET_PREFIX}*.parquet"):
+            if old != out:
+                old.unlink(missing_ok=True)
     return out
 
-def load_usda_food_access(cache_dir: Path, url: str | None = None) -> pd.DataFrame:
-    return pd.read_csv(get_usda_food_access(cache_dir, url=url), low_memory=False)
+def load_usda_food_access(
+    cache_dir: Path,
+    url: str | None = None,
+    states: Iterable[str] | None = None,
+) -> pd.DataFrame:
+    """GEOID plus the desert flag columns, for `states` (FIPS codes) or all."""
+    filters = [("STATEFP", "in", list(states))] if states is not None else None
+    df = pd.read_parquet(usda_parquet(cache_dir, url=url), filters=filters)
+    return df.drop(columns="STATEFP")
@@ -0,0 +1,188 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import Callable, TypeVar
+import contextlib
+import json
+import os
+import queue
+import threading
+import time
+
+T = TypeVar("T")
+
+DEFAULT_HEDGE_AFTER = 30.0   # seconds before a second mirror is tried, with no history
+MIN_HEDGE_AFTER = 5.0
+MAX_HEDGE_AFTER = 120.0
+FAILURE_COOLDOWN = 600.0     # a mirror that failed this recently is tried last
+EWMA_ALPHA = 0.3
+
+
+class Cancelled(Exception):
+    """Raised inside an attempt that lost the race and was told to stop."""
+
+
+class MirrorHealth:
+    """
+    Per-mirror success/failure counts and a latency EWMA, persisted as JSON so
+    the next run starts with the mirror that has been fastest lately. Several
+    processes may share the file: each update is applied to a fresh read of
+    it, so one process does not overwrite the others' counts.
+    """
+
+    def __init__(self, path: Path | None = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stats: dict[str, dict] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            self.stats = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            pass  # keep what we have; the next write replaces the bad file
+
+    def _entry(self, url: str) -> dict:
+        return self.stats.setdefault(url, {"ok": 0, "fail": 0, "latency": None, "last_fail": None})
+
+    def _observe(self, e: dict, seconds: float) -> None:
+        e["latency"] = seconds if e["latency"] is None else (1 - EWMA_ALPHA) * e["latency"] + EWMA_ALPHA * seconds
+
+    def _update(self, url: str, change: Callable[[dict], None]) -> None:
+        with self._lock:
+            self._load()
+            change(self._entry(url))
+            self._save()
+
+    def record_success(self, url: str, seconds: float) -> None:
+        def change(e: dict) -> None:
+            e["ok"] += 1
+            self._observe(e, seconds)
+        self._update(url, change)
+
+    def record_failure(self, url: str) -> None:
+        def change(e: dict) -> None:
+            e["fail"] += 1
+            e["last_fail"] = time.time()
+        self._update(url, change)
+
+    def record_slow(self, url: str, seconds: float) -> None:
+        # Lost a race: we only know it took at least `seconds`
+        self._update(url, lambda e: self._observe(e, seconds))
+
+    def _score(self, url: str, now: float) -> float:
+        e = self.stats.get(url)
+        if e is None:
+            return DEFAULT_HEDGE_AFTER
+        latency = e["latency"] if e["latency"] is not None else DEFAULT_HEDGE_AFTER
+        fail_rate = e["fail"] / max(e["ok"] + e["fail"], 1)
+        recent = e["last_fail"] is not None and now - e["last_fail"] < FAILURE_COOLDOWN
+        return latency * (1 + 4 * fail_rate) + (1e6 if recent else 0.0)
+
+    def ranked(self, urls: list[str]) -> list[str]:
+        now = time.time()
+        # sorted() is stable, so mirrors with no history keep their listed order
+        return sorted(urls, key=lambda u: self._score(u, now))
+
+    def hedge_after(self, url: str) -> float:
+        e = self.stats.get(url)
+        if not e or e["latency"] is None:
+            return DEFAULT_HEDGE_AFTER
+        return min(max(2 * e["latency"], MIN_HEDGE_AFTER), MAX_HEDGE_AFTER)
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        # Unique per process and thread, so concurrent writers never share a temp file
+        tmp = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp.write_text(json.dumps(self.stats, indent=2))
+            tmp.replace(self.path)
+        except OSError as e:
+            # Health is advisory: losing one write must not fail a fetch that worked
+            with contextlib.suppress(OSError):
+                tmp.unlink(missing_ok=True)
+            print(f"   mirror health not saved: {e}")
+
+
+def hedged_fetch(
+    urls: list[str],
+    attempt: Callable[[str, threading.Event], T],
+    health: MirrorHealth,
+    hedge_after: float | None = None,
+    discard: Callable[[T], None] | None = None,
+) -> T:
+    """
+    Call `attempt(url, cancel)` against the healthiest mirror first. If it has
+    not answered within the latency budget, the same request also goes to the
+    next mirror, and so on; a failure starts the next mirror immediately. The
+    first success wins and `cancel` is set so the losers can stop early.
+
+    Attempts run on daemon threads so a loser stuck on a slow mirror never
+    holds up the caller (or interpreter exit). A loser that still succeeds
+    after the winner is passed to `discard` (e.g. to delete its temp file).
+    """
+    remaining = health.ranked(urls)
+    if not remaining:
+        raise ValueError("No mirrors given")
+    budget = hedge_after if hedge_after is not None else health.hedge_after(remaining[0])
+
+    cancel = threading.Event()
+    results: queue.Queue = queue.Queue()
+    started: dict[str, float] = {}
+    errors: dict[str, BaseException] = {}
+    claim = threading.Lock()
+    won: list[str] = []
+
+    def run(url: str) -> None:
+        try:
+            result = attempt(url, cancel)
+        except BaseException as e:
+            results.put((url, None, e))
+            return
+        # Only the first success is handed back; the caller never sees the rest
+        with claim:
+            late = bool(won)
+            if not late:
+                won.append(url)
+        if not late:
+            results.put((url, result, None))
+        elif discard is not None:
+            discard(result)
+
+    def launch() -> None:
+        url = remaining.pop(0)
+        started[url] = time.perf_counter()
+        threading.Thread(target=run, args=(url,), daemon=True, name=f"mirror:{url}").start()
+
+    launch()
+    in_flight = 1
+    while in_flight:
+        try:
+            url, result, err = results.get(timeout=budget if remaining else None)
+        except queue.Empty:
+            launch()
+            in_flight += 1
+            continue
+
+        in_flight -= 1
+        elapsed = time.perf_counter() - started[url]
+        if err is None:
+            cancel.set()
+            health.record_success(url, elapsed)
+            now = time.perf_counter()
+            for other, t0 in started.items():
+                if other != url and other not in errors:
+                    health.record_slow(other, now - t0)
+            return result
+
+        errors[url] = err
+        health.record_failure(url)
+        if remaining:
+            launch()
+            in_flight += 1
+
+    summary = "; ".join(f"{u}: {e}" for u, e in errors.items())
+    raise RuntimeError(f"All mirrors failed. {summary}")
@@ -0,0 +1,42 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+import time
+from tqdm import tqdm
+
+
+def _timed(fn: Callable[[], object]) -> tuple[object, float]:
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def run_concurrently(jobs: dict[str, Callable[[], object]], max_workers: int | None = None) -> dict[str, object]:
+    """
+    Run independent, I/O-bound ingest jobs on a thread pool so wall-clock time is
+    bounded by the slowest source rather than the sum of all of them. Every job
+    runs to completion (so successful downloads still land in the cache) before
+    any failure is raised.
+    """
+    if not jobs:
+        return {}
+
+    results: dict[str, object] = {}
+    errors: dict[str, BaseException] = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as pool:
+        futures = {pool.submit(_timed, fn): name for name, fn in jobs.items()}
+        with tqdm(total=len(jobs), desc="ingest", unit="source") as bar:
+            for fut in as_completed(futures):
+                name = futures[fut]
+                try:
+                    results[name], elapsed = fut.result()
+                    tqdm.write(f"   {name}: done in {elapsed:.1f}s")
+                except Exception as e:
+                    errors[name] = e
+                    tqdm.write(f"   {name}: FAILED ({e})")
+                bar.update(1)
+
+    if errors:
+        summary = "; ".join(f"{k}: {v}" for k, v in errors.items())
+        raise RuntimeError(f"{len(errors)} ingest source(s) failed: {summary}")
+    return results
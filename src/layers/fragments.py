@@ -0,0 +1,92 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Callable, Hashable
+from branca.element import Element, Figure, MacroElement
+from jinja2.utils import htmlsafe_json_dumps
+
+from src.utils.lru import ByteLRU
+
+# Serialising a layer's data into the page is most of the cost of drawing it,
+# and the result only depends on the data files and what is in view. Layer
+# builders therefore take their payload as a ready-made JSON string, which the
+# app keeps in one process-wide ByteLRU so a layer toggled back on (in any
+# session) skips the work.
+#
+# Rendering has to leave that string alone too: branca's MacroElement.render
+# wraps each script in Element(), which compiles it as a Jinja template. For a
+# layer with its data inlined, that lexes the whole payload (twice per rerun, as
+# st_folium renders the map twice) and would choke on a "{{" in the data.
+
+# Loads a static layer file (src/layers/static_assets.py) in the browser. The
+# files are served as-is, so unless the server added a Content-Encoding header
+# the body is still gzip and is inflated here with DecompressionStream.
+FETCH_JSON_JS = """function (url) {
+    return fetch(url).then(function (r) {
+        if (!r.ok) { throw new Error(url + ": HTTP " + r.status); }
+        return r.arrayBuffer();
+    }).then(function (buf) {
+        var head = new Uint8Array(buf, 0, Math.min(2, buf.byteLength));
+        if (head[0] === 0x1f && head[1] === 0x8b) {
+            var body = new Blob([buf]).stream().pipeThrough(new DecompressionStream("gzip"));
+            return new Response(body).json();
+        }
+        return JSON.parse(new TextDecoder().decode(buf));
+    });
+}"""
+
+
+def script_json(data) -> str:
+    """Compact JSON that is safe to inline in a <script> block, like Jinja's `tojson`."""
+    return str(htmlsafe_json_dumps(data, separators=(",", ":")))
+
+
+@dataclass(frozen=True)
+class FragmentCache:
+    """
+    An LRU plus the key of the data the layers are drawn from (the build
+    versions of the selected partitions, the geometry level and the view).
+    Each layer adds its own name to that key.
+    """
+    lru: ByteLRU
+    key: tuple
+
+    def json(self, name: Hashable, build: Callable[[], object]) -> str:
+        return self.lru.get_or_set((*self.key, name), lambda: script_json(build()))
+
+
+def layer_json(cache: FragmentCache | None, name: Hashable, build: Callable[[], object]) -> str:
+    if cache is None:
+        return script_json(build())
+    return cache.json(name, build)
+
+
+class VerbatimElement(Element):
+    """Text that is already rendered and goes into the page as is."""
+
+    def __init__(self, text: str):
+        super().__init__()
+        self.text = text
+
+    def render(self, **kwargs) -> str:
+        return self.text
+
+
+class VerbatimScriptMacro(MacroElement):
+    """
+    MacroElement whose script macro output is added to the page verbatim. Put it
+    after the folium base class (e.g. `class X(folium.TopoJson, VerbatimScriptMacro)`)
+    so folium's own render steps still run before this one.
+    """
+
+    def render(self, **kwargs):
+        figure = self.get_root()
+        assert isinstance(figure, Figure), "You cannot render this Element if it is not in a Figure."
+        module = self._template.module.__dict__
+        if "header" in module:
+            figure.header.add_child(Element(module["header"](self, kwargs)), name=self.get_name())
+        if "html" in module:
+            figure.html.add_child(Element(module["html"](self, kwargs)), name=self.get_name())
+        if "script" in module:
+            figure.script.add_child(VerbatimElement(module["script"](self, kwargs)), name=self.get_name())
+        for element in self._children.values():
+            element.render(**kwargs)
@@ -0,0 +1,151 @@
+from __future__ import annotations
+from pathlib import Path
+import base64
+import io
+import numpy as np
+import pandas as pd
+import folium
+from PIL import Image
+
+from src.ingest.fetch_osm_outlets import BoundingBox
+from src.spatial.geometry_optimize import tolerance_for_zoom, pyramid_level_for_zoom
+from src.utils.instrument import instrumented
+
+# Heat rasters are pre-binned at build time, one PNG per zoom band, so the
+# browser draws one image however many points feed it.
+HEAT_ZOOMS = (6, 8, 10)
+HEAT_CELL_PIXELS = 4       # one histogram cell covers about 4×4 screen pixels at its zoom
+HEAT_SIGMA_CELLS = 4.0     # Gaussian smoothing, in cells (~16 screen px)
+HEAT_MAX_OPACITY = 0.8
+HEAT_GRADIENT = (          # YlOrRd, low → high
+    (0.0, (255, 255, 178)),
+    (0.4, (254, 178, 76)),
+    (0.7, (240, 59, 32)),
+    (1.0, (189, 0, 38)),
+)
+
+HEAT_LAYERS = {
+    "desert": "Food Deserts (heatmap)",
+    "swamp": "Food Swamps (heatmap)",
+}
+
+
+def heat_png_name(layer: str, zoom: int) -> str:
+    return f"{layer}_heat_z{zoom}.png"
+
+
+def _mercator(lat: np.ndarray) -> np.ndarray:
+    # Web-mercator y in "degrees", on the same scale as longitude, so square
+    # cells stay square on screen and an ImageOverlay lines up without warping
+    lat = np.radians(np.clip(lat, -85.0, 85.0))
+    return np.degrees(np.log(np.tan(np.pi / 4 + lat / 2)))
+
+
+def _inverse_mercator(y: float) -> float:
+    return float(np.degrees(2 * np.arctan(np.exp(np.radians(y))) - np.pi / 2))
+
+
+def _blur(grid: np.ndarray, sigma: float) -> np.ndarray:
+    """Separable Gaussian blur as a sum of shifted copies (no SciPy needed)."""
+    radius = max(int(np.ceil(3 * sigma)), 1)
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+    for axis in (0, 1):
+        padded = np.pad(grid, [(radius, radius) if a == axis else (0, 0) for a in (0, 1)])
+        n = grid.shape[axis]
+        grid = sum(
+            k * np.take(padded, np.arange(i, i + n), axis=axis)
+            for i, k in enumerate(kernel)
+        )
+    return grid
+
+
+def heat_grid(points: pd.DataFrame, bbox: BoundingBox, zoom: int, sigma_cells: float = HEAT_SIGMA_CELLS):
+    """
+    Weighted 2-D histogram of (lat, lon, weight) over `bbox` in web-mercator
+    cells sized for `zoom`, smoothed and scaled to 0..1. Returns the grid
+    (north row first, like an image) and its [[south, west], [north, east]].
+    """
+    cell = tolerance_for_zoom(zoom, pixel_fraction=HEAT_CELL_PIXELS)
+    pad = 3 * sigma_cells * cell
+    pts = points.dropna(subset=["lat", "lon", "weight"])
+    lon = pts["lon"].to_numpy(float)
+    west, east = bbox.west, bbox.east
+    if east > 180:
+        # Across the antimeridian: lay the grid out west of -180 instead, so
+        # its bounds line up with features drawn at their own longitudes
+        west, east = west - 360, east - 360
+        lon = np.where(lon > east, lon - 360, lon)
+    x0, x1 = west - pad, east + pad
+    y0, y1 = _mercator(np.array([bbox.south]))[0] - pad, _mercator(np.array([bbox.north]))[0] + pad
+    nx, ny = max(int(np.ceil((x1 - x0) / cell)), 1), max(int(np.ceil((y1 - y0) / cell)), 1)
+    x1, y1 = x0 + nx * cell, y0 + ny * cell
+
+    grid, _, _ = np.histogram2d(
+        _mercator(pts["lat"].to_numpy(float)),
+        lon,
+        bins=(ny, nx),
+        range=((y0, y1), (x0, x1)),
+        weights=pts["weight"].to_numpy(float),
+    )
+    grid = _blur(grid, sigma_cells)[::-1]
+    top = grid.max()
+    grid = grid / top if top > 0 else grid
+    return grid, [[_inverse_mercator(y0), x0], [_inverse_mercator(y1), x1]]
+
+
+def render_heat_png(grid: np.ndarray) -> bytes:
+    stops = np.array([s for s, _ in HEAT_GRADIENT])
+    colors = np.array([c for _, c in HEAT_GRADIENT], dtype=float)
+    rgba = np.empty(grid.shape + (4,), dtype=np.uint8)
+    for ch in range(3):
+        rgba[..., ch] = np.interp(grid, stops, colors[:, ch]).round()
+    # Fade in from transparent so empty areas show the basemap
+    rgba[..., 3] = (np.sqrt(grid) * HEAT_MAX_OPACITY * 255).round()
+    buf = io.BytesIO()
+    Image.fromarray(rgba, "RGBA").save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+
+def build_heat_rasters(points: pd.DataFrame, bbox: BoundingBox, layer: str, out_dir: Path,
+                       zooms: tuple[int, ...] = HEAT_ZOOMS) -> dict:
+    """Write one PNG per zoom band; return {zoom: {"file", "bounds"}} for the heat manifest."""
+    levels = {}
+    for z in zooms:
+        grid, bounds = heat_grid(points, bbox, z)
+        path = out_dir / heat_png_name(layer, z)
+        path.write_bytes(render_heat_png(grid))
+        levels[str(z)] = {"file": path.name, "bounds": bounds}
+    return levels
+
+
+def heat_level_for_zoom(zoom: float, zooms: tuple[int, ...] = HEAT_ZOOMS) -> int:
+    return pyramid_level_for_zoom(zoom, zooms)
+
+
+@instrumented
+def add_heat_overlay(parent: folium.Map | folium.FeatureGroup, png: bytes, bounds: list,
+                     name: str) -> folium.raster_layers.ImageOverlay:
+    return folium.raster_layers.ImageOverlay(
+        image="data:image/png;base64," + base64.b64encode(png).decode("ascii"),
+        bounds=bounds,
+        name=name,
+        interactive=False,
+        zindex=1,
+    ).add_to(parent)
+
+
+@instrumented
+def add_static_heat_overlay(parent: folium.Map | folium.FeatureGroup, url: str, bounds: list,
+                            name: str) -> folium.raster_layers.ImageOverlay:
+    overlay = folium.raster_layers.ImageOverlay(
+        image="data:,",
+        bounds=bounds,
+        name=name,
+        interactive=False,
+        zindex=1,
+    )
+    # Set afterwards: folium would read a site-relative URL as a local file path
+    overlay.url = url
+    return overlay.add_to(parent)
@@ -1,38 +1,128 @@
 from __future__ import annotations
+from dataclasses import dataclass
 import pandas as pd
 import folium
 from folium.plugins import MarkerCluster
+from jinja2 import Template
 
+from src.layers.fragments import FETCH_JSON_JS, FragmentCache, VerbatimScriptMacro, layer_json
+from src.utils.instrument import instrumented
+
+
+@dataclass(frozen=True)
+class PointLayer:
+    name: str
+    color: str
+
+
+POINT_LAYERS = {
+    "healthy": PointLayer("Healthy outlets", "#1a9850"),
+    "unhealthy": PointLayer("Unhealthy outlets", "#f46d43"),
+}
+POINT_TOOLTIP_COLUMNS = ["name", "outlet_type"]
+MARKER_STYLE = {
+    "radius": 3.5,
+    "fill": True,
+    "fillOpacity": 0.85,
+    "opacity": 0.9,
+}
+
+
+class BulkPointCluster(MarkerCluster, VerbatimScriptMacro):
+    """
+    A marker cluster whose points are shipped as one columnar JSON blob and
+    turned into canvas circle markers in the browser, instead of one folium
+    CircleMarker (plus Tooltip) per row. Tooltips are assembled client-side
+    from the tooltip columns, so each value is sent once.
+
+    The blob comes either inline as `data_json`, already serialised (see
+    src/layers/fragments.py), or as `urls` of static files the browser fetches.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var style = {{ this.marker_style|tojson }};
+                var cluster = L.markerClusterGroup({{ this.options|tojson }});
+                var renderer = L.canvas({padding: 0.5});
+                var esc = function (v) {
+                    return String(v).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;");
+                };
+                var add = function (data) {
+                    var markers = new Array(data.lat.length);
+                    for (var i = 0; i < data.lat.length; i++) {
+                        var parts = [];
+                        for (var j = 0; j < data.fields.length; j++) {
+                            var v = data.values[j][i];
+                            if (v !== null) { parts.push(data.fields[j] + ": " + esc(v)); }
+                        }
+                        var opts = Object.assign({renderer: renderer}, style);
+                        markers[i] = L.circleMarker([data.lat[i], data.lon[i]], opts)
+                            .bindTooltip(parts.length ? parts.join("<br>") : data.fallback, {sticky: true});
+                    }
+                    cluster.addLayers(markers);
+                };
+            {% if this.urls %}
+                var fetchJson = {{ this.fetch_js }};
+                {{ this.urls|tojson }}.forEach(function (url) { fetchJson(url).then(add); });
+            {% else %}
+                add({{ this.data_json }});
+            {% endif %}
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}"""
+    )
+
+    def __init__(self, marker_style: dict, name: str | None = None, data_json: str | None = None,
+                 urls: list[str] | None = None, rows: int | None = None, **kwargs):
+        super().__init__(name=name, chunkedLoading=True, **kwargs)
+        self._name = "BulkPointCluster"
+        self.data_json = data_json
+        self.urls = urls or []
+        self.fetch_js = FETCH_JSON_JS
+        self.rows = rows
+        self.marker_style = marker_style
+
+
+def points_payload(points_df: pd.DataFrame, tooltip_cols: list[str], fallback: str) -> dict:
+    pts = points_df.dropna(subset=["lat", "lon"])
+    fields = [c for c in tooltip_cols if c in pts.columns]
+    return {
+        "lat": pts["lat"].astype(float).round(6).tolist(),
+        "lon": pts["lon"].astype(float).round(6).tolist(),
+        "fields": fields,
+        # NaN/None become JSON null and are skipped in the tooltip
+        "values": [pts[c].astype(object).where(pts[c].notna(), None).tolist() for c in fields],
+        "fallback": fallback,
+    }
+
+
+def _marker_style(color: str) -> dict:
+    # `color` is the outline, `fillColor` the fill
+    return {**MARKER_STYLE, "color": color, "fillColor": color}
+
+
+@instrumented
 def add_point_layer(
     m: folium.Map,
     points_df: pd.DataFrame,
     name: str,
     tooltip_cols: list[str],
     color: str,
-):
-    cluster = MarkerCluster(name=name, disableClusteringAtZoom=13)
-    cluster.add_to(m)
-
-    for row in points_df.itertuples(index=False):
-        d = row._asdict()
-        lat, lon = d.get("lat"), d.get("lon")
-        if pd.isna(lat) or pd.isna(lon):
-            continue
-
-        tooltip_parts = []
-        for c in tooltip_cols:
-            if c in d and d[c] is not None:
-                tooltip_parts.append(f"{c}: {d[c]}")
-        tooltip = "<br>".join(tooltip_parts) if tooltip_parts else name
-
-        folium.CircleMarker(
-            location=[float(lat), float(lon)],
-            radius=3.5,
-            color=color,          # outline
-            fill=True,
-            fill_color=color,     # fill
-            fill_opacity=0.85,
-            opacity=0.9,
-            tooltip=folium.Tooltip(tooltip, sticky=True),
-        ).add_to(cluster)
+    cache: FragmentCache | None = None,
+) -> BulkPointCluster:
+    payload = lambda: points_payload(points_df, tooltip_cols, fallback=name)
+    return BulkPointCluster(
+        _marker_style(color),
+        name=name,
+        data_json=layer_json(cache, ("points", name, *tooltip_cols), payload),
+        rows=len(points_df),
+        disableClusteringAtZoom=13,
+    ).add_to(m)
+
 
+@instrumented
+def add_static_point_layer(m: folium.Map, urls: list[str], name: str, color: str) -> BulkPointCluster:
+    return BulkPointCluster(_marker_style(color), name=name, urls=urls, disableClusteringAtZoom=13).add_to(m)
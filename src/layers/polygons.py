@@ -1,186 +1,132 @@
 from __future__ import annotations
-from pathlib import Path
-import geopandas as gpd
-import pandas as pd
+import json
 import folium
+from folium.utilities import JsCode
+from jinja2 import Template
+
+from src.layers.fragments import FETCH_JSON_JS, FragmentCache, VerbatimScriptMacro, layer_json
+from src.layers.store import GeoStore, TRACTS_OBJECT, COUNTIES_OBJECT
+from src.layers.styles import ChoroplethSpec
+from src.utils.instrument import instrumented
+
+# All tract layers read from one GeoStore built from the tract_layers_z*.topojson
+# pyramid, which already holds every score column and each layer's precomputed
+# fill opacity (see src/layers/styles.py). County rollup layers are drawn the
+# same way from the pyramid's "counties" object.
+
+EMPTY_STYLE = {"fillOpacity": 0.0, "weight": 0.2, "opacity": 0.05}
+COUNTY_STYLE = {"fillOpacity": 0.0, "color": "#2b2b2b", "weight": 1.2, "opacity": 0.6}
+
+
+class TopoJsonLayer(folium.TopoJson, VerbatimScriptMacro):
+    """
+    folium's TopoJson, styled by a JS function. The stock class runs a Python
+    style callback over every geometry and writes the result into the data,
+    which would also mutate the GeoStore shared by every session.
+
+    The page gets either `data_json`, the already-serialised TopoJSON to draw,
+    or `urls` of static files holding it (see src/layers/static_assets.py),
+    which the browser fetches in parallel and draws as each one arrives.
+    `data` is only what the tooltip checks its fields against: the store's
+    topology, or for URLs a stand-in carrying just the tooltip's fields.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJson(null, {style: {{ this.style }}})
+                .addTo({{ this._parent.get_name() }});
+            (function () {
+                var layer = {{ this.get_name() }};
+                var add = function (t) { layer.addData(topojson.feature(t, t.objects[{{ this.object_name|tojson }}])); };
+            {% if this.urls %}
+                var fetchJson = {{ this.fetch_js }};
+                {{ this.urls|tojson }}.forEach(function (url) { fetchJson(url).then(add); });
+            {% else %}
+                add({{ this.data_json }});
+            {% endif %}
+            })();
+        {% endmacro %}
+        """
+    )
 
-def add_food_desert_layer(m: folium.Map, tracts_geojson: Path, desert_df: pd.DataFrame):
-    gdf = gpd.read_file(tracts_geojson)
-    merged = (
-        gdf.merge(desert_df, on="GEOID", how="left")
-        .fillna({"desert_severity": 0})
+    def __init__(self, object_name: str, style: JsCode, name: str, tooltip: folium.GeoJsonTooltip,
+                 data: dict | None = None, data_json: str | None = None, urls: list[str] | None = None):
+        if data is None:
+            data = {"objects": {object_name: {"geometries": [{"properties": dict.fromkeys(tooltip.fields)}]}}}
+        super().__init__(data, f"objects.{object_name}", name=name, tooltip=tooltip)
+        self.object_name = object_name
+        self.data_json = data_json
+        self.urls = urls or []
+        self.fetch_js = FETCH_JSON_JS
+        self.style = style
+
+    def get_bounds(self):
+        if self.urls:       # not known until the browser has the files
+            return [[None, None], [None, None]]
+        return super().get_bounds()
+
+    def render(self, **kwargs):
+        # Skip TopoJson.render, whose style_data() writes into self.data
+        super(folium.TopoJson, self).render(**kwargs)
+
+
+def _style_js(spec: ChoroplethSpec) -> JsCode:
+    # Styling runs in the browser from the precomputed opacity property, so
+    # folium never calls back into Python per feature.
+    filled = {"fillColor": spec.fill_color, "color": spec.line_color, "weight": 0.6, "opacity": 0.4}
+    return JsCode(
+        "function (feature) {"
+        f" var o = feature.properties[{json.dumps(spec.opacity_column)}] || 0;"
+        f" if (o <= 0) {{ return {json.dumps(EMPTY_STYLE)}; }}"
+        f" return Object.assign({{fillOpacity: o}}, {json.dumps(filled)});"
+        " }"
     )
 
-    # Compute max severity for normalization (avoid division by zero)
-    max_sev = max(merged["desert_severity"].max(), 1)
-
-    def style_fn(feat):
-        sev = feat["properties"].get("desert_severity", 0) or 0
-
-        if sev <= 0:
-            return {
-                "fillOpacity": 0.0,
-                "weight": 0.2,
-                "opacity": 0.05,
-            }
-
-        # Normalize severity → opacity (0.2 → 0.75)
-        norm = sev / max_sev
-        fill_opacity = 0.2 + 0.55 * norm
-
-        return {
-            "fillColor": "#d73027",  # red
-            "color": "#b22222",      # darker red outline
-            "fillOpacity": fill_opacity,
-            "weight": 0.6,
-            "opacity": 0.4,
-        }
-
-    folium.GeoJson(
-        data=merged.__geo_interface__,
-        name="Food Deserts (polygons)",
-        style_function=style_fn,
-        tooltip=folium.GeoJsonTooltip(
-            fields=["GEOID", "population", "desert_severity"],
-            aliases=["Census Tract", "Population", "Desert Severity"],
-        )
 
-    ).add_to(m)
+def _choropleth_tooltip(spec: ChoroplethSpec) -> folium.GeoJsonTooltip:
+    return folium.GeoJsonTooltip(fields=list(spec.tooltip_fields), aliases=list(spec.tooltip_aliases))
 
 
-def add_food_swamp_layer(m: folium.Map, tracts_geojson: Path, swamp_df: pd.DataFrame):
-    gdf = gpd.read_file(tracts_geojson)
-    merged = (
-        gdf.merge(swamp_df[["GEOID", "swamp_index"]], on="GEOID", how="left")
-        .fillna({"swamp_index": 0.0})
-    )
+def _county_style() -> JsCode:
+    return JsCode(f"function () {{ return {json.dumps(COUNTY_STYLE)}; }}")
 
-    # Cap extreme swamp values to stabilize color scaling
-    cap = merged["swamp_index"].quantile(0.95)
-    cap = max(cap, 1.0)
-
-    def style_fn(feat):
-        v = float(feat["properties"].get("swamp_index", 0.0) or 0.0)
-
-        if v <= 0:
-            return {
-                "fillOpacity": 0.0,
-                "weight": 0.2,
-                "opacity": 0.05,
-            }
-
-        # Normalize and clamp
-        norm = min(v / cap, 1.0)
-
-        # Opacity range: 0.2 → 0.7
-        fill_opacity = 0.2 + 0.5 * norm
-
-        return {
-            "fillColor": "#fee08b",  # yellow
-            "color": "#d9a400",      # darker yellow outline
-            "fillOpacity": fill_opacity,
-            "weight": 0.6,
-            "opacity": 0.4,
-        }
-
-    folium.GeoJson(
-        data=merged.__geo_interface__,
-        name="Food Swamps (polygons)",
-        style_function=style_fn,
-        tooltip=folium.GeoJsonTooltip(
-            fields=["GEOID", "population", "swamp_index"],
-            aliases=["Census Tract", "Population", "Food Swamp Index"],
-        )
 
+@instrumented
+def add_choropleth_layer(m: folium.Map, tracts: GeoStore, spec: ChoroplethSpec,
+                         cache: FragmentCache | None = None) -> TopoJsonLayer:
+    columns = [*spec.tooltip_fields, spec.opacity_column]
+    return TopoJsonLayer(
+        tracts.object_name,
+        data=tracts.topology,
+        data_json=layer_json(cache, ("choropleth", tracts.object_name, *columns),
+                             lambda: tracts.with_properties(columns).topology),
+        name=spec.name,
+        style=_style_js(spec),
+        tooltip=_choropleth_tooltip(spec),
     ).add_to(m)
 
-def add_pop_weighted_food_desert_layer(m, tracts_geojson: Path, df: pd.DataFrame):
-    gdf = gpd.read_file(tracts_geojson)
-    merged = gdf.merge(
-        df[["GEOID", "pop_weighted_desert"]],
-        on="GEOID",
-        how="left"
-    ).fillna({"pop_weighted_desert": 0})
-
-    cap = merged["pop_weighted_desert"].quantile(0.95)
-    cap = max(cap, 1)
-
-    def style_fn(feat):
-        v = feat["properties"].get("pop_weighted_desert", 0)
-        if v <= 0:
-            return {"fillOpacity": 0.0, "weight": 0.2, "opacity": 0.05}
-
-        norm = min(v / cap, 1.0)
-        fill_opacity = 0.25 + 0.55 * norm
-
-        return {
-            "fillColor": "#d73027",
-            "color": "#b22222",
-            "fillOpacity": fill_opacity,
-            "weight": 0.6,
-            "opacity": 0.4,
-        }
-
-    folium.GeoJson(
-        merged.__geo_interface__,
-        name="Food Deserts (population-weighted)",
-        style_function=style_fn,
-        tooltip=folium.GeoJsonTooltip(
-            fields=["GEOID", "pop_weighted_desert"],
-            aliases=["Census Tract", "Population-weighted desert impact"],
-        ),
-    ).add_to(m)
 
-def add_pop_weighted_food_swamp_layer(m, tracts_geojson: Path, df: pd.DataFrame):
-    gdf = gpd.read_file(tracts_geojson)
-    merged = gdf.merge(
-        df[["GEOID", "pop_weighted_swamp"]],
-        on="GEOID",
-        how="left"
-    ).fillna({"pop_weighted_swamp": 0})
-
-    cap = merged["pop_weighted_swamp"].quantile(0.95)
-    cap = max(cap, 1)
-
-    def style_fn(feat):
-        v = feat["properties"].get("pop_weighted_swamp", 0)
-        if v <= 0:
-            return {"fillOpacity": 0.0, "weight": 0.2, "opacity": 0.05}
-
-        norm = min(v / cap, 1.0)
-        fill_opacity = 0.25 + 0.5 * norm
-
-        return {
-            "fillColor": "#fee08b",
-            "color": "#d9a400",
-            "fillOpacity": fill_opacity,
-            "weight": 0.6,
-            "opacity": 0.4,
-        }
-
-    folium.GeoJson(
-        merged.__geo_interface__,
-        name="Food Swamps (population-weighted)",
-        style_function=style_fn,
-        tooltip=folium.GeoJsonTooltip(
-            fields=["GEOID", "pop_weighted_swamp"],
-            aliases=["Census Tract", "Population-weighted swamp impact"],
-        ),
-    ).add_to(m)
+@instrumented
+def add_static_choropleth_layer(m: folium.Map, urls: list[str], spec: ChoroplethSpec,
+                                object_name: str = TRACTS_OBJECT) -> TopoJsonLayer:
+    return TopoJsonLayer(object_name, urls=urls, name=spec.name, style=_style_js(spec),
+                         tooltip=_choropleth_tooltip(spec)).add_to(m)
 
 
-
-def add_county_boundaries(m: folium.Map, counties_geojson: Path):
-    gdf = gpd.read_file(counties_geojson)
-
-    folium.GeoJson(
-        gdf.__geo_interface__,
+@instrumented
+def add_county_boundaries(m: folium.Map, counties: GeoStore, cache: FragmentCache | None = None) -> TopoJsonLayer:
+    return TopoJsonLayer(
+        counties.object_name,
+        data=counties.topology,
+        data_json=layer_json(cache, "counties", lambda: counties.with_properties(["NAME"]).topology),
         name="County boundaries",
-        style_function=lambda _: {
-            "fillOpacity": 0.0,
-            "color": "#2b2b2b",
-            "weight": 1.2,
-            "opacity": 0.6,
-        },
+        style=_county_style(),
         tooltip=folium.GeoJsonTooltip(fields=["NAME"], aliases=["County"]),
     ).add_to(m)
+
+
+@instrumented
+def add_static_county_boundaries(m: folium.Map, urls: list[str]) -> TopoJsonLayer:
+    return TopoJsonLayer(COUNTIES_OBJECT, urls=urls, name="County boundaries", style=_county_style(),
+                         tooltip=folium.GeoJsonTooltip(fields=["NAME"], aliases=["County"])).add_to(m)
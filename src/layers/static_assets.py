@@ -0,0 +1,96 @@
+from __future__ import annotations
+from pathlib import Path
+import gzip
+import hashlib
+import json
+
+import pandas as pd
+
+from src.layers.points import points_payload, POINT_LAYERS, POINT_TOOLTIP_COLUMNS
+from src.layers.store import geo_store_from_topology, TRACTS_OBJECT, COUNTIES_OBJECT
+from src.layers.styles import CHOROPLETH_LAYERS, COUNTY_CHOROPLETH_LAYERS
+
+# Static mode: instead of inlining layer data into the page on every rerun,
+# the build writes each layer once as a gzipped JSON file named by its content
+# hash, and the map fetches it by URL. Streamlit serves static files with
+# "Cache-Control: no-cache", so browsers revalidate each file on load (an
+# unchanged one comes back as a bodiless 304) rather than caching it outright;
+# the hashed names just mean a page never mixes old and new data. The
+# partition's static_layers.json says which file holds what.
+STATIC_INDEX = "static_layers.json"
+# Earlier versions of each file kept on disk, so a page opened before a
+# rebuild can still fetch the URLs it was given
+KEEP_VERSIONS = 2
+
+
+def write_asset(out_dir: Path, stem: str, body: bytes, suffix: str) -> str:
+    """
+    Write `body` as `{stem}.{hash}{suffix}`, keeping the KEEP_VERSIONS most
+    recently written older versions of the same stem and deleting the rest.
+    Returns the file name.
+    """
+    name = f"{stem}.{hashlib.sha256(body).hexdigest()[:12]}{suffix}"
+    path = out_dir / name
+    if path.exists():
+        path.touch()  # current again: order it ahead of the versions it replaced
+    else:
+        path.write_bytes(body)
+    older = [p for p in out_dir.glob(f"{stem}.*{suffix}") if p.name != name]
+    older.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in older[KEEP_VERSIONS:]:
+        old.unlink()
+    return name
+
+
+def write_json_asset(out_dir: Path, stem: str, data) -> str:
+    # mtime=0 so the same data always compresses to the same bytes (and name)
+    body = gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), compresslevel=9, mtime=0)
+    return write_asset(out_dir, stem, body, ".json.gz")
+
+
+def publish_static_layers(out_dir: Path, tract_layers: dict[int, Path], points: dict[str, pd.DataFrame],
+                          heat: dict[str, dict], heat_dir: Path) -> dict:
+    """
+    Write every layer the app can draw as a static file under `out_dir`:
+    each tract and county choropleth (the latter keyed "county_<layer>") and
+    the county outlines at every pyramid level, the
+    outlet points, and the heat PNGs listed in `heat` (the heat manifest).
+    Returns the index to save as STATIC_INDEX.
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    levels = {}
+    for z, path in tract_layers.items():
+        topology = json.loads(path.read_text())
+        tracts = geo_store_from_topology(topology, TRACTS_OBJECT)
+        files = {
+            key: write_json_asset(
+                out_dir, f"{key}_z{z}",
+                tracts.with_properties([*spec.tooltip_fields, spec.opacity_column]).topology,
+            )
+            for key, spec in CHOROPLETH_LAYERS.items()
+        }
+        counties = geo_store_from_topology(topology, COUNTIES_OBJECT)
+        files.update({
+            f"county_{key}": write_json_asset(
+                out_dir, f"county_{key}_z{z}",
+                counties.with_properties([*spec.tooltip_fields, spec.opacity_column]).topology,
+            )
+            for key, spec in COUNTY_CHOROPLETH_LAYERS.items()
+        })
+        files["counties"] = write_json_asset(out_dir, f"counties_z{z}", counties.with_properties(["NAME"]).topology)
+        levels[str(z)] = files
+    point_files = {
+        key: write_json_asset(out_dir, f"{key}_points",
+                              points_payload(df, POINT_TOOLTIP_COLUMNS, fallback=POINT_LAYERS[key].name))
+        for key, df in points.items()
+    }
+    heat_files = {
+        layer: {
+            z: {"file": write_asset(out_dir, Path(level["file"]).stem,
+                                    (heat_dir / level["file"]).read_bytes(), ".png"),
+                "bounds": level["bounds"]}
+            for z, level in zooms.items()
+        }
+        for layer, zooms in heat.items()
+    }
+    return {"levels": levels, "points": point_files, "heat": heat_files}
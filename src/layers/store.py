@@ -0,0 +1,78 @@
+from __future__ import annotations
+from pathlib import Path
+from dataclasses import dataclass
+import json
+import pandas as pd
+
+from src.spatial.topology import subset_topology, merge_topologies, topology_bounds
+
+# One TopoJSON file per geometry pyramid level, named by the level's minimum
+# zoom. Each holds a "tracts" and a "counties" object sharing the same arcs.
+TRACT_LAYERS_TEMPLATE = "tract_layers_z{zoom}.topojson"
+TRACTS_OBJECT = "tracts"
+COUNTIES_OBJECT = "counties"
+BOUNDS_COLUMNS = ["minx", "miny", "maxx", "maxy"]
+
+
+@dataclass(frozen=True)
+class GeoStore:
+    """
+    A polygon layer's data, parsed once: its TopoJSON (one object, sent to the
+    browser as-is) and a frame of each feature's properties plus its bounds
+    (BOUNDS_COLUMNS) for lookups and viewport queries. Every layer drawn from
+    the same store shares the same objects, so treat both as read-only.
+
+    `frame` always holds every feature, while `topology` may be narrowed to
+    the features in view with `with_features`.
+    """
+    frame: pd.DataFrame
+    topology: dict
+    object_name: str
+
+    @property
+    def geometries(self) -> list[dict]:
+        return self.topology["objects"][self.object_name]["geometries"]
+
+    def with_features(self, positions) -> "GeoStore":
+        subset = subset_topology(self.topology, self.object_name, positions)
+        return GeoStore(frame=self.frame, topology=subset, object_name=self.object_name)
+
+    def with_properties(self, columns) -> "GeoStore":
+        """The same features carrying only `columns`, so a layer ships just what it draws."""
+        columns = list(columns)
+        geometries = [
+            {**g, "properties": {c: (g.get("properties") or {}).get(c) for c in columns}}
+            for g in self.geometries
+        ]
+        topology = {**self.topology, "objects": {self.object_name: {"type": "GeometryCollection",
+                                                                    "geometries": geometries}}}
+        return GeoStore(frame=self.frame, topology=topology, object_name=self.object_name)
+
+    def total_bounds(self) -> tuple[float, float, float, float]:
+        b = self.frame[BOUNDS_COLUMNS]
+        return b["minx"].min(), b["miny"].min(), b["maxx"].max(), b["maxy"].max()
+
+
+def tract_layers_name(zoom: int) -> str:
+    return TRACT_LAYERS_TEMPLATE.format(zoom=zoom)
+
+
+def geo_store_from_topology(topology: dict, object_name: str) -> GeoStore:
+    """Keep only `object_name` and its arcs, and index its properties and bounds."""
+    topology = subset_topology(topology, object_name)
+    geometries = topology["objects"][object_name]["geometries"]
+    frame = pd.DataFrame([g.get("properties") or {} for g in geometries])
+    frame[BOUNDS_COLUMNS] = topology_bounds(topology, object_name)
+    return GeoStore(frame=frame, topology=topology, object_name=object_name)
+
+
+def concat_geo_stores(stores: list[GeoStore]) -> GeoStore:
+    if len(stores) == 1:
+        return stores[0]
+    name = stores[0].object_name
+    frame = pd.concat([s.frame for s in stores], ignore_index=True)
+    return GeoStore(frame=frame, topology=merge_topologies([s.topology for s in stores], name), object_name=name)
+
+
+def read_geo_store(path: Path, object_name: str = TRACTS_OBJECT) -> GeoStore:
+    return geo_store_from_topology(json.loads(path.read_text()), object_name)
@@ -0,0 +1,182 @@
+from __future__ import annotations
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+from src.metrics.food_swamp import SWAMP_RADII_MI, swamp_radius_column
+
+
+@dataclass(frozen=True)
+class ChoroplethSpec:
+    """
+    How one tract score is drawn. Opacity scales linearly from `min_opacity`
+    to `max_opacity` as the score goes from 0 to the cap; tracts scoring 0 are
+    drawn as faint outlines only. `cap` is "max" or a quantile such as 0.95
+    (extreme values are clamped to it), never below `cap_floor`.
+    """
+    column: str
+    name: str
+    fill_color: str
+    line_color: str
+    min_opacity: float
+    max_opacity: float
+    tooltip_fields: tuple[str, ...]
+    tooltip_aliases: tuple[str, ...]
+    cap: str | float = 0.95
+    cap_floor: float = 1.0
+
+    @property
+    def opacity_column(self) -> str:
+        return f"{self.column}_opacity"
+
+
+CHOROPLETH_LAYERS = {
+    "desert": ChoroplethSpec(
+        column="desert_severity",
+        name="Food Deserts (polygons)",
+        fill_color="#d73027",  # red
+        line_color="#b22222",  # darker red outline
+        min_opacity=0.2,
+        max_opacity=0.75,
+        tooltip_fields=("GEOID", "population", "desert_severity"),
+        tooltip_aliases=("Census Tract", "Population", "Desert Severity"),
+        cap="max",
+    ),
+    "swamp": ChoroplethSpec(
+        column="swamp_index",
+        name="Food Swamps (polygons)",
+        fill_color="#fee08b",  # yellow
+        line_color="#d9a400",  # darker yellow outline
+        min_opacity=0.2,
+        max_opacity=0.7,
+        tooltip_fields=("GEOID", "population", "swamp_index"),
+        tooltip_aliases=("Census Tract", "Population", "Food Swamp Index"),
+    ),
+    "pop_weighted_desert": ChoroplethSpec(
+        column="pop_weighted_desert",
+        name="Food Deserts (population-weighted)",
+        fill_color="#d73027",
+        line_color="#b22222",
+        min_opacity=0.25,
+        max_opacity=0.8,
+        tooltip_fields=("GEOID", "pop_weighted_desert"),
+        tooltip_aliases=("Census Tract", "Population-weighted desert impact"),
+    ),
+    "pop_weighted_swamp": ChoroplethSpec(
+        column="pop_weighted_swamp",
+        name="Food Swamps (population-weighted)",
+        fill_color="#fee08b",
+        line_color="#d9a400",
+        min_opacity=0.25,
+        max_opacity=0.75,
+        tooltip_fields=("GEOID", "pop_weighted_swamp"),
+        tooltip_aliases=("Census Tract", "Population-weighted swamp impact"),
+    ),
+    "supermarket_distance": ChoroplethSpec(
+        column="nearest_healthy_mi",
+        name="Distance to nearest supermarket",
+        fill_color="#762a83",  # purple
+        line_color="#542788",
+        min_opacity=0.1,
+        max_opacity=0.75,
+        tooltip_fields=("GEOID", "nearest_healthy_mi", "healthy_within_1mi", "healthy_within_10mi"),
+        tooltip_aliases=("Census Tract", "Nearest supermarket (mi)", "Within 1 mi", "Within 10 mi"),
+    ),
+}
+
+# One layer per radius of the radius-based swamp index, keyed "swamp_within_<r>mi"
+CHOROPLETH_LAYERS.update({
+    f"swamp_within_{r:g}mi": ChoroplethSpec(
+        column=swamp_radius_column(r),
+        name=f"Food Swamps (within {r:g} mi)",
+        fill_color="#fee08b",
+        line_color="#d9a400",
+        min_opacity=0.2,
+        max_opacity=0.7,
+        tooltip_fields=("GEOID", f"swamp_healthy_{r:g}mi", f"swamp_unhealthy_{r:g}mi", swamp_radius_column(r)),
+        tooltip_aliases=("Census Tract", f"Healthy within {r:g} mi", f"Unhealthy within {r:g} mi", "Food Swamp Index"),
+    )
+    for r in SWAMP_RADII_MI
+})
+
+# County rollups (src/metrics/rollup.py) drawn instead of a tract layer at low
+# zoom, keyed by the tract layer they replace. They sit on the pyramid's
+# "counties" object, which carries the county rows of the rollup cube.
+COUNTY_CHOROPLETH_LAYERS = {
+    "desert": ChoroplethSpec(
+        column="desert_severity",
+        name="Food Deserts (county average)",
+        fill_color="#d73027",
+        line_color="#b22222",
+        min_opacity=0.2,
+        max_opacity=0.75,
+        tooltip_fields=("NAME", "population", "desert_severity", "desert_rank"),
+        tooltip_aliases=("County", "Population", "Desert Severity (population-weighted)", "Rank in state"),
+        cap="max",
+        cap_floor=0.1,
+    ),
+    "swamp": ChoroplethSpec(
+        column="swamp_index",
+        name="Food Swamps (county average)",
+        fill_color="#fee08b",
+        line_color="#d9a400",
+        min_opacity=0.2,
+        max_opacity=0.7,
+        tooltip_fields=("NAME", "population", "healthy_count", "unhealthy_count", "swamp_index", "swamp_rank"),
+        tooltip_aliases=("County", "Population", "Healthy outlets", "Unhealthy outlets",
+                         "Food Swamp Index (population-weighted)", "Rank in state"),
+        cap="max",
+        cap_floor=0.1,
+    ),
+    "pop_weighted_desert": ChoroplethSpec(
+        column="desert_population",
+        name="Food Deserts (county population affected)",
+        fill_color="#d73027",
+        line_color="#b22222",
+        min_opacity=0.25,
+        max_opacity=0.8,
+        tooltip_fields=("NAME", "desert_population", "desert_share"),
+        tooltip_aliases=("County", "Population in desert tracts", "Share of population"),
+    ),
+    "pop_weighted_swamp": ChoroplethSpec(
+        column="swamp_population",
+        name="Food Swamps (county population affected)",
+        fill_color="#fee08b",
+        line_color="#d9a400",
+        min_opacity=0.25,
+        max_opacity=0.75,
+        tooltip_fields=("NAME", "swamp_population", "swamp_share"),
+        tooltip_aliases=("County", "Population in swamp tracts", "Share of population"),
+    ),
+}
+
+# Zoom levels at or below this draw COUNTY_CHOROPLETH_LAYERS instead of tracts
+COUNTY_ROLLUP_MAX_ZOOM = 7
+
+
+def style_cap(values: pd.Series, spec: ChoroplethSpec) -> float:
+    v = values.fillna(0).astype(float)
+    cap = v.max() if spec.cap == "max" else v.quantile(float(spec.cap))
+    return float(max(cap if np.isfinite(cap) else 0.0, spec.cap_floor))
+
+
+def fill_opacity(values: pd.Series, cap: float, spec: ChoroplethSpec) -> np.ndarray:
+    v = values.fillna(0).to_numpy(dtype=float)
+    norm = np.clip(v / cap, 0.0, 1.0)
+    opacity = spec.min_opacity + (spec.max_opacity - spec.min_opacity) * norm
+    return np.where(v > 0, opacity, 0.0).round(3)
+
+
+def add_style_columns(df: pd.DataFrame, specs: dict[str, ChoroplethSpec] = CHOROPLETH_LAYERS) -> tuple[pd.DataFrame, dict]:
+    """
+    Precompute each layer's per-tract fill opacity as a column, so the map can
+    style features straight from their properties. Returns the frame and the
+    caps used, keyed by layer, for the build's style manifest.
+    """
+    out = df.copy()
+    caps = {}
+    for key, spec in specs.items():
+        cap = style_cap(out[spec.column], spec)
+        out[spec.opacity_column] = fill_opacity(out[spec.column], cap, spec)
+        caps[key] = {"column": spec.column, "cap": cap}
+    return out, caps
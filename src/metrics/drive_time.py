@@ -0,0 +1,41 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+from src.spatial.road_network import RoadGraph, multi_source_dijkstra
+
+# Straight-line hop between a point and its nearest road node
+CONNECTOR_SPEED_MPH = 15.0
+# Searches stop here; tracts further than this from any supermarket get NaN
+DRIVE_CUTOFF_MINUTES = 90.0
+
+
+def compute_drive_times(
+    points: pd.DataFrame,
+    healthy_outlets: pd.DataFrame,
+    graph: RoadGraph,
+    cutoff_minutes: float = DRIVE_CUTOFF_MINUTES,
+) -> pd.DataFrame:
+    """
+    Drive time in minutes from each point (GEOID, lat, lon) to its nearest
+    healthy outlet, from a single multi-source search seeded at every outlet.
+    """
+    pts = points.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+    outlets = healthy_outlets.dropna(subset=["lat", "lon"])
+    minutes = np.full(len(pts), np.nan)
+
+    if len(pts) and len(outlets) and graph.n_nodes:
+        to_hours = 1.0 / CONNECTOR_SPEED_MPH
+        src, src_mi = graph.nearest_nodes(outlets["lat"].to_numpy(float), outlets["lon"].to_numpy(float))
+        dst, dst_mi = graph.nearest_nodes(pts["lat"].to_numpy(float), pts["lon"].to_numpy(float))
+        seconds = multi_source_dijkstra(
+            graph,
+            sources=src,
+            source_seconds=src_mi * to_hours * 3600.0,
+            targets=dst,
+            cutoff=cutoff_minutes * 60.0,
+        )
+        total = seconds[dst] / 60.0 + dst_mi * to_hours * 60.0
+        minutes = np.where(total <= cutoff_minutes, total, np.nan)
+
+    return pd.DataFrame({"GEOID": pts["GEOID"], "drive_minutes": np.round(minutes, 1)})
@@ -0,0 +1,127 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+import shapely
+from pyproj import Transformer
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_MILE = 1609.344
+ACCESS_RADII_MI = (1, 10, 20)
+CHUNK_SIZE = 5000
+
+
+def haversine_mi(lat1, lon1, lat2, lon2) -> np.ndarray:
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0))) / METERS_PER_MILE
+
+
+class OutletIndex:
+    """
+    STRtree over outlets projected to a spherical azimuthal-equidistant plane
+    centred on the data. On that plane distances are never shorter than the
+    great-circle distance and at most `stretch` times longer, so the tree
+    gives exact candidate sets for a radius `r` by querying `stretch * r`;
+    candidates are then checked with the haversine formula.
+    """
+
+    def __init__(self, outlets: pd.DataFrame, extent: pd.DataFrame | None = None):
+        pts = outlets.dropna(subset=["lat", "lon"])
+        self.lat = pts["lat"].to_numpy(float)
+        self.lon = pts["lon"].to_numpy(float)
+
+        everything = pts if extent is None else pd.concat([pts[["lat", "lon"]], extent[["lat", "lon"]]])
+        lat0 = float((everything["lat"].min() + everything["lat"].max()) / 2) if len(everything) else 0.0
+        lon0 = float((everything["lon"].min() + everything["lon"].max()) / 2) if len(everything) else 0.0
+        self._to_plane = Transformer.from_crs(
+            "EPSG:4326",
+            f"+proj=aeqd +lat_0={lat0} +lon_0={lon0} +R={EARTH_RADIUS_M} +units=m",
+            always_xy=True,
+        )
+        # Largest angular distance from the centre sets the worst-case stretch
+        c = 0.0
+        if len(everything):
+            c = float((haversine_mi(lat0, lon0, everything["lat"], everything["lon"]).max()
+                       * METERS_PER_MILE / EARTH_RADIUS_M))
+        c = min(c, 3.0)
+        self.stretch = (c / np.sin(c) if c > 1e-9 else 1.0) * 1.001
+
+        self.tree = shapely.STRtree(self._project(self.lat, self.lon))
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    def _project(self, lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+        x, y = self._to_plane.transform(lon, lat)
+        return shapely.points(x, y)
+
+    def nearest(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Great-circle distance (miles) to, and position of, each point's nearest outlet."""
+        n = len(lat)
+        dist = np.full(n, np.nan)
+        idx = np.full(n, -1, dtype=np.int64)
+        if n == 0 or len(self) == 0:
+            return dist, idx
+        geoms = self._project(lat, lon)
+        # The planar nearest neighbour bounds the true one: nothing further
+        # than `stretch` × its great-circle distance can beat it
+        (src, dst) = self.tree.query_nearest(geoms, all_matches=False)
+        bound = haversine_mi(lat[src], lon[src], self.lat[dst], self.lon[dst])
+        dist[src], idx[src] = bound, dst
+        reach = np.empty(n)
+        reach[src] = bound * METERS_PER_MILE * self.stretch + 1.0
+        for start in range(0, n, CHUNK_SIZE):
+            sl = slice(start, start + CHUNK_SIZE)
+            s, d = self.tree.query(geoms[sl], predicate="dwithin", distance=reach[sl])
+            s = s + start
+            h = haversine_mi(lat[s], lon[s], self.lat[d], self.lon[d])
+            # Closest candidate per point: sort by (point, distance), keep the first
+            order = np.lexsort((h, s))
+            s, d, h = s[order], d[order], h[order]
+            first = np.r_[True, s[1:] != s[:-1]]
+            s, d, h = s[first], d[first], h[first]
+            better = h < dist[s]
+            dist[s[better]] = h[better]
+            idx[s[better]] = d[better]
+        return dist, idx
+
+    def count_within(self, lat: np.ndarray, lon: np.ndarray, radii_mi=ACCESS_RADII_MI) -> dict[float, np.ndarray]:
+        """Number of outlets within each radius (miles) of each point, in one tree pass."""
+        n = len(lat)
+        counts = {r: np.zeros(n, dtype=np.int64) for r in radii_mi}
+        if n == 0 or len(self) == 0:
+            return counts
+        geoms = self._project(lat, lon)
+        reach = max(radii_mi) * METERS_PER_MILE * self.stretch + 1.0
+        for start in range(0, n, CHUNK_SIZE):
+            sl = slice(start, start + CHUNK_SIZE)
+            s, d = self.tree.query(geoms[sl], predicate="dwithin", distance=reach)
+            h = haversine_mi(lat[sl][s], lon[sl][s], self.lat[d], self.lon[d])
+            for r in radii_mi:
+                counts[r][sl] += np.bincount(s[h <= r], minlength=len(geoms[sl]))
+        return counts
+
+
+def within_column(radius_mi: float) -> str:
+    return f"healthy_within_{radius_mi:g}mi"
+
+
+def compute_supermarket_access(
+    points: pd.DataFrame,
+    healthy_outlets: pd.DataFrame,
+    radii_mi=ACCESS_RADII_MI,
+) -> pd.DataFrame:
+    """
+    For each point (a tract centroid or population point with GEOID, lat and
+    lon), the great-circle distance in miles to the nearest healthy outlet and
+    how many healthy outlets lie within each radius.
+    """
+    pts = points.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+    lat, lon = pts["lat"].to_numpy(float), pts["lon"].to_numpy(float)
+    index = OutletIndex(healthy_outlets, extent=pts)
+
+    dist, _ = index.nearest(lat, lon)
+    out = pd.DataFrame({"GEOID": pts["GEOID"], "nearest_healthy_mi": dist.round(2)})
+    for r, c in index.count_within(lat, lon, radii_mi).items():
+        out[within_column(r)] = c
+    return out
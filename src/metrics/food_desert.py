@@ -1,11 +1,21 @@
 from __future__ import annotations
 import pandas as pd
 
-def compute_food_desert_scores(usda_df: pd.DataFrame) -> pd.DataFrame:
-    df = usda_df.copy()
+from src.ingest.fetch_usda_food_access import GEOID_COLUMNS, is_desert_flag
+
+# Tracts whose drive to the nearest supermarket exceeds this get an extra flag
+DRIVE_LOW_ACCESS_MINUTES = 15.0
+
+def compute_food_desert_scores(
+    usda_df: pd.DataFrame,
+    drive_times: pd.DataFrame | None = None,
+    drive_threshold_minutes: float = DRIVE_LOW_ACCESS_MINUTES,
+) -> pd.DataFrame:
+    # Only the id and flag columns are touched, so copy just those
+    df = usda_df[[c for c in usda_df.columns if c in GEOID_COLUMNS or is_desert_flag(c)]].copy()
 
     geoid_col = None
-    for c in ["CensusTract", "GEOID", "geoid", "TRACTID", "CensusTractId"]:
+    for c in GEOID_COLUMNS:
         if c in df.columns:
             geoid_col = c
             break
@@ -14,7 +24,15 @@ def compute_food_desert_scores(usda_df: pd.DataFrame) -> pd.DataFrame:
 
     df["GEOID"] = df[geoid_col].astype(str).str.zfill(11)
 
-    candidate_flags = [c for c in df.columns if "LILA" in c.upper() or "LOWACCESS" in c.upper()]
+    if drive_times is not None:
+        # Road-network indicator; a tract with no supermarket within reach
+        # (NaN drive time) counts as low access, one not in the table doesn't
+        minutes = drive_times.drop_duplicates("GEOID").set_index("GEOID")["drive_minutes"]
+        covered = df["GEOID"].isin(minutes.index)
+        slow = ~(df["GEOID"].map(minutes) <= drive_threshold_minutes)
+        df["LowAccessDrive"] = (covered & slow).astype(int)
+
+    candidate_flags = [c for c in df.columns if is_desert_flag(c)]
     if not candidate_flags:
         df["desert_severity"] = 0
         df["is_food_desert"] = False
@@ -1,6 +1,8 @@
 from __future__ import annotations
 import pandas as pd
 
+from src.metrics.food_access import OutletIndex
+
 def compute_food_swamp_index(healthy_points: pd.DataFrame, unhealthy_points: pd.DataFrame) -> pd.DataFrame:
     h = healthy_points.dropna(subset=["GEOID"]).groupby("GEOID").size().rename("healthy_count")
     u = unhealthy_points.dropna(subset=["GEOID"]).groupby("GEOID").size().rename("unhealthy_count")
@@ -9,3 +11,34 @@ def compute_food_swamp_index(healthy_points: pd.DataFrame, unhealthy_points: pd.
     df["unhealthy_count"] = df["unhealthy_count"].astype(int)
     df["swamp_index"] = df["unhealthy_count"] / (df["healthy_count"] + 1.0)
     return df
+
+
+# Radii (miles) computed in one pass by the radius swamp index
+SWAMP_RADII_MI = (1, 2, 5)
+
+def swamp_radius_column(radius_mi: float) -> str:
+    return f"swamp_index_{radius_mi:g}mi"
+
+def compute_radius_swamp_index(
+    points: pd.DataFrame,
+    healthy_points: pd.DataFrame,
+    unhealthy_points: pd.DataFrame,
+    radii_mi=SWAMP_RADII_MI,
+) -> pd.DataFrame:
+    """
+    Swamp index from the outlets within each radius of a tract's centroid
+    rather than inside its boundary, so an outlet just over a tract line still
+    counts and tiny urban tracts aren't dominated by one or two outlets. All
+    radii come from the same tree queries.
+    """
+    pts = points.dropna(subset=["lat", "lon"]).reset_index(drop=True)
+    lat, lon = pts["lat"].to_numpy(float), pts["lon"].to_numpy(float)
+    healthy = OutletIndex(healthy_points, extent=pts).count_within(lat, lon, radii_mi)
+    unhealthy = OutletIndex(unhealthy_points, extent=pts).count_within(lat, lon, radii_mi)
+
+    out = pd.DataFrame({"GEOID": pts["GEOID"]})
+    for r in radii_mi:
+        out[f"swamp_healthy_{r:g}mi"] = healthy[r]
+        out[f"swamp_unhealthy_{r:g}mi"] = unhealthy[r]
+        out[swamp_radius_column(r)] = (unhealthy[r] / (healthy[r] + 1.0)).round(3)
+    return out
@@ -1,14 +1,205 @@
 from __future__ import annotations
+from pathlib import Path
+from typing import Iterator
+import hashlib
+import os
+
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
+
+# Store inventories live one file per store, named by the store's OSM id with
+# "/" replaced by "_" (node_123.csv, way_456.parquet). Each row is one item:
+# a `category` (required) and optionally a `quantity` used as its weight
+# (shelf units, facings, ...); other columns such as sku or price are ignored.
+INVENTORY_EXTENSIONS = (".csv", ".parquet")
+INVENTORY_CHUNK_ROWS = 250_000
+HEALTHY_ITEM_SCORE = 60
+
+# Nutrient-category lookup: 0 (no nutritional value) .. 100. A categories.csv
+# (category,score) in the inventory directory overrides or extends it.
+DEFAULT_CATEGORY_SCORES = {
+    "fresh_produce": 100,
+    "frozen_vegetables": 90,
+    "frozen_fruit": 90,
+    "legumes": 90,
+    "whole_grains": 85,
+    "fish_seafood": 85,
+    "nuts_seeds": 80,
+    "eggs": 75,
+    "lean_meat": 75,
+    "canned_vegetables": 70,
+    "canned_fruit": 60,
+    "dairy": 60,
+    "bread_bakery": 45,
+    "processed_meat": 30,
+    "refined_grains": 30,
+    "prepared_meals": 30,
+    "frozen_meals": 25,
+    "snacks": 15,
+    "sweets": 10,
+    "candy": 5,
+    "sugary_drinks": 5,
+    "alcohol": 0,
+}
+
+# Per-store running totals, one row per store in the cache and in the output
+TOTALS = ["n_items", "n_known", "weight", "weighted_score", "healthy_weight"]
+
+
+def normalize_category(values: pd.Series) -> pd.Series:
+    return values.astype("string").str.strip().str.lower().str.replace(r"[\s\-/]+", "_", regex=True)
+
+
+def load_category_scores(path: Path | None = None) -> pd.Series:
+    scores = pd.Series(DEFAULT_CATEGORY_SCORES, dtype=float)
+    if path is not None and path.exists():
+        custom = pd.read_csv(path, usecols=["category", "score"])
+        custom = pd.Series(custom["score"].to_numpy(float), index=normalize_category(custom["category"]))
+        scores = pd.concat([scores, custom]).groupby(level=0).last()
+    scores.index.name = "category"
+    return scores.rename("score")
+
+
+def lookup_version(scores: pd.Series) -> str:
+    """Changes whenever any category's score does, which invalidates every cached store."""
+    return hashlib.sha256(scores.sort_index().to_json().encode()).hexdigest()[:16]
+
+
+def store_key(osm_id: str) -> str:
+    return osm_id.replace("/", "_")
+
+
+def inventory_files(inventory_dir: Path | None) -> dict[str, Path]:
+    """{store key: file} for every inventory file in the directory."""
+    if inventory_dir is None or not inventory_dir.is_dir():
+        return {}
+    return {
+        p.name[: -len(ext)]: p
+        for p in sorted(inventory_dir.iterdir())
+        for ext in INVENTORY_EXTENSIONS
+        if p.name.endswith(ext)
+    }
+
 
-def compute_nutrition_scores_stub(healthy_points: pd.DataFrame):
+def inventory_signature(inventory_dir: Path | None) -> dict[str, list[int]]:
+    """(size, mtime) of every inventory file; cheap enough to compare on every build."""
+    return {key: _stat(p) for key, p in inventory_files(inventory_dir).items()}
+
+
+def _stat(path: Path) -> list[int]:
+    st = path.stat()
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _chunks(path: Path, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    if path.suffix == ".parquet":
+        pf = pq.ParquetFile(path)
+        columns = [c for c in ("category", "quantity") if c in pf.schema_arrow.names]
+        for batch in pf.iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=lambda c: c in ("category", "quantity"), chunksize=chunk_rows)
+
+
+def score_inventory(path: Path, scores: pd.Series, chunk_rows: int = INVENTORY_CHUNK_ROWS) -> dict[str, float]:
+    """
+    Stream one store's inventory in chunks and return its TOTALS. Only the
+    distinct categories of a chunk are normalised and looked up; item scores
+    then come from one array index, so memory stays at one chunk.
+    """
+    totals = dict.fromkeys(TOTALS, 0.0)
+    lookup = scores.to_numpy(float)
+    for chunk in _chunks(path, chunk_rows):
+        if "category" not in chunk:
+            raise ValueError(f"{path} has no 'category' column")
+        codes, uniques = pd.factorize(chunk["category"])
+        positions = scores.index.get_indexer(normalize_category(pd.Series(uniques)))
+        item_pos = np.where(codes >= 0, positions[codes], -1)
+        known = item_pos >= 0
+        item_score = np.where(known, lookup[item_pos], 0.0)
+        weight = (
+            pd.to_numeric(chunk["quantity"], errors="coerce").fillna(1.0).clip(lower=0).to_numpy(float)
+            if "quantity" in chunk else np.ones(len(chunk))
+        )
+        weight = np.where(known, weight, 0.0)
+        totals["n_items"] += len(chunk)
+        totals["n_known"] += int(known.sum())
+        totals["weight"] += float(weight.sum())
+        totals["weighted_score"] += float((weight * item_score).sum())
+        totals["healthy_weight"] += float(weight[item_score >= HEALTHY_ITEM_SCORE].sum())
+    return totals
+
+
+def update_store_totals(
+    stores: list[str],
+    inventory_dir: Path | None,
+    scores: pd.Series,
+    cache_path: Path,
+    chunk_rows: int = INVENTORY_CHUNK_ROWS,
+) -> pd.DataFrame:
+    """
+    TOTALS for each store key in `stores` that has an inventory file. Totals
+    are cached per store with the file's size and mtime and the lookup
+    version, so only stores whose file (or the lookup) changed are re-read.
+    """
+    files = inventory_files(inventory_dir)
+    version = lookup_version(scores)
+    cached = pd.read_parquet(cache_path) if cache_path.exists() else pd.DataFrame(columns=["store", "size", "mtime_ns", "lookup"])
+    cached = cached.set_index("store")
+
+    rows, rescored = [], 0
+    for key in sorted(set(stores) & set(files)):
+        size, mtime_ns = _stat(files[key])
+        if key in cached.index:
+            hit = cached.loc[key]
+            if hit["size"] == size and hit["mtime_ns"] == mtime_ns and hit["lookup"] == version:
+                rows.append({"store": key, **hit.to_dict()})
+                continue
+        rows.append({"store": key, "size": size, "mtime_ns": mtime_ns, "lookup": version,
+                     **score_inventory(files[key], scores, chunk_rows)})
+        rescored += 1
+    print(f"   nutrition: {rescored} store inventories scored, {len(rows) - rescored} unchanged")
+
+    totals = pd.DataFrame(rows, columns=["store", "size", "mtime_ns", "lookup", *TOTALS])
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(cache_path.name + ".tmp")
+    totals.to_parquet(tmp, index=False)
+    os.replace(tmp, cache_path)
+    return totals
+
+
+def compute_nutrition_scores(
+    healthy_points: pd.DataFrame,
+    inventory_dir: Path | None,
+    cache_path: Path,
+    categories_path: Path | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Score each healthy outlet from its inventory (0..100: the weighted mean
+    item score) and roll up to tracts. Outlets without an inventory file get
+    no score rather than a zero.
+    """
+    scores = load_category_scores(categories_path)
     stores = healthy_points.copy()
-    stores["nutrition_score"] = 0.0
+    stores["store"] = stores["osm_id"].astype("string").map(store_key, na_action="ignore")
+    totals = update_store_totals(stores["store"].dropna().tolist(), inventory_dir, scores, cache_path)
+    stores = stores.merge(totals[["store", *TOTALS]], on="store", how="left")
+
+    weight = stores["weight"].where(stores["weight"] > 0)
+    stores["nutrition_score"] = stores["weighted_score"] / weight
+    stores["healthy_share"] = stores["healthy_weight"] / weight
+    stores["coverage"] = stores["n_known"] / stores["n_items"].where(stores["n_items"] > 0)
+    store_cols = ["osm_id", "name", "lat", "lon", "GEOID", "nutrition_score", "healthy_share", "n_items", "coverage"]
+
+    scored = stores.dropna(subset=["GEOID", "nutrition_score"])
     tract = (
-        stores.dropna(subset=["GEOID"])
-        .groupby("GEOID")["nutrition_score"]
-        .mean()
-        .rename("nutrition_score")
+        scored.groupby("GEOID")
+        .agg(
+            nutrition_score=("nutrition_score", "mean"),
+            best_store_score=("nutrition_score", "max"),
+            scored_stores=("nutrition_score", "size"),
+        )
         .reset_index()
     )
-    return stores[["name", "lat", "lon", "GEOID", "nutrition_score"]], tract
+    return stores[store_cols], tract
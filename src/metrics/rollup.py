@@ -0,0 +1,119 @@
+from __future__ import annotations
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+# One table of every tract, county, state and user region with the same
+# measures, so the app reads county tooltips and rankings from a few hundred
+# precomputed rows instead of grouping tracts on every rerun.
+ROLLUP_LEVELS = ("tract", "county", "state", "region")
+# Additive measures: a rollup is their sum, so partitions combine by adding
+SUM_COLUMNS = [
+    "tracts", "population", "healthy_count", "unhealthy_count",
+    "pop_weighted_desert", "pop_weighted_swamp", "desert_population", "swamp_population",
+]
+RANKED = {"desert_severity": "desert_rank", "swamp_index": "swamp_rank"}
+# A tract's population counts as living in a food swamp above this index:
+# more unhealthy outlets than healthy ones plus one
+SWAMP_AFFECTED_INDEX = 1.0
+
+
+def tract_measures(tracts: pd.DataFrame, desert_pop: pd.DataFrame, swamp_pop: pd.DataFrame) -> pd.DataFrame:
+    """GEOID, NAME and SUM_COLUMNS per tract; tracts missing from a score table score 0."""
+    names = tracts["NAME"] if "NAME" in tracts else tracts["GEOID"]
+    df = (
+        tracts[["GEOID", "population"]].assign(NAME=names)
+        .merge(desert_pop[["GEOID", "desert_severity"]].drop_duplicates("GEOID"), on="GEOID", how="left")
+        .merge(swamp_pop[["GEOID", "healthy_count", "unhealthy_count", "swamp_index"]].drop_duplicates("GEOID"),
+               on="GEOID", how="left")
+    )
+    df = df.fillna({"population": 0, "desert_severity": 0, "healthy_count": 0, "unhealthy_count": 0, "swamp_index": 0})
+    df[["healthy_count", "unhealthy_count"]] = df[["healthy_count", "unhealthy_count"]].astype(int)
+    pop = df["population"].astype(float)
+    df["tracts"] = 1
+    df["pop_weighted_desert"] = df["desert_severity"] * pop
+    df["pop_weighted_swamp"] = df["swamp_index"] * pop
+    df["desert_population"] = pop.where(df["desert_severity"] > 0, 0.0)
+    df["swamp_population"] = pop.where(df["swamp_index"] > SWAMP_AFFECTED_INDEX, 0.0)
+    return df[["GEOID", "NAME", *SUM_COLUMNS]]
+
+
+def assign_regions(tracts: gpd.GeoDataFrame, regions: gpd.GeoDataFrame, name_column: str = "name") -> pd.DataFrame:
+    """
+    (GEOID, region) for each tract whose interior point falls in a region
+    polygon. Regions may overlap, in which case a tract counts toward each.
+    """
+    regions = regions.to_crs(tracts.crs)
+    tree = shapely.STRtree(regions.geometry.to_numpy())
+    points = shapely.point_on_surface(tracts.geometry.to_numpy())
+    pts, hits = tree.query(points, predicate="intersects")
+    return pd.DataFrame({
+        "GEOID": tracts["GEOID"].to_numpy(object)[pts],
+        "region": regions[name_column].astype(str).to_numpy(object)[hits],
+    }).drop_duplicates()
+
+
+def _rollup(measures: pd.DataFrame, level: str, keys: pd.Series, names: pd.Series | None = None) -> pd.DataFrame:
+    out = measures[SUM_COLUMNS].groupby(keys.to_numpy()).sum()
+    out.index.name = "key"
+    out = out.reset_index()
+    out["name"] = out["key"].map(names) if names is not None else out["key"]
+    out["name"] = out["name"].fillna(out["key"])
+    return out.assign(level=level)
+
+
+def build_rollup(
+    measures: pd.DataFrame,
+    county_names: pd.Series,
+    state_names: pd.Series,
+    tract_regions: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """
+    The cube: one row per (level, key). Counties are keyed by the 5-digit
+    state+county GEOID prefix and states by the 2-digit one; `county_names`
+    and `state_names` map those keys to display names.
+    """
+    geoid = measures["GEOID"].astype(str)
+    parts = [
+        measures.rename(columns={"GEOID": "key", "NAME": "name"}).assign(level="tract"),
+        _rollup(measures, "county", geoid.str[:5], county_names),
+        _rollup(measures, "state", geoid.str[:2], state_names),
+    ]
+    if tract_regions is not None and len(tract_regions):
+        in_region = measures.merge(tract_regions, on="GEOID")
+        parts.append(_rollup(in_region, "region", in_region["region"]))
+    return finish_rollup(pd.concat(parts, ignore_index=True))
+
+
+def finish_rollup(cube: pd.DataFrame) -> pd.DataFrame:
+    """Population-weighted scores and per-level ranks (1 = worst) from the summed measures."""
+    cube = cube.copy()
+    pop = cube["population"].astype(float).where(cube["population"] > 0)
+    cube["desert_severity"] = cube["pop_weighted_desert"] / pop
+    cube["swamp_index"] = cube["pop_weighted_swamp"] / pop
+    cube["desert_share"] = cube["desert_population"] / pop
+    cube["swamp_share"] = cube["swamp_population"] / pop
+    for col, rank in RANKED.items():
+        cube[rank] = cube.groupby("level")[col].rank(ascending=False, method="min").astype("Int64")
+    order = pd.Categorical(cube["level"], categories=ROLLUP_LEVELS, ordered=True)
+    cube = cube.assign(_order=order).sort_values(["_order", "key"]).drop(columns="_order")
+    columns = ["level", "key", "name", *SUM_COLUMNS, "desert_severity", "swamp_index", "desert_share",
+               "swamp_share", *RANKED.values()]
+    return cube[columns].reset_index(drop=True)
+
+
+def combine_rollups(cube: pd.DataFrame) -> pd.DataFrame:
+    """
+    Merge the cubes of several partitions (concatenated): a region that spans
+    states has one row per state until its sums are added, and ranks are
+    recomputed over everything selected.
+    """
+    sums = cube.groupby(["level", "key"], sort=False).agg(
+        {"name": "first", **{c: "sum" for c in SUM_COLUMNS}}
+    ).reset_index()
+    return finish_rollup(sums)
+
+
+def level_rows(cube: pd.DataFrame, level: str) -> pd.DataFrame:
+    return cube[np.asarray(cube["level"] == level, dtype=bool)].reset_index(drop=True)
@@ -0,0 +1,38 @@
+from __future__ import annotations
+import geopandas as gpd
+import pandas as pd
+
+SCORE_COLUMNS = ["desert_severity", "swamp_index", "pop_weighted_desert", "pop_weighted_swamp"]
+
+
+def merge_tract_scores(
+    tracts: gpd.GeoDataFrame | pd.DataFrame,
+    desert_df: pd.DataFrame,
+    desert_pop_df: pd.DataFrame,
+    swamp_df: pd.DataFrame,
+    swamp_pop_df: pd.DataFrame,
+    access_df: pd.DataFrame | None = None,
+    swamp_radius_df: pd.DataFrame | None = None,
+) -> gpd.GeoDataFrame | pd.DataFrame:
+    """
+    Attach every per-tract score to the tract table (polygons or just their
+    attributes) so the app can draw all polygon layers from one frame. Tracts
+    missing from a score table get 0, matching how the layers treat them.
+    Supermarket access and radius swamp columns are attached as-is: a missing
+    distance means no outlet was found, not a distance of 0.
+    """
+    merged = tracts
+    for df, col in [
+        (desert_df, "desert_severity"),
+        (swamp_df, "swamp_index"),
+        (desert_pop_df, "pop_weighted_desert"),
+        (swamp_pop_df, "pop_weighted_swamp"),
+    ]:
+        merged = merged.merge(df[["GEOID", col]].drop_duplicates("GEOID"), on="GEOID", how="left")
+
+    merged = merged.fillna({c: 0 for c in SCORE_COLUMNS})
+    merged["desert_severity"] = merged["desert_severity"].astype(int)
+    for extra in (access_df, swamp_radius_df):
+        if extra is not None:
+            merged = merged.merge(extra.drop_duplicates("GEOID"), on="GEOID", how="left")
+    return merged
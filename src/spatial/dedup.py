@@ -0,0 +1,111 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+
+from src.metrics.food_access import EARTH_RADIUS_M, METERS_PER_MILE, haversine_mi
+
+# Overpass returns a store mapped as both a POI node and a building way twice,
+# a few metres to ~100 m apart (the way comes back as its centre).
+DEDUP_DISTANCE_M = 100.0
+METERS_PER_DEGREE = EARTH_RADIUS_M * np.pi / 180
+# Half of the 3x3 neighbourhood (plus the cell itself), so each cell pair is visited once
+_NEIGHBOURS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def normalize_name(values: pd.Series) -> pd.Series:
+    """Lower-cased alphanumerics without store numbers ("Food Lion #1234" -> "foodlion"); <NA> if nothing is left."""
+    key = (
+        values.astype("string")
+        .str.lower()
+        .str.replace(r"#\s*\d+|\bstore\s+\d+\b|^the\s+", "", regex=True)
+        .str.replace(r"[^0-9a-z]+", "", regex=True)
+    )
+    return key.mask(key.isin(["", "unknown"]))
+
+
+def candidate_pairs(lat: np.ndarray, lon: np.ndarray, distance_m: float) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Every pair (i < j) of points within `distance_m`. Points are hashed into
+    grid cells at least `distance_m` across, so a match can only sit in the
+    same or a neighbouring cell; each cell's members are found with one
+    searchsorted over the sorted cell keys, then the candidates are checked
+    with the haversine formula.
+    """
+    n = len(lat)
+    if n < 2:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    # Longitude cells are sized at the highest latitude present, where a degree is shortest
+    cell_lat = distance_m / METERS_PER_DEGREE
+    cell_lon = cell_lat / max(np.cos(np.radians(np.abs(lat).max())), 1e-6)
+    cx = np.floor(lon / cell_lon).astype(np.int64)
+    cy = np.floor(lat / cell_lat).astype(np.int64)
+    span = int(cy.max() - cy.min()) + 3
+    cy = cy - cy.min() + 1
+
+    order = np.argsort(cx * span + cy, kind="stable")
+    keys = (cx * span + cy)[order]
+    left, right = [], []
+    for dx, dy in _NEIGHBOURS:
+        target = keys + dx * span + dy
+        start = np.searchsorted(keys, target, side="left")
+        stop = np.searchsorted(keys, target, side="right")
+        if (dx, dy) == (0, 0):
+            start = np.arange(n) + 1  # only later members of the same cell
+        counts = np.maximum(stop - start, 0)
+        src = np.repeat(np.arange(n), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        left.append(order[src])
+        right.append(order[np.repeat(start, counts) + offsets])
+    i, j = np.concatenate(left), np.concatenate(right)
+    close = haversine_mi(lat[i], lon[i], lat[j], lon[j]) * METERS_PER_MILE <= distance_m
+    i, j = i[close], j[close]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+def connected_labels(n: int, i: np.ndarray, j: np.ndarray) -> np.ndarray:
+    """Smallest member index of each point's group, following chains of pairs (A~B, B~C)."""
+    labels = np.arange(n)
+    while True:
+        low = np.minimum(labels[i], labels[j])
+        before = labels.copy()
+        np.minimum.at(labels, i, low)
+        np.minimum.at(labels, j, low)
+        labels = labels[labels]
+        if np.array_equal(labels, before):
+            return labels
+
+
+def dedupe_outlets(points: pd.DataFrame, distance_m: float = DEDUP_DISTANCE_M) -> pd.DataFrame:
+    """
+    Merge outlets that are the same store: within `distance_m` of each other
+    and with the same normalised name or brand, or both unnamed with one a
+    node and the other a way. Chains of such pairs form one group. Each group
+    keeps one row, preferring a named one, then a way (its centre lies inside
+    the building), then the lowest osm_id; input order is otherwise kept.
+    Call it per outlet type, so a store is never merged with a different kind.
+    """
+    pts = points.reset_index(drop=True)
+    lat = pts["lat"].to_numpy(float)
+    lon = pts["lon"].to_numpy(float)
+    i, j = candidate_pairs(lat, lon, distance_m)
+
+    # Missing keys become "" so comparisons stay plain boolean arrays
+    name = normalize_name(pts["name"]).fillna("").to_numpy(object)
+    brand = normalize_name(pts["brand"]).fillna("").to_numpy(object) if "brand" in pts else np.full(len(pts), "", object)
+    is_way = pts["osm_id"].astype(str).str.startswith("way/").to_numpy()
+    same_name = (name[i] == name[j]) & (name[i] != "")
+    same_brand = (brand[i] == brand[j]) & (brand[i] != "")
+    unnamed_pair = (name[i] == "") & (name[j] == "") & (is_way[i] != is_way[j])
+    match = same_name | same_brand | unnamed_pair
+
+    group = connected_labels(len(pts), i[match], j[match])
+    rank = pd.DataFrame({
+        "group": group,
+        "unnamed": name == "",
+        "node": ~is_way,
+        "osm_id": pts["osm_id"].astype(str).to_numpy(),
+    }).sort_values(["group", "unnamed", "node", "osm_id"], kind="stable")
+    keep = np.sort(rank.drop_duplicates("group").index.to_numpy())
+    merged = len(pts) - len(keep)
+    print(f"   dedup: merged {merged} duplicate outlets ({len(pts)} -> {len(keep)}) within {distance_m:g} m")
+    return pts.iloc[keep].reset_index(drop=True)
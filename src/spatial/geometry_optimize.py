@@ -1,5 +1,8 @@
 from __future__ import annotations
 import geopandas as gpd
+import pandas as pd
+
+from src.spatial.topology import build_topology, merge_layer, topology_polygons, to_topojson
 
 def simplify_polygons(gdf: gpd.GeoDataFrame, tolerance: float = 0.001) -> gpd.GeoDataFrame:
     out = gdf.copy()
@@ -7,8 +10,49 @@ def simplify_polygons(gdf: gpd.GeoDataFrame, tolerance: float = 0.001) -> gpd.Ge
     out["geometry"] = out["geometry"].buffer(0)  # fix invalids
     return out
 
+def simplify_shared_borders(gdf: gpd.GeoDataFrame, tolerance: float = 0.001) -> gpd.GeoDataFrame:
+    # Simplifies each shared border once, so neighbours stay aligned without buffer(0) repairs
+    out = gdf.copy()
+    topo = build_topology({"layer": gdf.geometry.values})
+    out["geometry"] = gpd.GeoSeries(topology_polygons(topo, "layer", tolerance), index=gdf.index, crs=gdf.crs)
+    return out
+
 def drop_large_columns(gdf: gpd.GeoDataFrame, keep: list[str]) -> gpd.GeoDataFrame:
     cols = [c for c in keep if c in gdf.columns]
     if "geometry" not in cols:
         cols.append("geometry")
     return gdf[cols]
+
+# Minimum zoom of each pyramid level; a level serves zooms up to the next one.
+PYRAMID_ZOOMS = (7, 9, 11, 13)
+
+def tolerance_for_zoom(zoom: int, pixel_fraction: float = 0.5) -> float:
+    # Web-mercator tiles are 256 px wide and span 360° at zoom 0
+    return pixel_fraction * 360.0 / (256 * 2 ** zoom)
+
+def pyramid_level_for_zoom(zoom: float, zooms: tuple[int, ...] = PYRAMID_ZOOMS) -> int:
+    # Coarsest level whose simplification is still sub-pixel-ish at this zoom
+    eligible = [z for z in zooms if z <= zoom]
+    return max(eligible) if eligible else min(zooms)
+
+def topology_pyramid(
+    tracts: gpd.GeoDataFrame,
+    properties: pd.DataFrame,
+    county_names: pd.DataFrame | None = None,
+    zooms: tuple[int, ...] = PYRAMID_ZOOMS,
+) -> dict[int, dict]:
+    """
+    TopoJSON per pyramid level with a "tracts" object (carrying `properties`,
+    matched on GEOID) and a "counties" object merged from the tracts by
+    COUNTYFP (carrying `county_names`' NAME and any other columns, matched on
+    COUNTYFP). Both use one set of shared arcs, simplified once per level.
+    """
+    topo = build_topology({"tracts": tracts.geometry.values})
+    topo, fips = merge_layer(topo, "tracts", tracts["COUNTYFP"].astype(str).to_numpy(), "counties")
+    tract_props = tracts[["GEOID"]].merge(properties, on="GEOID", how="left")
+    counties = pd.DataFrame({"COUNTYFP": fips})
+    if county_names is not None:
+        counties = counties.merge(county_names.drop_duplicates("COUNTYFP"), on="COUNTYFP", how="left")
+    counties["NAME"] = counties.get("NAME", counties["COUNTYFP"]).fillna(counties["COUNTYFP"])
+    layers = {"tracts": tract_props, "counties": counties}
+    return {z: to_topojson(topo, layers, tolerance_for_zoom(z)) for z in zooms}
@@ -0,0 +1,241 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+from array import array
+import heapq
+import numpy as np
+import pandas as pd
+import pyogrio
+import shapely
+
+from src.metrics.food_access import haversine_mi
+
+# Free-flow speeds by OSM highway class, used when a way has no usable maxspeed
+HIGHWAY_SPEEDS_MPH = {
+    "motorway": 65, "motorway_link": 45,
+    "trunk": 55, "trunk_link": 40,
+    "primary": 45, "primary_link": 35,
+    "secondary": 40, "secondary_link": 30,
+    "tertiary": 35, "tertiary_link": 25,
+    "unclassified": 30, "residential": 25, "living_street": 10,
+    "service": 15, "road": 25,
+}
+KMH_PER_MPH = 1.609344
+BATCH_SIZE = 50_000
+
+_ONEWAY_FORWARD = {"yes", "true", "1", "f"}
+_ONEWAY_REVERSE = {"-1", "reverse", "t"}
+_ONEWAY_BOTH = {"no", "false", "0", "b"}
+
+
+@dataclass(frozen=True)
+class RoadGraph:
+    """
+    Road network as a CSR adjacency over intersections. Edges are stored
+    reversed (from where you arrive to where you came from), so a search from
+    the supermarkets gives every node's drive time *to* its nearest one.
+    """
+    indptr: np.ndarray    # int64, len n_nodes + 1
+    indices: np.ndarray   # int32 neighbour node per edge
+    seconds: np.ndarray   # float32 travel time per edge
+    lon: np.ndarray
+    lat: np.ndarray
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.lon)
+
+    def nearest_nodes(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Closest node to each point and the straight-line distance to it in miles."""
+        tree = shapely.STRtree(shapely.points(self.lon, self.lat))
+        _, node = tree.query_nearest(shapely.points(lon, lat), all_matches=False)
+        return node, haversine_mi(lat, lon, self.lat[node], self.lon[node])
+
+
+def _tag(other_tags: pd.Series, key: str) -> pd.Series:
+    return other_tags.str.extract(f'"{key}"=>"([^"]*)"', expand=False)
+
+
+def _speeds_mph(highway: pd.Series, maxspeed: pd.Series) -> np.ndarray:
+    default = highway.map(HIGHWAY_SPEEDS_MPH).to_numpy(float)
+    m = maxspeed.astype("string").str.extract(r"^\s*(\d+(?:\.\d+)?)\s*(mph)?", expand=True)
+    value = pd.to_numeric(m[0], errors="coerce").to_numpy(float)
+    value = np.where(m[1].notna().to_numpy(), value, value / KMH_PER_MPH)
+    return np.where(np.isfinite(value) & (value > 0), value, default)
+
+
+def _oneway(highway: pd.Series, oneway: pd.Series, junction: pd.Series) -> np.ndarray:
+    """1 = drivable along the way's direction only, -1 = against it, 0 = both."""
+    o = oneway.astype("string").str.lower()
+    forward = o.isin(_ONEWAY_FORWARD).fillna(False).to_numpy(bool)
+    reverse = o.isin(_ONEWAY_REVERSE).fillna(False).to_numpy(bool)
+    tagged = forward | reverse | o.isin(_ONEWAY_BOTH).fillna(False).to_numpy(bool)
+    # Motorways and roundabouts are one-way unless tagged otherwise
+    implied = (highway.isin(["motorway", "motorway_link"]) | (junction.astype("string") == "roundabout"))
+    implied = implied.fillna(False).to_numpy(bool) & ~tagged
+    return np.select([forward | implied, reverse], [1, -1], 0).astype(np.int8)
+
+
+def _way_attributes(batch: pd.DataFrame) -> tuple[pd.Series, np.ndarray, np.ndarray]:
+    if "other_tags" in batch.columns:            # GDAL's OSM driver (.osm / .osm.pbf)
+        tags = batch["other_tags"].astype("string")
+        highway = batch["highway"].astype("string")
+        maxspeed, oneway, junction = _tag(tags, "maxspeed"), _tag(tags, "oneway"), _tag(tags, "junction")
+    else:                                        # any line layer with highway (or Geofabrik fclass) columns
+        highway = batch["highway" if "highway" in batch.columns else "fclass"].astype("string")
+        none = pd.Series(pd.NA, index=batch.index, dtype="string")
+        maxspeed = batch["maxspeed"] if "maxspeed" in batch.columns else none
+        oneway = batch["oneway"] if "oneway" in batch.columns else none
+        junction = batch["junction"] if "junction" in batch.columns else none
+    return highway, _speeds_mph(highway, maxspeed), _oneway(highway, oneway, junction)
+
+
+def _node_keys(coords: np.ndarray) -> np.ndarray:
+    # OSM stores coordinates at 1e-7 degrees; pack lat/lon into one int64
+    lat = np.round(coords[:, 1] * 1e7).astype(np.int64)
+    lon = np.round(coords[:, 0] * 1e7).astype(np.int64)
+    return (lat + 2**30) * 2**32 + (lon + 2**31)
+
+
+def load_road_graph(path: Path) -> RoadGraph:
+    """
+    Read the drivable ways of a local road extract (.osm/.osm.pbf through GDAL's
+    OSM driver, or a line layer such as a Geofabrik shapefile) in batches, and
+    build a CSR graph over intersections. Vertices that only shape a single way
+    are folded into the edge between its intersections, which shrinks a state
+    graph several times over.
+    """
+    is_osm = path.name.endswith((".osm", ".osm.pbf"))
+    fields = set(pyogrio.read_info(path, layer="lines" if is_osm else None)["fields"])
+    wanted = ["highway", "other_tags"] if is_osm else [
+        c for c in ("highway", "fclass", "oneway", "maxspeed", "junction") if c in fields
+    ]
+    highway_col = "highway" if "highway" in wanted else "fclass"
+    drivable = ", ".join(f"'{h}'" for h in HIGHWAY_SPEEDS_MPH)
+
+    keys, way_ids, cost, oneway = [], [], [], []
+    n_ways = 0
+    with pyogrio.open_arrow(
+        path,
+        layer="lines" if is_osm else None,
+        columns=wanted,
+        where=f"{highway_col} IN ({drivable})",
+        use_pyarrow=True,
+        batch_size=BATCH_SIZE,
+    ) as (meta, reader):
+        geom_col = meta["geometry_name"] or "wkb_geometry"
+        for batch in reader:
+            attrs = batch.drop_columns([geom_col]).to_pandas()
+            _, speed, ow = _way_attributes(attrs)
+            geoms = shapely.from_wkb(batch.column(geom_col).to_numpy(zero_copy_only=False))
+            coords, line = shapely.get_coordinates(geoms, return_index=True)
+            if not len(coords):
+                continue
+            # Seconds from each vertex to the next one on the same way (0 at the end)
+            same = np.r_[line[1:] == line[:-1], False]
+            nxt = np.r_[coords[1:], coords[-1:]]
+            miles = np.where(same, haversine_mi(coords[:, 1], coords[:, 0], nxt[:, 1], nxt[:, 0]), 0.0)
+            keys.append(_node_keys(coords))
+            way_ids.append(line + n_ways)
+            cost.append(miles / speed[line] * 3600.0)
+            oneway.append(ow[line])
+            n_ways += len(geoms)
+
+    if not keys:
+        raise ValueError(f"No drivable roads found in {path}")
+    keys, way_ids = np.concatenate(keys), np.concatenate(way_ids)
+    cost, oneway = np.concatenate(cost), np.concatenate(oneway)
+
+    # Intersections: way endpoints and vertices shared by more than one way position
+    uniq, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    first = np.r_[True, way_ids[1:] != way_ids[:-1]]
+    last = np.r_[way_ids[1:] != way_ids[:-1], True]
+    is_node = first | last | (counts[inverse] > 1)
+
+    pos = np.flatnonzero(is_node)
+    cum = np.r_[0.0, np.cumsum(cost)[:-1]]
+    a, b = pos[:-1], pos[1:]
+    keep = way_ids[a] == way_ids[b]
+    a, b = a[keep], b[keep]
+    secs = cum[b] - cum[a]
+    ow = oneway[a]
+
+    node_keys, node_of = np.unique(inverse[np.r_[a, b]], return_inverse=True)
+    u, v = node_of[: len(a)], node_of[len(a):]
+    # Reversed travel edges: forward travel u->v is stored as v->u
+    src = np.r_[v[ow >= 0], u[ow <= 0]]
+    dst = np.r_[u[ow >= 0], v[ow <= 0]]
+    w = np.r_[secs[ow >= 0], secs[ow <= 0]]
+
+    order = np.argsort(src, kind="stable")
+    n = len(node_keys)
+    indptr = np.r_[0, np.cumsum(np.bincount(src, minlength=n))].astype(np.int64)
+    node_key = uniq[node_keys]
+    lat = ((node_key // 2**32) - 2**30) / 1e7
+    lon = ((node_key % 2**32) - 2**31) / 1e7
+    return RoadGraph(
+        indptr=indptr,
+        indices=dst[order].astype(np.int32),
+        seconds=w[order].astype(np.float32),
+        lon=lon,
+        lat=lat,
+    )
+
+
+def multi_source_dijkstra(
+    graph: RoadGraph,
+    sources: np.ndarray,
+    source_seconds: np.ndarray | None = None,
+    targets: np.ndarray | None = None,
+    cutoff: float = np.inf,
+) -> np.ndarray:
+    """
+    One Dijkstra run seeded with every source at once (at its own starting
+    cost), so each node ends up with the cost to its nearest source. Stops
+    early once every target is settled or the frontier passes `cutoff`
+    seconds; unreached nodes are inf.
+    """
+    # Typed arrays index almost as fast as lists at a fraction of the memory
+    indptr = array("q", graph.indptr.tobytes())
+    indices = array("i", graph.indices.astype(np.int32).tobytes())
+    weights = array("d", graph.seconds.astype(np.float64).tobytes())
+    dist = array("d", [np.inf]) * graph.n_nodes
+    done = bytearray(graph.n_nodes)
+
+    start = np.zeros(len(sources)) if source_seconds is None else np.asarray(source_seconds, float)
+    heap = []
+    for node, d in zip(np.asarray(sources).tolist(), start.tolist()):
+        if d < dist[node]:
+            dist[node] = d
+            heap.append((d, node))
+    heapq.heapify(heap)
+
+    want = None
+    if targets is not None:
+        want = bytearray(graph.n_nodes)
+        for t in np.unique(targets).tolist():
+            want[t] = 1
+        remaining = sum(want)
+
+    pop, push = heapq.heappop, heapq.heappush
+    while heap:
+        d, node = pop(heap)
+        if done[node]:
+            continue
+        if d > cutoff:
+            break
+        done[node] = 1
+        if want is not None and want[node]:
+            remaining -= 1
+            if not remaining:
+                break
+        for i in range(indptr[node], indptr[node + 1]):
+            nb = indices[i]
+            nd = d + weights[i]
+            if nd < dist[nb]:
+                dist[nb] = nd
+                push(heap, (nd, nb))
+
+    out = np.frombuffer(dist, dtype=np.float64).copy()
+    out[np.frombuffer(done, dtype=np.uint8) == 0] = np.inf
+    return out
@@ -0,0 +1,448 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from itertools import chain
+import numpy as np
+import pandas as pd
+import shapely
+
+# Vertices are matched on a 1e-6° grid (~0.1 m), the precision Census
+# shapefiles are published at, so a border shared by two polygons is found
+# even when their float coordinates differ in the last bits.
+SNAP_DEGREES = 1e-6
+# Output coordinates are integers on a grid this fraction of the simplification
+# tolerance, so quantization never shows next to the simplification itself
+QUANTIZE_FRACTION = 0.25
+# One transform origin for every file, so partitions can be merged by
+# concatenating their arcs
+TRANSLATE = (-180.0, -90.0)
+
+
+@dataclass(frozen=True)
+class ArcTopology:
+    """
+    Polygon layers cut into shared arcs, TopoJSON-style: a border between two
+    neighbours is stored once, and every ring is a list of arc references
+    (`~i` for arc i walked backwards). Simplifying the arcs instead of each
+    polygon keeps neighbours aligned, with no slivers to repair.
+    """
+    lon: np.ndarray                  # vertex coordinates
+    lat: np.ndarray
+    arcs: list[np.ndarray]           # vertex ids along each arc
+    geometries: list[list[list[list[int]]]]   # feature -> polygons -> rings -> arc refs
+    layers: dict[str, tuple[int, int]]        # [start, stop) feature positions of each input layer
+
+    def layer_geometries(self, layer: str) -> list:
+        start, stop = self.layers[layer]
+        return self.geometries[start:stop]
+
+
+def _ring_bounds(ring_of: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    starts = np.flatnonzero(np.r_[True, ring_of[1:] != ring_of[:-1]])
+    return starts, np.r_[starts[1:], len(ring_of)]
+
+
+def build_topology(layers: dict[str, np.ndarray]) -> ArcTopology:
+    """
+    Cut the polygons of every layer (name -> array of shapely geometries) into
+    shared arcs. A ring is cut wherever the set of rings using its edges
+    changes, so each arc runs along exactly one stretch of shared (or outer)
+    border and every ring using it sees the same vertices.
+    """
+    spans, start = {}, 0
+    for name, geoms in layers.items():
+        spans[name] = (start, start + len(geoms))
+        start += len(geoms)
+    geoms = np.concatenate([np.asarray(g, dtype=object) for g in layers.values()]) if layers else np.array([])
+
+    parts, feature_of_part = shapely.get_parts(geoms, return_index=True)
+    rings, part_of_ring = shapely.get_rings(parts, return_index=True)
+    is_shell = np.r_[True, part_of_ring[1:] != part_of_ring[:-1]]
+    xy, ring_of = shapely.get_coordinates(rings, return_index=True)
+
+    # Open the rings, snap, and drop vertices that repeat their predecessor
+    q = np.round(xy / SNAP_DEGREES).astype(np.int64)
+    key = (q[:, 0] + 2**28) * 2**29 + (q[:, 1] + 2**28)
+    keep = np.r_[ring_of[1:] == ring_of[:-1], False]
+    key, ring_of = key[keep], ring_of[keep]
+    while True:
+        starts, ends = _ring_bounds(ring_of)
+        prev = np.arange(len(key)) - 1
+        prev[starts] = ends - 1
+        repeat = key == key[prev]
+        repeat[starts] = False
+        repeat[ends - 1] |= key[ends - 1] == key[starts]
+        repeat[starts[ends - starts == 1]] = False
+        if not repeat.any():
+            break
+        key, ring_of = key[~repeat], ring_of[~repeat]
+    # Rings of fewer than three distinct vertices enclose nothing
+    starts, ends = _ring_bounds(ring_of)
+    small = np.repeat(ends - starts < 3, ends - starts)
+    key, ring_of = key[~small], ring_of[~small]
+    starts, ends = _ring_bounds(ring_of)
+
+    uniq, vid = np.unique(key, return_inverse=True)
+    vid = vid.astype(np.int64)
+    lon = ((uniq // 2**29) - 2**28) * SNAP_DEGREES
+    lat = ((uniq % 2**29) - 2**28) * SNAP_DEGREES
+    n = len(vid)
+    nxt = np.arange(n) + 1
+    nxt[ends - 1] = starts
+    prev = np.arange(n) - 1
+    prev[starts] = ends - 1
+
+    # Each undirected edge gets the sum of random hashes of the rings using it;
+    # a ring is cut where that owner signature changes
+    lo, hi = np.minimum(vid, vid[nxt]), np.maximum(vid, vid[nxt])
+    _, edge = np.unique(lo * len(uniq) + hi, return_inverse=True)
+    ring_hash = np.random.default_rng(0).integers(1, 2**63, size=len(rings), dtype=np.uint64)
+    owners = np.zeros(edge.max() + 1 if n else 0, dtype=np.uint64)
+    np.add.at(owners, edge, ring_hash[ring_of])
+    sig = owners[edge]
+    cut = sig != sig[prev]
+
+    # Orient shells counter-clockwise and holes clockwise (shoelace sign), so
+    # merged layers can tell their shells from their holes
+    x, y = lon[vid], lat[vid]
+    area = np.bincount(ring_of, weights=x * y[nxt] - x[nxt] * y, minlength=len(rings))
+    flip = np.where(is_shell, area < 0, area > 0)
+
+    arcs: list[np.ndarray] = []
+    index: dict[bytes, int] = {}
+
+    def ref(piece: np.ndarray) -> int:
+        fwd = piece.tobytes()
+        if fwd in index:
+            return index[fwd]
+        rev = piece[::-1].tobytes()
+        if rev in index:
+            return ~index[rev]
+        index[fwd] = len(arcs)
+        arcs.append(piece)
+        return len(arcs) - 1
+
+    geometries: list[list] = [[] for _ in range(len(geoms))]
+    current_part = -1
+    for s, e in zip(starts.tolist(), ends.tolist()):
+        r = int(ring_of[s])
+        v, c = vid[s:e], cut[s:e]
+        if flip[r]:
+            v, c = v[::-1], c[::-1]
+        c = np.flatnonzero(c)
+        if len(c) == 0:
+            # A ring with one owner set all round is a single closed arc,
+            # started at its lowest vertex so both users find the same one
+            k = int(np.argmin(v))
+            refs = [ref(np.r_[v[k:], v[:k], v[k]])]
+        else:
+            v = np.r_[v[c[0]:], v[:c[0]], v[c[0]]]
+            c = np.r_[c - c[0], len(v) - 1]
+            refs = [ref(v[c[i]:c[i + 1] + 1]) for i in range(len(c) - 1)]
+
+        part = int(part_of_ring[r])
+        feature = int(feature_of_part[part])
+        if is_shell[r]:
+            geometries[feature].append([refs])
+            current_part = part
+        elif current_part == part:
+            geometries[feature][-1].append(refs)
+
+    return ArcTopology(
+        lon=lon,
+        lat=lat,
+        arcs=arcs,
+        geometries=geometries,
+        layers=spans,
+    )
+
+
+def _signed_area(topo: ArcTopology, ring: list[int]) -> float:
+    x, y = _outline_xy(topo, ring)
+    return float(np.sum(x[:-1] * y[1:] - x[1:] * y[:-1])) / 2
+
+
+def merge_layer(topo: ArcTopology, layer: str, by, name: str) -> tuple[ArcTopology, np.ndarray]:
+    """
+    Add layer `name` with one feature per distinct `by` value, made by
+    merging that group's features of `layer` (e.g. counties from tracts).
+    Arcs used once within a group form its outline, so the merged borders
+    are the very arcs the source features use. Returns the new topology and
+    the group keys in feature order.
+    """
+    by = np.asarray(by)
+    keys, group = np.unique(by, return_inverse=True)
+    members: list[list] = [[] for _ in keys]
+    for g, polygons in zip(group.tolist(), topo.layer_geometries(layer)):
+        members[g].append(polygons)
+
+    merged = []
+    for features in members:
+        rings = _rings(features)
+        used: dict[int, int] = {}
+        for ring in rings:
+            for r in ring:
+                a = r if r >= 0 else ~r
+                used[a] = used.get(a, 0) + 1
+        # Walk the outline arcs in the direction their rings used them
+        outgoing: dict[int, list[int]] = {}
+        for ring in rings:
+            for r in ring:
+                if used[r if r >= 0 else ~r] == 1:
+                    arc = topo.arcs[r] if r >= 0 else topo.arcs[~r][::-1]
+                    outgoing.setdefault(int(arc[0]), []).append(r)
+        outlines = []
+        while outgoing:
+            start = next(iter(outgoing))
+            ring, at = [], start
+            while at in outgoing:
+                r = outgoing[at].pop()
+                if not outgoing[at]:
+                    del outgoing[at]
+                ring.append(r)
+                at = int(topo.arcs[r][-1] if r >= 0 else topo.arcs[~r][0])
+                if at == start:
+                    break
+            outlines.append(ring)
+
+        shells = [r for r in outlines if _signed_area(topo, r) > 0]
+        holes = [r for r in outlines if _signed_area(topo, r) <= 0]
+        polygons = [[r] for r in shells]
+        if holes and shells:
+            shapes = [shapely.Polygon(np.column_stack(_outline_xy(topo, r))) for r in shells]
+            for h in holes:
+                inside = shapely.Polygon(np.column_stack(_outline_xy(topo, h))).point_on_surface()
+                owner = next((i for i, p in enumerate(shapes) if p.contains(inside)), None)
+                if owner is not None:
+                    polygons[owner].append(h)
+        merged.append(polygons)
+
+    start = len(topo.geometries)
+    return ArcTopology(
+        lon=topo.lon,
+        lat=topo.lat,
+        arcs=topo.arcs,
+        geometries=topo.geometries + merged,
+        layers={**topo.layers, name: (start, start + len(merged))},
+    ), keys
+
+
+def _outline_xy(topo: ArcTopology, ring: list[int]) -> tuple[np.ndarray, np.ndarray]:
+    v = np.concatenate([topo.arcs[r] if r >= 0 else topo.arcs[~r][::-1] for r in ring])
+    return topo.lon[v], topo.lat[v]
+
+
+def _rings(geometries: list) -> list[list[int]]:
+    return [ring for polygons in geometries for rings in polygons for ring in rings]
+
+
+def _dedupe(xy: np.ndarray, arc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Drop points equal to the next one on their arc, keeping at least two per arc."""
+    drop = np.r_[(arc_ids[1:] == arc_ids[:-1]) & np.all(xy[1:] == xy[:-1], axis=1), False]
+    first = np.r_[True, arc_ids[1:] != arc_ids[:-1]]
+    kept = np.bincount(arc_ids[~drop], minlength=arc_ids.max() + 1)
+    drop &= ~(first & (kept[arc_ids] < 2))
+    return xy[~drop], arc_ids[~drop]
+
+
+def _arc_points_flat(topo: ArcTopology, tolerance: float, step: float | None) -> tuple[np.ndarray, np.ndarray]:
+    lengths = np.array([len(a) for a in topo.arcs])
+    flat = np.concatenate(topo.arcs)
+    ids = np.repeat(np.arange(len(topo.arcs)), lengths)
+    full = np.column_stack([topo.lon[flat], topo.lat[flat]])
+
+    def finish(xy: np.ndarray, arc_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if step is not None:
+            xy = np.round((xy - np.array(TRANSLATE)) / step).astype(np.int64)
+        return _dedupe(xy, arc_ids)
+
+    original = finish(full, ids)
+    if tolerance <= 0:
+        return original
+    lines = shapely.simplify(shapely.linestrings(full, indices=ids), tolerance, preserve_topology=True)
+    xy, arc_ids = finish(*shapely.get_coordinates(lines, return_index=True))
+
+    segments = np.bincount(arc_ids, minlength=len(topo.arcs)) - 1
+    revert = [
+        a for ring in _rings(topo.geometries)
+        if sum(segments[r if r >= 0 else ~r] for r in ring) < 3
+        for a in (r if r >= 0 else ~r for r in ring)
+    ]
+    if revert:
+        restore = np.isin(original[1], revert)
+        keep = ~np.isin(arc_ids, revert)
+        xy = np.concatenate([xy[keep], original[0][restore]])
+        arc_ids = np.concatenate([arc_ids[keep], original[1][restore]])
+        order = np.argsort(arc_ids, kind="stable")
+        xy, arc_ids = xy[order], arc_ids[order]
+    return xy, arc_ids
+
+
+def _arc_starts(arc_ids: np.ndarray) -> np.ndarray:
+    return np.flatnonzero(np.r_[True, arc_ids[1:] != arc_ids[:-1]])
+
+
+def arc_points(topo: ArcTopology, tolerance: float = 0.0, step: float | None = None) -> list[np.ndarray]:
+    """
+    Each arc's (lon, lat) points, Douglas-Peucker simplified by `tolerance`
+    degrees and, if `step` is given, quantized to integers on that grid
+    relative to TRANSLATE. Arcs of rings that would collapse below three
+    distinct points are kept at full detail.
+    """
+    if not topo.arcs:
+        return []
+    xy, arc_ids = _arc_points_flat(topo, tolerance, step)
+    return np.split(xy, _arc_starts(arc_ids)[1:])
+
+
+def _ring_coords(ring: list[int], points: list[np.ndarray]) -> np.ndarray:
+    walked = [points[r] if r >= 0 else points[~r][::-1] for r in ring]
+    return np.concatenate([walked[0]] + [w[1:] for w in walked[1:]])
+
+
+def topology_polygons(topo: ArcTopology, layer: str, tolerance: float = 0.0) -> np.ndarray:
+    """Rebuild a layer's (Multi)Polygons from its simplified shared arcs."""
+    points = arc_points(topo, tolerance)
+    out = []
+    for polygons in topo.layer_geometries(layer):
+        parts = []
+        for rings in polygons:
+            coords = [_ring_coords(r, points) for r in rings]
+            if len(coords[0]) >= 4:
+                parts.append(shapely.Polygon(coords[0], [c for c in coords[1:] if len(c) >= 4]))
+        if not parts:
+            out.append(None)
+        else:
+            out.append(parts[0] if len(parts) == 1 else shapely.MultiPolygon(parts))
+    return np.array(out, dtype=object)
+
+
+def _records(properties: pd.DataFrame) -> list[dict]:
+    # JSON has no NaN; missing values become null
+    return properties.astype(object).where(properties.notna(), None).to_dict("records")
+
+
+def to_topojson(topo: ArcTopology, properties: dict[str, pd.DataFrame], tolerance: float) -> dict:
+    """
+    Encode the topology as TopoJSON with one GeometryCollection per layer:
+    arcs simplified by `tolerance` degrees, then quantized and delta-encoded.
+    `properties` holds one frame per layer, row-aligned with its features.
+    """
+    step = tolerance * QUANTIZE_FRACTION if tolerance > 0 else SNAP_DEGREES
+    arcs = []
+    if topo.arcs:
+        xy, arc_ids = _arc_points_flat(topo, tolerance, step)
+        starts = _arc_starts(arc_ids)
+        # Delta-encode: each point relative to the previous one on its arc
+        deltas = xy.copy()
+        deltas[1:] -= xy[:-1]
+        deltas[starts] = xy[starts]
+        flat = deltas.tolist()
+        arcs = [flat[a:b] for a, b in zip(starts.tolist(), np.r_[starts[1:], len(flat)].tolist())]
+
+    objects = {}
+    for layer, props in properties.items():
+        geometries = []
+        for polygons, record in zip(topo.layer_geometries(layer), _records(props)):
+            if not polygons:
+                geometries.append({"type": None, "properties": record})
+            elif len(polygons) == 1:
+                geometries.append({"type": "Polygon", "arcs": polygons[0], "properties": record})
+            else:
+                geometries.append({"type": "MultiPolygon", "arcs": polygons, "properties": record})
+        objects[layer] = {"type": "GeometryCollection", "geometries": geometries}
+    return {
+        "type": "Topology",
+        "transform": {"scale": [step, step], "translate": list(TRANSLATE)},
+        "objects": objects,
+        "arcs": arcs,
+    }
+
+
+# Reading side: the app keeps TopoJSON as-is and only narrows or merges it.
+
+def _geometry_rings(geometry: dict) -> list[list[int]]:
+    if geometry.get("type") == "Polygon":
+        return geometry["arcs"]
+    if geometry.get("type") == "MultiPolygon":
+        return [ring for polygon in geometry["arcs"] for ring in polygon]
+    return []
+
+
+def _remap(geometry: dict, mapping) -> dict:
+    def ring(refs):
+        return [mapping[r] if r >= 0 else ~mapping[~r] for r in refs]
+    if geometry.get("type") == "Polygon":
+        return {**geometry, "arcs": [ring(r) for r in geometry["arcs"]]}
+    if geometry.get("type") == "MultiPolygon":
+        return {**geometry, "arcs": [[ring(r) for r in p] for p in geometry["arcs"]]}
+    return geometry
+
+
+def subset_topology(topology: dict, object_name: str, positions=None) -> dict:
+    """
+    A topology holding only `object_name` (narrowed to `positions` if given)
+    and only the arcs it uses, renumbered.
+    """
+    geometries = topology["objects"][object_name]["geometries"]
+    if positions is not None:
+        geometries = [geometries[i] for i in positions]
+    used = sorted({r if r >= 0 else ~r for g in geometries for ring in _geometry_rings(g) for r in ring})
+    mapping = {old: new for new, old in enumerate(used)}
+    return {
+        "type": "Topology",
+        "transform": topology["transform"],
+        "objects": {object_name: {"type": "GeometryCollection",
+                                  "geometries": [_remap(g, mapping) for g in geometries]}},
+        "arcs": [topology["arcs"][i] for i in used],
+    }
+
+
+def merge_topologies(topologies: list[dict], object_name: str) -> dict:
+    """Concatenate one object across topologies that share a transform."""
+    if len(topologies) == 1:
+        return topologies[0]
+    transform = topologies[0]["transform"]
+    arcs, geometries = [], []
+    for t in topologies:
+        if t["transform"] != transform:
+            raise ValueError("Topologies with different transforms can't be merged")
+        offset = len(arcs)
+        mapping = range(offset, offset + len(t["arcs"]))
+        geometries.extend(_remap(g, mapping) for g in t["objects"][object_name]["geometries"])
+        arcs.extend(t["arcs"])
+    return {
+        "type": "Topology",
+        "transform": transform,
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": geometries}},
+        "arcs": arcs,
+    }
+
+
+def topology_bounds(topology: dict, object_name: str) -> np.ndarray:
+    """(minx, miny, maxx, maxy) of each geometry of `object_name`; NaN if empty."""
+    geometries = topology["objects"][object_name]["geometries"]
+    out = np.full((len(geometries), 4), np.nan)
+    arcs = topology["arcs"]
+    if not arcs:
+        return out
+    lengths = np.array([len(a) for a in arcs])
+    deltas = np.array(list(chain.from_iterable(arcs)), dtype=np.int64).reshape(-1, 2)
+    # Undo the delta encoding arc by arc
+    total = np.cumsum(deltas, axis=0)
+    first = np.r_[0, np.cumsum(lengths)[:-1]]
+    base = np.r_[np.zeros((1, 2), np.int64), total[first[1:] - 1]]
+    absolute = total - np.repeat(base, lengths, axis=0)
+    lo = np.minimum.reduceat(absolute, first)
+    hi = np.maximum.reduceat(absolute, first)
+
+    refs = [[r if r >= 0 else ~r for ring in _geometry_rings(g) for r in ring] for g in geometries]
+    counts = np.array([len(r) for r in refs])
+    has = counts > 0
+    if has.any():
+        flat = np.fromiter(chain.from_iterable(refs), dtype=np.int64, count=int(counts.sum()))
+        starts = np.r_[0, np.cumsum(counts[has])[:-1]]
+        scale = np.array(topology["transform"]["scale"], float)
+        translate = np.array(topology["transform"]["translate"], float)
+        out[has, :2] = np.minimum.reduceat(lo[flat], starts) * scale + translate
+        out[has, 2:] = np.maximum.reduceat(hi[flat], starts) * scale + translate
+    return out
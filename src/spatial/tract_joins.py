@@ -1,6 +1,12 @@
 from __future__ import annotations
+from pathlib import Path
+import os
 import geopandas as gpd
+import numpy as np
 import pandas as pd
+import shapely
+
+CACHE_COLUMNS = ["osm_id", "lat", "lon", "GEOID", "geometry_version"]
 
 def points_to_gdf(df: pd.DataFrame, crs: str = "EPSG:4326") -> gpd.GeoDataFrame:
     return gpd.GeoDataFrame(
@@ -16,3 +22,49 @@ def spatial_join_points_to_tracts(points_gdf: gpd.GeoDataFrame, tracts_gdf: gpd.
     if "index_right" in joined.columns:
         joined = joined.drop(columns=["index_right"])
     return joined
+
+
+def locate_points(lon: np.ndarray, lat: np.ndarray, tracts: gpd.GeoDataFrame) -> np.ndarray:
+    """
+    GEOID of the tract containing each point (None outside every tract), from
+    one batched STRtree query against prepared tract polygons. A point exactly
+    on a shared border touches both tracts and goes to the first in `tracts`.
+    """
+    geoms = tracts.geometry.to_numpy()
+    shapely.prepare(geoms)
+    tree = shapely.STRtree(geoms)
+    pts, hits = tree.query(shapely.points(lon, lat), predicate="intersects")
+    order = np.lexsort((hits, pts))
+    pts, hits = pts[order], hits[order]
+    first = np.unique(pts, return_index=True)[1]
+    geoid = np.full(len(lon), None, dtype=object)
+    geoid[pts[first]] = tracts["GEOID"].to_numpy(object)[hits[first]]
+    return geoid
+
+
+def assign_tracts_cached(points: pd.DataFrame, tracts: gpd.GeoDataFrame, cache_path: Path,
+                         geometry_version: str) -> pd.DataFrame:
+    """
+    `points` (osm_id, lat, lon, ...) with the GEOID of the tract each falls
+    in. Assignments are cached by osm_id with the point's coordinates and the
+    tract geometry version, so only new or moved points (or all of them, after
+    the tracts change) are located again. `tracts` should be full resolution:
+    simplified borders put points near them in the wrong tract.
+    """
+    pts = points.drop_duplicates("osm_id")[["osm_id", "lat", "lon"]]
+    cached = pd.read_parquet(cache_path) if cache_path.exists() else pd.DataFrame(columns=CACHE_COLUMNS)
+    cached = cached[cached["geometry_version"] == geometry_version]
+    merged = pts.merge(cached, on="osm_id", how="left", suffixes=("", "_cached"))
+    fresh = (merged["lat"] == merged["lat_cached"]) & (merged["lon"] == merged["lon_cached"])
+    todo = merged.loc[~fresh]
+    merged.loc[~fresh, "GEOID"] = locate_points(todo["lon"].to_numpy(float), todo["lat"].to_numpy(float), tracts)
+    merged["geometry_version"] = geometry_version
+    print(f"   tract assignment: {int((~fresh).sum())} points located, {int(fresh.sum())} reused from cache")
+
+    # Only currently fetched points are kept, so the cache never outgrows the data
+    out = merged[CACHE_COLUMNS]
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache_path.with_name(cache_path.name + ".tmp")
+    out.to_parquet(tmp, index=False)
+    os.replace(tmp, cache_path)
+    return points.merge(out[["osm_id", "GEOID"]], on="osm_id", how="left")
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import math
+import numpy as np
+import geopandas as gpd
+import pandas as pd
+import shapely
+
+from src.ingest.fetch_osm_outlets import BoundingBox
+
+
+def bounds_from_folium(bounds: dict | None) -> BoundingBox | None:
+    """Parse the `bounds` dict st_folium returns into a BoundingBox."""
+    if not bounds:
+        return None
+    sw, ne = bounds.get("_southWest") or {}, bounds.get("_northEast") or {}
+    vals = [sw.get("lat"), sw.get("lng"), ne.get("lat"), ne.get("lng")]
+    if any(v is None for v in vals):
+        return None
+    return BoundingBox(south=vals[0], west=vals[1], north=vals[2], east=vals[3])
+
+
+def padded_view(bbox: BoundingBox, margin: float = 0.5) -> BoundingBox:
+    """
+    Grow `bbox` by `margin` × its size on every side, then snap outward to a
+    power-of-two degree grid. Small pans stay inside the same snapped box, so
+    the selected features (and the map HTML) don't change until the user moves
+    past the margin.
+    """
+    span = max(bbox.north - bbox.south, bbox.east - bbox.west, 1e-6)
+    step = 2.0 ** math.floor(math.log2(span))
+    pad = span * margin
+    return BoundingBox(
+        south=max(math.floor((bbox.south - pad) / step) * step, -90.0),
+        west=math.floor((bbox.west - pad) / step) * step,
+        north=min(math.ceil((bbox.north + pad) / step) * step, 90.0),
+        east=math.ceil((bbox.east + pad) / step) * step,
+    )
+
+
+class ViewportIndex:
+    """STRtree over a layer's geometries, answering "which rows are in view"."""
+
+    def __init__(self, geometries):
+        self.tree = shapely.STRtree(np.asarray(geometries))
+
+    @classmethod
+    def from_frame(cls, gdf: gpd.GeoDataFrame) -> "ViewportIndex":
+        return cls(gdf.geometry.values)
+
+    @classmethod
+    def from_bounds(cls, bounds: pd.DataFrame) -> "ViewportIndex":
+        """One box per row of (minx, miny, maxx, maxy); NaN rows never match."""
+        b = bounds.to_numpy(float)
+        ok = np.isfinite(b).all(axis=1)
+        boxes = np.full(len(b), None, dtype=object)
+        boxes[ok] = shapely.box(*b[ok].T)
+        return cls(boxes)
+
+    @classmethod
+    def from_points(cls, df: pd.DataFrame) -> "ViewportIndex":
+        lon, lat = (df[c].to_numpy(float, na_value=np.nan) for c in ("lon", "lat"))
+        return cls(shapely.points(lon, lat))
+
+    def query(self, bbox: BoundingBox) -> np.ndarray:
+        """Sorted row positions whose geometry intersects `bbox`."""
+        window = shapely.box(bbox.west, bbox.south, bbox.east, bbox.north)
+        return np.sort(self.tree.query(window, predicate="intersects"))
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from collections import OrderedDict
+from pathlib import Path
+from typing import Hashable
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+# The build keeps an uncompressed Arrow IPC copy (x.arrow) of each table the app
+# reads (x.parquet). Parquet has to be decoded into fresh memory by every
+# reader; an IPC file can be memory-mapped, so one process maps it once and all
+# sessions read the same pages from the OS page cache.
+ARROW_SUFFIX = ".arrow"
+
+
+def arrow_path(parquet_path: Path) -> Path:
+    return parquet_path.with_suffix(ARROW_SUFFIX)
+
+
+def write_arrow_copy(parquet_path: Path) -> Path:
+    """
+    Write the IPC copy of a parquet file. It goes to a temporary file that is
+    renamed into place, so a process that has the old copy mapped keeps
+    reading the old data rather than a half-written file.
+    """
+    table = pq.read_table(parquet_path)
+    path = arrow_path(parquet_path)
+    tmp = path.with_name(path.name + ".tmp")
+    with ipc.new_file(tmp, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, path)
+    return path
+
+
+def map_table(path: Path) -> pa.Table:
+    """Zero-copy table over a memory-mapped IPC file."""
+    return ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+class Snapshot:
+    """
+    The tables of some partitions as of one build version. Every IPC copy is
+    mapped when the snapshot is made, so a session holding it sees one
+    consistent build even while a rebuild replaces files. Tables and frames
+    are shared between sessions: treat them as read-only.
+    """
+
+    def __init__(self, version: Hashable, partitions: list[Path]):
+        self.version = version
+        self.partitions = partitions
+        self._lock = threading.Lock()
+        self._tables: dict[str, pa.Table] = {}
+        self._frames: dict[str, pd.DataFrame] = {}
+        # Only tables every partition has an IPC copy of; the rest are read on demand
+        mapped = [{p.with_suffix(".parquet").name: p for p in d.glob(f"*{ARROW_SUFFIX}")} for d in partitions]
+        for name in set.intersection(*(set(m) for m in mapped)):
+            self._tables[name] = _concat([map_table(m[name]) for m in mapped])
+
+    def table(self, name: str) -> pa.Table:
+        """`name` is the parquet file name; falls back to reading it if there is no IPC copy."""
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = _concat([pq.read_table(d / name) for d in self.partitions])
+            return self._tables[name]
+
+    def frame(self, name: str) -> pd.DataFrame:
+        """The table as a DataFrame whose columns are views of the Arrow buffers (no copy)."""
+        table = self.table(name)
+        with self._lock:
+            if name not in self._frames:
+                self._frames[name] = table.to_pandas(types_mapper=pd.ArrowDtype)
+            return self._frames[name]
+
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(t.nbytes for t in self._tables.values())
+
+
+def _concat(tables: list[pa.Table]) -> pa.Table:
+    return tables[0] if len(tables) == 1 else pa.concat_tables(tables, promote_options="default")
+
+
+class ArrowStore:
+    """
+    One per process: hands every caller the current Snapshot for a set of
+    partitions. A new build version swaps in a new snapshot atomically; callers
+    still holding the old one are unaffected, and its mappings are released
+    once the last of them is done with it. Only the `max_snapshots` most
+    recently used keys are kept.
+    """
+
+    def __init__(self, max_snapshots: int = 8):
+        self.max_snapshots = max_snapshots
+        self._lock = threading.Lock()
+        self._snapshots: OrderedDict[Hashable, Snapshot] = OrderedDict()
+
+    def snapshot(self, key: Hashable, version: Hashable, partitions: list[Path]) -> Snapshot:
+        with self._lock:
+            current = self._snapshots.get(key)
+            if current is not None and current.version == version:
+                self._snapshots.move_to_end(key)
+                return current
+        fresh = Snapshot(version, partitions)
+        with self._lock:
+            self._snapshots[key] = fresh
+            self._snapshots.move_to_end(key)
+            while len(self._snapshots) > self.max_snapshots:
+                self._snapshots.popitem(last=False)
+        return fresh
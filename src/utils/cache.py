@@ -1,6 +1,7 @@
 from __future__ import annotations
 from pathlib import Path
 import hashlib
+import json
 
 def ensure_dir(p: Path) -> Path:
     p.mkdir(parents=True, exist_ok=True)
@@ -15,3 +16,22 @@ def file_sha256(path: Path, chunk_size: int = 1024 * 1024) -> str:
                 break
             h.update(chunk)
     return h.hexdigest()
+
+def memo_sha256(path: Path) -> str:
+    """
+    file_sha256, remembered in a `<name>.sha256.json` file beside `path` for as
+    long as its size and mtime are unchanged. For large raw inputs, where
+    hashing would dominate a build that has nothing to do.
+    """
+    memo_path = path.with_name(path.name + ".sha256.json")
+    st = path.stat()
+    stamp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    try:
+        memo = json.loads(memo_path.read_text())
+    except (OSError, ValueError):
+        memo = {}
+    if memo.get("stamp") == stamp:
+        return memo["sha256"]
+    digest = file_sha256(path)
+    memo_path.write_text(json.dumps({"stamp": stamp, "sha256": digest}))
+    return digest
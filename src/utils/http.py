@@ -0,0 +1,58 @@
+from __future__ import annotations
+from pathlib import Path
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+POOL_SIZE = 8
+
+_local = threading.local()
+
+
+def get_session(retries: bool = True) -> requests.Session:
+    """
+    Return a pooled `requests.Session` for the calling thread. Sessions are not
+    safe to share across threads, so each worker thread gets its own, and every
+    request it makes reuses that session's keep-alive connections.
+
+    Pass `retries=False` when the caller fails over on its own (e.g. hedged
+    mirror requests), so a bad endpoint isn't retried with backoff first.
+    """
+    attr = "session" if retries else "session_no_retry"
+    session = getattr(_local, attr, None)
+    if session is None:
+        session = requests.Session()
+        retry = Retry(
+            total=3 if retries else 0,
+            backoff_factor=1.0,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        setattr(_local, attr, session)
+    return session
+
+
+def stream_to_file(url: str, out: Path, desc: str | None = None, timeout: int = 120) -> Path:
+    tmp = out.with_suffix(out.suffix + ".part")
+    try:
+        with get_session().get(url, stream=True, timeout=timeout) as r:
+            r.raise_for_status()
+            total = int(r.headers.get("Content-Length", 0)) or None
+            with tmp.open("wb") as f, tqdm(
+                total=total, unit="B", unit_scale=True, desc=desc or out.name, leave=False
+            ) as bar:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    if chunk:
+                        f.write(chunk)
+                        bar.update(len(chunk))
+        tmp.replace(out)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return out
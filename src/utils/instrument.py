@@ -0,0 +1,128 @@
+from __future__ import annotations
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, asdict
+from typing import Iterator
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:          # Windows
+    resource = None
+
+# Measurements taken while a `collect()` block is open land in its list.
+# ContextVar keeps concurrent Streamlit sessions (one thread each) apart.
+_records: ContextVar[list | None] = ContextVar("instrument_records", default=None)
+
+
+@dataclass
+class Measurement:
+    """
+    One timed step. `rows` and `bytes` are filled in by whoever knows them
+    (rows written, payload size); memory fields are None when not measured.
+    """
+    name: str
+    seconds: float = 0.0
+    rows: int | None = None
+    bytes: int | None = None
+    max_rss_mb: float | None = None
+    traced_peak_mb: float | None = None
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+def max_rss_mb() -> float | None:
+    """Process high-water mark of resident memory so far (it never goes down)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+
+@contextmanager
+def measure(name: str, trace_memory: bool = False) -> Iterator[Measurement]:
+    """
+    Time the block and note the process's peak RSS afterwards. With
+    `trace_memory`, also record the peak of memory allocated inside the block
+    (Python objects and NumPy buffers) through tracemalloc, which is exact but
+    slows allocation-heavy code down noticeably.
+    """
+    m = Measurement(name)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if trace_memory:
+        tracemalloc.reset_peak()
+    t0 = time.perf_counter()
+    try:
+        yield m
+    finally:
+        m.seconds = round(time.perf_counter() - t0, 4)
+        if trace_memory:
+            m.traced_peak_mb = round(tracemalloc.get_traced_memory()[1] / 2**20, 1)
+        if started_tracing:
+            tracemalloc.stop()
+        m.max_rss_mb = max_rss_mb()
+        records = _records.get()
+        if records is not None:
+            records.append(m)
+
+
+@contextmanager
+def collect() -> Iterator[list[Measurement]]:
+    """Gather every measurement taken in this context (e.g. one app rerun)."""
+    records: list[Measurement] = []
+    token = _records.set(records)
+    try:
+        yield records
+    finally:
+        _records.reset(token)
+
+
+def payload_size(element) -> tuple[int | None, int | None]:
+    """(rows, bytes) of the data a folium element ships to the browser."""
+    data = getattr(element, "data", None)
+    rows = getattr(element, "rows", None)
+    if isinstance(data, dict):
+        if "features" in data:
+            rows = len(data["features"])
+        elif "objects" in data:          # TopoJSON
+            rows = sum(len(o.get("geometries", ())) for o in data["objects"].values())
+        else:
+            rows = len(data.get("lat", ()))
+    data_json = getattr(element, "data_json", None)
+    if isinstance(data_json, str):       # shipped pre-serialised
+        return rows, len(data_json)
+    urls = getattr(element, "urls", None)
+    if urls:                             # fetched by the browser; only the URLs are in the page
+        return None, sum(len(u) for u in urls)
+    if isinstance(data, dict):
+        return rows, len(json.dumps(data, separators=(",", ":"), default=str))
+    url = getattr(element, "url", None)
+    if isinstance(url, str):
+        return 1, len(url)
+    return None, None
+
+
+def instrumented(fn):
+    """
+    Measure a layer builder that returns the folium element it added. Costs
+    nothing unless a `collect()` block is open; the payload is sized after the
+    clock stops so serialising it for the count isn't billed to the builder.
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if _records.get() is None:
+            return fn(*args, **kwargs)
+        with measure(fn.__name__) as m:
+            element = fn(*args, **kwargs)
+        m.name = f"{fn.__name__}: {getattr(element, 'layer_name', None) or fn.__name__}"
+        m.rows, m.bytes = payload_size(element)
+        return element
+    return wrapper
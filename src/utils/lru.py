@@ -0,0 +1,76 @@
+from __future__ import annotations
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+import threading
+
+
+@dataclass(frozen=True)
+class LruStats:
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    evictions: int
+
+
+class ByteLRU:
+    """
+    A least-recently-used cache of str/bytes values bounded by their total
+    size rather than their count. Safe to share between threads (Streamlit
+    runs each session's script in its own thread).
+
+    A value bigger than the whole budget is returned but not kept.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[Hashable, str | bytes] = OrderedDict()
+        self._bytes = 0
+        self._hits = self._misses = self._evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> str | bytes | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self._misses += 1
+                return None
+            self._items.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: Hashable, value: str | bytes) -> None:
+        size = len(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            if size > self.max_bytes:
+                return
+            self._items[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self._evictions += 1
+
+    def get_or_set(self, key: Hashable, build: Callable[[], str | bytes]) -> str | bytes:
+        # Built outside the lock: two sessions missing the same key at once both
+        # build it, which is cheaper than making every other key wait.
+        value = self.get(key)
+        if value is None:
+            value = build()
+            self.put(key, value)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> LruStats:
+        with self._lock:
+            return LruStats(len(self._items), self._bytes, self.max_bytes,
+                            self._hits, self._misses, self._evictions)
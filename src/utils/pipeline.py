@@ -0,0 +1,241 @@
+from __future__ import annotations
+from pathlib import Path
+from dataclasses import dataclass, field
+from typing import Callable
+from datetime import datetime, timezone
+import json
+import pyarrow.parquet as pq
+
+from src.utils.cache import file_sha256, memo_sha256
+from src.utils.instrument import Measurement, measure
+
+MANIFEST_VERSION = 1
+# Raw inputs at least this big (the USDA CSV, road extracts) are hashed once
+# and then recognised by size and mtime, so a warm build doesn't re-read them
+MEMO_HASH_BYTES = 32 * 2**20
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    One step of the build. A stage declares the files it reads and the files it
+    writes; it is skipped when its outputs exist and the content hashes of its
+    inputs (and its params) match what the manifest recorded on the last run.
+    `network` marks I/O-bound download stages that may run concurrently.
+    """
+    name: str
+    run: Callable[[], None]
+    inputs: tuple[Path, ...] = ()
+    outputs: tuple[Path, ...] = ()
+    params: dict = field(default_factory=dict)
+    network: bool = False
+
+
+def toposort_stages(stages: list[Stage]) -> list[Stage]:
+    producers: dict[Path, str] = {}
+    for s in stages:
+        for out in s.outputs:
+            if out in producers:
+                raise ValueError(f"{out} is produced by both {producers[out]} and {s.name}")
+            producers[out] = s.name
+
+    by_name = {s.name: s for s in stages}
+    deps = {
+        s.name: {producers[p] for p in s.inputs if p in producers and producers[p] != s.name}
+        for s in stages
+    }
+
+    ordered: list[Stage] = []
+    done: set[str] = set()
+    visiting: set[str] = set()
+
+    def visit(name: str) -> None:
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle through stage {name}")
+        visiting.add(name)
+        for d in sorted(deps[name], key=list(by_name).index):
+            visit(d)
+        visiting.discard(name)
+        done.add(name)
+        ordered.append(by_name[name])
+
+    for s in stages:
+        visit(s.name)
+    return ordered
+
+
+def load_manifest(path: Path) -> dict:
+    if not path.exists():
+        return {"version": MANIFEST_VERSION, "stages": {}}
+    data = json.loads(path.read_text())
+    if data.get("version") != MANIFEST_VERSION:
+        return {"version": MANIFEST_VERSION, "stages": {}}
+    return data
+
+
+def _hash_files(paths: tuple[Path, ...]) -> dict[str, str | None]:
+    return {str(p): (file_sha256(p) if p.exists() else None) for p in paths}
+
+
+def _hash_inputs(paths: tuple[Path, ...], produced: set[Path]) -> dict[str, str | None]:
+    """Like _hash_files, but large inputs no stage produces use the memoized digest."""
+    def digest(p: Path) -> str | None:
+        if not p.exists():
+            return None
+        if p not in produced and p.stat().st_size >= MEMO_HASH_BYTES:
+            return memo_sha256(p)
+        return file_sha256(p)
+    return {str(p): digest(p) for p in paths}
+
+
+def _is_fresh(stage: Stage, record: dict | None, input_hashes: dict) -> bool:
+    if record is None:
+        return False
+    if not all(p.exists() for p in stage.outputs):
+        return False
+    # round-trip params through JSON so tuples compare equal to stored lists
+    params = json.loads(json.dumps(stage.params))
+    return record.get("inputs") == input_hashes and record.get("params") == params
+
+
+def _record(manifest: dict, manifest_path: Path, stage: Stage, input_hashes: dict) -> None:
+    missing = [str(p) for p in stage.outputs if not p.exists()]
+    if missing:
+        raise FileNotFoundError(f"Stage {stage.name} did not write {missing}")
+
+    manifest["stages"][stage.name] = {
+        "inputs": input_hashes,
+        "outputs": _hash_files(stage.outputs),
+        "params": stage.params,
+    }
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest_path.write_text(json.dumps(manifest, indent=2))
+
+
+def _output_stats(paths: tuple[Path, ...]) -> dict[str, dict]:
+    stats = {}
+    for p in paths:
+        if not p.exists():
+            continue
+        entry = {"bytes": p.stat().st_size}
+        if p.suffix == ".parquet":
+            entry["rows"] = pq.read_metadata(p).num_rows
+        stats[p.name] = entry
+    return stats
+
+
+def _run_entry(stage: Stage, m: Measurement) -> dict:
+    outputs = _output_stats(stage.outputs)
+    m.bytes = sum(o["bytes"] for o in outputs.values())
+    rows = [o["rows"] for o in outputs.values() if "rows" in o]
+    m.rows = sum(rows) if rows else None
+    return {"status": "ran", **m.as_dict(), "outputs": outputs}
+
+
+def _write_run(run: dict, path: Path | None) -> None:
+    if path is None:
+        return
+    run["finished"] = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(run, indent=2))
+
+
+def run_pipeline(
+    stages: list[Stage],
+    manifest_path: Path,
+    force: set[str] | None = None,
+    runner: Callable[[dict[str, Callable[[], None]]], object] | None = None,
+    run_path: Path | None = None,
+    trace_memory: bool = False,
+) -> dict:
+    """
+    Run `stages` in dependency order, skipping any whose inputs are unchanged.
+    `force` names stages to re-run regardless; an empty set forces every stage.
+    If `runner` is given, stale `network` stages with no upstream stage are
+    handed to it together (e.g. a thread pool) before the rest run in order.
+    The manifest is rewritten after each stage so an interrupted build resumes.
+
+    Each stage that runs is timed; if `run_path` is given, this run's timings,
+    peak memory and output sizes/row counts are written there as JSON (see
+    src/utils/instrument.py; `trace_memory` adds tracemalloc peaks). Skipped
+    stages carry the entry from the run that last built them.
+    """
+    previous = {}
+    if run_path is not None and run_path.exists():
+        previous = json.loads(run_path.read_text()).get("stages", {})
+    run = {
+        "started": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "trace_memory": trace_memory,
+        "stages": {},
+    }
+    manifest = load_manifest(manifest_path)
+    records = manifest["stages"]
+    ordered = toposort_stages(stages)
+    produced = {p for s in stages for p in s.outputs}
+
+    def needs_run(stage: Stage, input_hashes: dict) -> bool:
+        forced = force is not None and (not force or stage.name in force)
+        return forced or not _is_fresh(stage, records.get(stage.name), input_hashes)
+
+    done: set[str] = set()
+    if runner is not None:
+        batch = {}
+        for stage in ordered:
+            if not stage.network or any(p in produced for p in stage.inputs):
+                continue
+            input_hashes = _hash_inputs(stage.inputs, produced)
+            if needs_run(stage, input_hashes):
+                batch[stage.name] = (stage, input_hashes)
+        if batch:
+            finished: set[str] = set()
+
+            timings: dict[str, Measurement] = {}
+
+            def job(stage: Stage) -> Callable[[], None]:
+                def _run() -> None:
+                    # concurrent downloads share one process, so no memory tracing here
+                    with measure(stage.name) as m:
+                        stage.run()
+                    timings[stage.name] = m
+                    finished.add(stage.name)
+                return _run
+
+            try:
+                runner({name: job(stage) for name, (stage, _) in batch.items()})
+            finally:
+                # record whatever finished so a failed source doesn't redo the others
+                for name in finished:
+                    stage, input_hashes = batch[name]
+                    _record(manifest, manifest_path, stage, input_hashes)
+                    run["stages"][name] = _run_entry(stage, timings[name])
+                _write_run(run, run_path)
+            done.update(batch)
+
+    for stage in ordered:
+        if stage.name in done:
+            continue
+        input_hashes = _hash_inputs(stage.inputs, produced)
+        if not needs_run(stage, input_hashes):
+            print(f"-- {stage.name}: up to date, skipped")
+            # keep the numbers from the run that actually built the outputs
+            last = previous.get(stage.name, {})
+            last = last if last.get("status") == "ran" else last.get("last_run")
+            run["stages"][stage.name] = {"status": "skipped", "last_run": last}
+            continue
+
+        try:
+            with measure(stage.name, trace_memory=trace_memory) as m:
+                stage.run()
+        except BaseException:
+            run["stages"][stage.name] = {"status": "failed", **m.as_dict()}
+            _write_run(run, run_path)
+            raise
+        _record(manifest, manifest_path, stage, input_hashes)
+        run["stages"][stage.name] = _run_entry(stage, m)
+        print(f"-- {stage.name}: {m.seconds:.1f}s, peak RSS {m.max_rss_mb} MB")
+        _write_run(run, run_path)
+
+    _write_run(run, run_path)
+    return manifest
@@ -0,0 +1,137 @@
+from __future__ import annotations
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+
+import src.ingest.fetch_osm_outlets as osm
+from src.ingest.mirrors import EWMA_ALPHA, MIN_HEDGE_AFTER, MirrorHealth, hedged_fetch
+
+CSV_BODY = ("\t".join(osm.OVERPASS_CSV_HEADER) + "\nnode\t1\t35.0\t-79.0\t{name}\t\t\n")
+
+
+def _serve(status: int = 200, body: str = "", delay: float = 0.0):
+    """A local stand-in for an Overpass mirror; returns (server, url)."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(delay)
+            data = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/api/interpreter"
+
+
+@pytest.fixture
+def health(tmp_path, monkeypatch):
+    h = MirrorHealth(tmp_path / "mirrors.json")
+    monkeypatch.setattr(osm, "_health", h)
+    return h
+
+
+@pytest.fixture
+def mirrors():
+    servers = []
+
+    def start(**kw):
+        server, url = _serve(**kw)
+        servers.append(server)
+        return url
+
+    yield start
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+
+
+def test_slow_primary_loses_to_hedge(tmp_path, health, mirrors):
+    slow = mirrors(body=CSV_BODY.format(name="slow"), delay=1.0)
+    fast = mirrors(body=CSV_BODY.format(name="fast"))
+    out = tmp_path / "tile.tsv"
+
+    osm._fetch_overpass("query", out, urls=[slow, fast], hedge_after=0.2)
+
+    assert "fast" in out.read_text()
+    assert health.stats[fast]["ok"] == 1
+    assert health.stats[slow]["ok"] == 0 and health.stats[slow]["latency"] >= 0.2
+    # The slow mirror answers after the race is decided; its partial file goes
+    time.sleep(1.5)
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_every_mirror_failing(tmp_path, health, mirrors):
+    broken = mirrors(status=500, body="busy")
+    html = mirrors(body="<html>rate limited</html>")
+    out = tmp_path / "tile.tsv"
+
+    with pytest.raises(RuntimeError, match="All mirrors failed"):
+        osm._fetch_overpass("query", out, urls=[broken, html], hedge_after=5.0)
+
+    assert health.stats[broken]["fail"] == 1 and health.stats[html]["fail"] == 1
+    assert not out.exists()
+    assert not list(tmp_path.glob("*.part"))
+
+
+def test_late_winner_is_discarded(tmp_path):
+    discarded = []
+
+    def attempt(url, cancel):
+        if url == "slow":
+            time.sleep(0.3)     # ignores `cancel` and finishes anyway
+        return url
+
+    result = hedged_fetch(["slow", "fast"], attempt, MirrorHealth(), hedge_after=0.05,
+                          discard=discarded.append)
+    time.sleep(0.5)
+    assert result == "fast"
+    assert discarded == ["slow"]
+
+
+def test_health_persists_and_reorders(tmp_path):
+    path = tmp_path / "mirrors.json"
+    h = MirrorHealth(path)
+    h.record_success("a", 10.0)
+    h.record_success("b", 1.0)
+    h.record_success("b", 3.0)
+    assert h.stats["b"]["latency"] == pytest.approx((1 - EWMA_ALPHA) * 1.0 + EWMA_ALPHA * 3.0)
+    assert h.ranked(["a", "b", "c"]) == ["b", "a", "c"]
+
+    reloaded = MirrorHealth(path)
+    assert reloaded.stats == h.stats
+    assert reloaded.ranked(["a", "b"]) == ["b", "a"]
+    assert reloaded.hedge_after("a") == pytest.approx(20.0)
+    assert reloaded.hedge_after("b") == MIN_HEDGE_AFTER
+
+    # A recent failure sends the fastest mirror to the back
+    reloaded.record_failure("b")
+    assert MirrorHealth(path).ranked(["a", "b"]) == ["a", "b"]
+
+
+def test_shared_health_file_merges_writers(tmp_path):
+    path = tmp_path / "mirrors.json"
+    first, second = MirrorHealth(path), MirrorHealth(path)
+    first.record_success("a", 1.0)
+    second.record_success("b", 2.0)
+    second.record_failure("a")
+    stats = MirrorHealth(path).stats
+    assert stats["a"]["ok"] == 1 and stats["a"]["fail"] == 1
+    assert stats["b"]["ok"] == 1
+    assert list(tmp_path.glob("*.tmp")) == []
+
+
+def test_failed_health_write_does_not_fail_fetch(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    h = MirrorHealth(blocker / "mirrors.json")   # its parent is a file, so every save fails
+    assert hedged_fetch(["a"], lambda url, cancel: url, h) == "a"
+    assert h.stats["a"]["ok"] == 1